@@ -3,6 +3,8 @@ import os
 import fnmatch
 from glob import glob
 import shutil
+import hashlib
+import numpy as np
 
 ###############################################################################
 def main(*opargs, **kwargs):
@@ -189,6 +191,97 @@ def copyfile(srcfile, dstfile, replace=True):
 		print("Error while copying file %s" % (dstfile))
 		return 0
 
+###############################################################################
+def partialhash(filename, blocksize=65536):
+	'''fast fingerprint of a file using its size plus the first and last blocks.  good enough to tell if a large raw file has changed without reading all of it'''
+	h = hashlib.md5()
+	size = os.path.getsize(filename)
+	h.update(str(size).encode('utf-8'))
+	with open(filename, 'rb') as f:
+		h.update(f.read(blocksize))
+		if size > blocksize:
+			f.seek(max(blocksize, size - blocksize), 0)
+			h.update(f.read(blocksize))
+	return h.hexdigest()
+
+###############################################################################
+# the record index of a raw file.  one row per record, in file order.  the timestamp is NaN when the record type does not carry a time
+RECORDINDEXDTYPE = np.dtype([('type', np.int64), ('offset', np.int64), ('length', np.int64), ('timestamp', np.float64)])
+RECORDINDEXSUFFIX = ".recordindex.npz"
+
+###############################################################################
+def loadrecordindex(filename, builder, version=1, suffix=RECORDINDEXSUFFIX):
+	'''return the record index for a raw file.  the index is read from the sidecar file if it matches the size and modified time of the raw file and the reader version.
+	otherwise builder() is called to scan the file once, and the result is saved as the sidecar for next time.  a reader can keep a second index of a subset of its records under another suffix'''
+	indexfilename = filename + suffix
+	source = np.array([os.path.getsize(filename), os.path.getmtime(filename), version], dtype=np.float64)
+	if os.path.isfile(indexfilename):
+		try:
+			with np.load(indexfilename) as sidecar:
+				if np.array_equal(sidecar['source'], source):
+					return sidecar['records']
+		except (OSError, ValueError, KeyError):
+			pass # a damaged sidecar is simply rebuilt
+
+	records = np.asarray(builder(), dtype=RECORDINDEXDTYPE)
+	try:
+		# write to a temporary name first so a half written sidecar is never picked up
+		tempfilename = indexfilename + ".tmp.npz"
+		np.savez(tempfilename, records=records, source=source)
+		os.replace(tempfilename, indexfilename)
+	except OSError:
+		pass # the raw folder may be read only, so just use the index for this session
+	return records
+
+###############################################################################
+def recordsoftype(records, recordtypes):
+	'''return the rows of a record index which match one record type, or any of a list of record types'''
+	return records[np.isin(records['type'], recordtypes)]
+
+###############################################################################
+def recordsinwindow(records, starttime, endtime):
+	'''return the rows of a record index with a timestamp in the window starttime <= timestamp <= endtime.  a binary search is used when the times are in order'''
+	records = records[~np.isnan(records['timestamp'])]
+	timestamps = records['timestamp']
+	if len(timestamps) > 0 and np.all(timestamps[1:] >= timestamps[:-1]):
+		first = np.searchsorted(timestamps, starttime, side='left')
+		last = np.searchsorted(timestamps, endtime, side='right')
+		return records[first:last]
+	return records[(timestamps >= starttime) & (timestamps <= endtime)]
+
+###############################################################################
+def recordsinrange(records, startbyte, endbyte):
+	'''return the rows of a record index which start in the byte range startbyte <= offset < endbyte'''
+	return records[(records['offset'] >= startbyte) & (records['offset'] < endbyte)]
+
+###############################################################################
+def splitrecords(records, count):
+	'''split a record index into count runs of about the same number of bytes, so a big file can be decoded in parallel.  returns a list of (startbyte, endbyte) ranges which always begin and end on a record boundary'''
+	if len(records) == 0:
+		return []
+	records = np.sort(records, order='offset')
+	offsets = records['offset']
+	ends = offsets + records['length']
+	# cut at the first record which starts past each equal share of the bytes
+	shares = offsets[0] + (ends[-1] - offsets[0]) * np.arange(1, max(1, int(count))) / max(1, int(count))
+	cuts = np.unique(np.concatenate(([0], np.searchsorted(offsets, shares, side='left'), [len(offsets)])))
+	return [(int(offsets[first]), int(ends[last - 1])) for first, last in zip(cuts[:-1], cuts[1:]) if last > first]
+
+###############################################################################
+def gatherrecords(raw, offsets, dtype, chunksize=16384):
+	'''decode the fixed size structure found at each offset of a uint8 file array in one go.  the bytes are gathered into a contiguous block which is viewed through the structured dtype'''
+	dtype = np.dtype(dtype)
+	offsets = np.asarray(offsets, dtype=np.int64)
+	# trap truncated records at the end of the file
+	offsets = offsets[offsets + dtype.itemsize <= len(raw)]
+	columns = np.arange(dtype.itemsize)
+	records = np.empty(len(offsets), dtype=dtype)
+	# gather in chunks so the index array stays small on big files
+	for start in range(0, len(offsets), chunksize):
+		chunk = offsets[start:start + chunksize]
+		records[start:start + len(chunk)] = raw[chunk[:, None] + columns].view(dtype)[:, 0]
+	return records
+
 ###############################################################################
 def outfilename(filename, prefix="", appendix="", extension=""):
 	filename = filename.replace('\\','/')
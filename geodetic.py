@@ -504,6 +504,61 @@ def est_dist(  latitude1,  longitude1,  latitude2,  longitude2 ) :
 				pow(math.fabs(longitude2-longitude1)*c, 2) ) * a * ( 1.0 - f + f * c )
    	# END of rough estimate of the distance.
 
+###############################################################################
+def douglaspeucker(x, y, tolerance):
+	'''return a boolean mask of the vertices to keep when simplifying a line using the douglas peucker algorithm.
+	tolerance is in the same units as x and y.  the first and last vertices are always kept'''
+	x = np.asarray(x, dtype=np.float64)
+	y = np.asarray(y, dtype=np.float64)
+	mask = np.zeros(len(x), dtype=bool)
+	if len(x) < 3 or tolerance <= 0:
+		mask[:] = True
+		return mask
+
+	mask[0] = True
+	mask[-1] = True
+	# use a stack rather than recursion so very long lines do not hit the recursion limit
+	stack = [(0, len(x) - 1)]
+	while stack:
+		first, last = stack.pop()
+		if last - first < 2:
+			continue
+		dx = x[last] - x[first]
+		dy = y[last] - y[first]
+		px = x[first+1:last] - x[first]
+		py = y[first+1:last] - y[first]
+		seglength2 = dx * dx + dy * dy
+		if seglength2 == 0:
+			distance = np.hypot(px, py)
+		else:
+			# distance to the segment rather than the infinite line, so tracks which double back on themselves are kept
+			t = np.clip((px * dx + py * dy) / seglength2, 0.0, 1.0)
+			distance = np.hypot(px - t * dx, py - t * dy)
+		idx = int(np.argmax(distance))
+		if distance[idx] > tolerance:
+			split = first + 1 + idx
+			mask[split] = True
+			stack.append((first, split))
+			stack.append((split, last))
+	return mask
+
+###############################################################################
+def est_dist_array(latitude1, longitude1, latitude2, longitude2):
+	'''numpy version of est_dist.  takes arrays of positions and returns an array of distances in metres'''
+	f = 1.0 / 298.257223563		# WGS84
+	a = 6378137.0 			# metres
+
+	piD4   = 0.785398163397
+
+	latitude1	= np.asarray(latitude1) * piD4 / 45.0
+	longitude1	= np.asarray(longitude1) * piD4 / 45.0
+	latitude2	= np.asarray(latitude2) * piD4 / 45.0
+	longitude2	= np.asarray(longitude2) * piD4 / 45.0
+
+	c = np.cos((latitude2+latitude1)/2.0)
+
+	return np.hypot(latitude2-latitude1, (longitude2-longitude1)*c) * a * (1.0 - f + f * c)
+
 ###############################################################################
 def getPRJFromEPSG(EPSGCode):
 	'''read through the SRID.csv file from Pyproj to find the correct PRJ string for a given EPSG code.  This is used to write out a sensible PRJ file alongside a shape file. '''
@@ -641,7 +696,7 @@ class geodesy:
 
 	###############################################################################
 	def convertToGrid(self, longitude, latitude):
-		'''convert from longitude, latitude to a projected easting, northing'''
+		'''convert from longitude, latitude to a projected easting, northing.  pass numpy arrays to convert a whole file in one call'''
 		if int(self.EPSGCode) == 4326:
 			return longitude, latitude
 
@@ -649,18 +704,38 @@ class geodesy:
 			return longitude, latitude
 
 		# if self.projection.crs.is_projected == True:
-		x,y = self.projection(float(longitude),float(latitude))
+		transformer = gettransformer(self.projection.crs.geodetic_crs, self.projection.crs)
+		if np.ndim(longitude) == 0:
+			x,y = transformer.transform(float(longitude),float(latitude))
+		else:
+			x,y = transformer.transform(np.asarray(longitude, dtype=np.float64), np.asarray(latitude, dtype=np.float64))
 		return x,y
 
 	###############################################################################
 	def convertToGeographicals(self, easting, northing):
-		'''convert from East, North to longitude, latitude'''
+		'''convert from East, North to longitude, latitude.  pass numpy arrays to convert a whole file in one call'''
 		if self.projection is not None:
-			x,y = self.projection(float(easting),float(northing), inverse=True)
+			transformer = gettransformer(self.projection.crs, self.projection.crs.geodetic_crs)
+			if np.ndim(easting) == 0:
+				x,y = transformer.transform(float(easting),float(northing))
+			else:
+				x,y = transformer.transform(np.asarray(easting, dtype=np.float64), np.asarray(northing, dtype=np.float64))
 			return x,y
 		else:
 			return easting, northing
 
+##########################################################################################################################
+# pyproj transformers are expensive to create, so we make one per pair of coordinate systems and reuse it
+TRANSFORMERS = {}
+
+##########################################################################################################################
+def gettransformer(fromcrs, tocrs):
+	'''return a cached pyproj transformer between 2 coordinate systems.  always_xy keeps the longitude, latitude (easting, northing) order the same as pyproj.Proj'''
+	key = (fromcrs.srs, tocrs.srs)
+	if key not in TRANSFORMERS:
+		TRANSFORMERS[key] = pyproj.Transformer.from_crs(fromcrs, tocrs, always_xy=True)
+	return TRANSFORMERS[key]
+
 
 
 # Test driver
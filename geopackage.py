@@ -8,6 +8,7 @@ from sqlite3 import Error
 import struct
 import sys
 import os.path
+import shutil
 import fileutils
 import datetime
 import subprocess
@@ -37,11 +38,42 @@ def main():
 
 ###############################################################################
 class geopackage:
-	'''a simple helper class to hold a pyproj geodesy object so we can transform with ease'''
-	def __init__(self, filename, epsg = 4326):
+	'''a simple helper class to hold a pyproj geodesy object so we can transform with ease.
+	in bulk mode the package is built into a temporary file with fast, unsafe sqlite settings and only renamed to the real filename by close()'''
+	def __init__(self, filename, epsg = 4326, update=False, bulk=False):
 		self.epsg = epsg #the epsg code is an integer number.  the name is found from the EPSG database
-		self.connection = creategeopackage(filename)
-		
+		self.filename = filename
+		self.bulk = bulk
+		self.buildfilename = filename
+		if self.bulk:
+			# build into a clearly marked temporary file.  if we crash, this is what is left behind, not a half-valid package
+			self.buildfilename = filename + BULKBUILDSUFFIX
+			if os.path.isfile(self.buildfilename):
+				os.remove(self.buildfilename)
+			if update and os.path.isfile(filename):
+				shutil.copyfile(filename, self.buildfilename)
+
+		if update and os.path.isfile(self.buildfilename):
+			self.connection = opengeopackage(self.buildfilename)
+		else:
+			self.connection = creategeopackage(self.buildfilename)
+
+		if self.bulk:
+			setbulkpragmas(self.connection)
+
+	###############################################################################
+	def close(self):
+		'''finish the geopackage.  in bulk mode restore the safe settings, compact it and move it into place'''
+		self.connection.commit()
+		if self.bulk:
+			setsafepragmas(self.connection)
+			self.connection.execute("VACUUM")
+			self.connection.execute("ANALYZE")
+			self.connection.commit()
+		self.connection.close()
+		if self.bulk:
+			os.replace(self.buildfilename, self.filename)
+
 	###############################################################################
 	def addEPSG(self, epsg="4326" ):
 		'''add an EPSG record to the geopackage'''
@@ -55,28 +87,37 @@ class geopackage:
 ###############################################################################
 ###############################################################################
 class vectortable:
-	'''class to create and manage a vector table'''
+	'''class to create and manage a vector table.  records are buffered and written in batches with executemany inside a single transaction'''
 	
-	def __init__(self, connection, tablename="pointtable", epsg = "4326", type="POINTS", fields=["ID","INTEGER"]):
+	def __init__(self, connection, tablename="pointtable", epsg = "4326", type="POINTS", fields=["ID","INTEGER"], batchsize=10000):
 		self.name 		= tablename
 		self.connection = connection
 		self.epsg 	= epsg
 		self.type		= type
 		self.fields		= fields
 		self.fieldcount	= len(fields)
+		self.batchsize	= max(batchsize, 1) 	# how many records to buffer before writing them to the table in one go
+		self.records	= []
 		littlenumber 	= -999999999
 		bignumber 		=  999999999
 		self.envelope 	= [bignumber,littlenumber,bignumber,littlenumber] 	# we need an evelope of min, max X and Y so we can update the pkg_contents table so the data appears correclty in GIS
 		
 		self.connection = createvectortable(self.connection, self.name, self.envelope, self.type, self.fields, self.epsg) # create the table
-	
+
+		# if the table already has records we are appending to it, so grow its envelope rather than replacing it
+		envelope = readenvelope(self.connection, self.name)
+		if envelope is not None:
+			self.envelope = envelope
+
 		self.cursor = self.connection.cursor() 			# open a cursor so we ce use it repeatedly
+		self.sql = insertsql(self.name, self.fieldcount + 1) 	# the fields plus the geometry
 
 	###############################################################################
 	def addpointrecord(self, x, y, fielddata=[]):
 		'''add a record to the table if it has the correct number of fields'''
 		if len(fielddata) == self.fieldcount:
-			addpointrecord(self.cursor, self.name, self.envelope, [x,y], fielddata)
+			calcenvelope(self.envelope, [x,y])
+			self.addrecord(fielddata, createpoint([x,y]))
 
 	###############################################################################
 	def addlinestringrecord(self, linestring=[], fielddata=[]):
@@ -84,7 +125,8 @@ class vectortable:
 		if len(linestring) == 0:
 			return
 		if len(fielddata) == self.fieldcount:
-			addlinestringrecord(self.cursor, self.name, self.envelope, linestring, fielddata)
+			calcenvelope(self.envelope, linestring)
+			self.addrecord(fielddata, createlinestring(linestring))
 
 	###############################################################################
 	def addpolygonrecord(self, polygon=[], fielddata=[]):
@@ -92,11 +134,43 @@ class vectortable:
 		if len(polygon) == 0:
 			return
 		if len(fielddata) == self.fieldcount:
-			addpolygonrecord(self.cursor, self.name, self.envelope, polygon, fielddata)
+			calcenvelope(self.envelope, polygon)
+			self.addrecord(fielddata, createpolygon(polygon))
+
+	###############################################################################
+	def addrecord(self, fielddata, wkb):
+		'''buffer a record and write the buffer to the table once it reaches the batch size'''
+		self.records.append(tuple(fielddata) + (wkb,))
+		if len(self.records) >= self.batchsize:
+			self.flush()
+
+	###############################################################################
+	def flush(self):
+		'''write all buffered records to the table with a single executemany inside one explicit transaction'''
+		if len(self.records) == 0:
+			return
+		if not self.connection.in_transaction:
+			self.cursor.execute("BEGIN")
+		self.cursor.executemany(self.sql, self.records)
+		self.connection.commit()
+		self.records = []
+
+	###############################################################################
+	def getdistinctvalues(self, fieldname):
+		'''return the set of unique values in a field.  handy to find out what is already in the table'''
+		self.flush()
+		return getdistinctvalues(self.cursor, self.name, fieldname)
+
+	###############################################################################
+	def deleterecords(self, fieldname, value):
+		'''delete all records where the field matches the value'''
+		self.flush()
+		deleterecords(self.cursor, self.name, fieldname, value)
 
 	###############################################################################
 	def close(self):
 		'''close the table''' 	
+		self.flush()
 		update_envelope(self.connection, self.name, self.envelope)
 		self.connection.commit()
 	
@@ -241,6 +315,33 @@ def creategeopackage(filename):
 	adddefaultsrsrecords(conn)
 	return conn
 
+###############################################################################
+# the suffix of the temporary file a geopackage is built into when in bulk mode
+BULKBUILDSUFFIX = ".building"
+
+###############################################################################
+def setbulkpragmas(conn):
+	'''fast settings for bulk loading.  there is no journal and no fsync, so the file is not safe until setsafepragmas is called'''
+	conn.execute("PRAGMA journal_mode = MEMORY")
+	conn.execute("PRAGMA synchronous = OFF")
+	conn.execute("PRAGMA cache_size = -262144") # 256MB, negative values are in KB
+	conn.execute("PRAGMA temp_store = MEMORY")
+
+###############################################################################
+def setsafepragmas(conn):
+	'''restore the default, crash safe sqlite settings'''
+	conn.execute("PRAGMA journal_mode = DELETE")
+	conn.execute("PRAGMA synchronous = FULL")
+	conn.execute("PRAGMA cache_size = -2000")
+	conn.execute("PRAGMA temp_store = DEFAULT")
+
+###############################################################################
+def opengeopackage(filename):
+	'''open an existing geopackage so we can add to it'''
+	print ("Opening GeoPackage: %s" % (filename))
+	conn = create_connection(filename)
+	return conn
+
 ###############################################################################
 def create_connection(db_file):
 	""" create a database connection to a SQLite database """
@@ -436,6 +537,50 @@ def update_envelope(conn,tablename, envelope):
 	cur.execute(sql)
 	conn.commit()
 
+###############################################################################
+def readenvelope(conn, tablename):
+	'''read the envelope of a table which already has records.  returns min_x, max_x, min_y, max_y to match calcenvelope, or None if the table is empty'''
+	cur = conn.cursor()
+	try:
+		cur.execute("SELECT EXISTS (SELECT 1 FROM " + tablename + ")")
+		if cur.fetchone()[0] == 0:
+			return None
+		cur.execute("SELECT min_x, max_x, min_y, max_y FROM gpkg_contents WHERE table_name = ?", (tablename,))
+		row = cur.fetchone()
+	except Error as e:
+		print(e)
+		return None
+	if row is None or None in row:
+		return None
+	return list(row)
+
+###############################################################################
+def getdistinctvalues(cursor, tablename, fieldname):
+	'''return the set of unique values in a field of the table'''
+	try:
+		cursor.execute("SELECT DISTINCT " + fieldname + " FROM " + tablename)
+	except Error as e:
+		print(e)
+		return set()
+	return set(row[0] for row in cursor.fetchall())
+
+###############################################################################
+def deleterecords(cursor, tablename, fieldname, value):
+	'''delete all records from the table where the field matches the value'''
+	cursor.execute("DELETE FROM " + tablename + " WHERE " + fieldname + " = ?", (value,))
+
+###############################################################################
+# the parameterised INSERT statements, built once per table and number of values
+INSERTSQL = {}
+
+###############################################################################
+def insertsql(tablename, valuecount):
+	'''return the INSERT statement for a table.  it is built once and reused rather than rebuilt for every record'''
+	key = (tablename, valuecount)
+	if key not in INSERTSQL:
+		INSERTSQL[key] = "INSERT INTO " + tablename + " VALUES (" + ",".join(["?"] * valuecount) + ")"
+	return INSERTSQL[key]
+
 ###############################################################################
 def	addpointrecord(cursor, tablename, envelope, vector, fielddata, epsg=4326):
 	'''add a new POINT to the table'''
@@ -443,11 +588,7 @@ def	addpointrecord(cursor, tablename, envelope, vector, fielddata, epsg=4326):
 	wkb = createpoint(vector, epsg)
 	fd = fielddata.copy()
 	fd.append(wkb)
-	values = " VALUES ("
-	for _ in range(len(fd)):
-		values += "?,"
-	values = values[:-1] + ")"
-	sql = "INSERT INTO " + tablename + values
+	sql = insertsql(tablename, len(fd))
 	v = tuple(fd)
 	cursor.execute(sql, v)
 
@@ -459,11 +600,7 @@ def	addlinestringrecord(cursor, tablename, envelope, vectors, fielddata):
 	wkb = createlinestring(vectors)
 	fd = fielddata.copy()
 	fd.append(wkb)
-	values = " VALUES ("
-	for _ in range(len(fd)):
-		values += "?,"
-	values = values[:-1] + ")"
-	sql = "INSERT INTO " + tablename + values
+	sql = insertsql(tablename, len(fd))
 	v = tuple(fd)
 	# v = (None,wkb) + tuple(fielddata)
 	cursor.execute(sql, v)
@@ -477,11 +614,7 @@ def	addpolygonrecord(cursor, tablename, envelope, vectors, fielddata=[]):
 	wkb = createpolygon(vectors)
 	fd = fielddata.copy()
 	fd.append(wkb)
-	values = " VALUES ("
-	for _ in range(len(fd)):
-		values += "?,"
-	values = values[:-1] + ")"
-	sql = "INSERT INTO " + tablename + values
+	sql = insertsql(tablename, len(fd))
 	v = tuple(fd)
 
 	cursor.execute(sql, v)
@@ -15,10 +15,12 @@
 # import ctypes
 # import math
 import os.path
+import mmap
 import pprint
 # import re
 import struct
 import sys
+import tempfile
 import time
 import numpy as np
 from argparse import ArgumentParser
@@ -35,6 +37,7 @@ import statistics
 import timeseries
 import fileutils
 import geodetic
+import multiprocesshelper
 
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import proj3d
@@ -65,7 +68,7 @@ def main():
 
 	for file in files:
 		print ("processing file: %s" % (file))
-		process(file)
+		process(file, args.epsg)
 	# except:
 	# 	#open the ALL file for reading by creating a new kmallreader class and passin in the filename to open.
 	# 	filename =   "C:/sampledata/kmall/B_S2980_3005_20220220_084910.kmall"
@@ -143,9 +146,10 @@ def extract2timeseries(filename):
 		print(p[0],x,y,z,roll,pitch,heading)
 
 ############################################################
-def process(filename):
+def process(filename, epsg="0"):
 
 	r = kmallreader(filename)
+	geo = geodetic.geodesy(epsg)
 
 	# demonstrate how to load the navigation records into a list.  this is really handy if we want to make a trackplot for coverage
 	start_time = time.time() # time the process
@@ -155,13 +159,18 @@ def process(filename):
 	print("Read Duration: %.3f seconds, navcount %d" % (time.time() - start_time, len(navigation))) # print the processing time. It is handy to keep an eye on processing performance.
 
 	print("Loading Point Cloud...")
-	pointcloud = Cpointcloud()
+	# the points stay as longitude, latitude unless the epsg is a projected CRS.  the kmall positions are WGS84
+	projected = geo.projection is not None and int(geo.EPSGCode) != 4326 and geo.projection.crs.is_projected
+	pointcloud = Cpointcloud(epsg=int(geo.EPSGCode) if projected else 4326, geographic=not projected)
 	pingCount = 0
+	pings = []
 	start_time = time.time() # time the process
 	while r.moreData():
 		# read a datagram.  If we support it, return the datagram type and aclass for that datagram
 		# The user then needs to call the read() method for the class to undertake a fileread and binary decode.  This keeps the read super quick.
 		typeofdatagram, datagram = r.readDatagram()
+		if typeofdatagram == 'CORRUPT':
+			break
 		# print("%s,%d" % (typeofdatagram, r.fileptr.tell()), end='')
 
 		# if typeofdatagram == '#IIP':
@@ -182,18 +191,22 @@ def process(filename):
 		# 	datagram.read()
 		if typeofdatagram == '#MRZ':
 			datagram.read()
-			x, y, z = computebathypointcloud(datagram)
-			pointcloud.add(x, y, z)
+			pings.append(datagram)
+			# georeference the pings in batches so there is one projection call per batch
+			if len(pings) == 100:
+				pointcloud.add(*computebathypointclouds(pings, geo))
+				pings = []
 			#now georeference by computing the actual position on the seafloor
 			# for a in datagram.Attitude:
 			#	 print ("%.5f, %.3f, %.3f, %.3f, %.3f" % (r.to_timestamp(r.to_DateTime(a[0], a[1])), a[3], a[4], a[5], a[6]))
 			
 		continue
+	pointcloud.add(*computebathypointclouds(pings, geo))
 
-	outfile = os.path.join(os.path.dirname(filename), os.path.basename(filename) + ".txt")
-	xyz = np.column_stack([pointcloud.xarr,pointcloud.yarr, pointcloud.zarr])
+	outfile = os.path.join(os.path.dirname(filename), os.path.basename(filename) + ".las")
 	print("Saving point cloud to %s" % (outfile)) 
-	np.savetxt(outfile, (xyz), fmt='%.10f', delimiter=',')
+	pointcloud.save(outfile)
+	pointcloud.close()
 	r.rewind()
 	print("Complete reading ALL file :-)")
 	r.close()
@@ -201,21 +214,26 @@ def process(filename):
 ###############################################################################
 def computebathypointcloud(datagram, geo):
 	'''using the MRZ datagram, efficiently compute a numpy array of the point clouds  '''
+	return computebathypointclouds([datagram], geo)
 
-	for beam in datagram.beams:
-		beam.east, beam.north = geo.convertToGrid((beam.deltaLongitude_deg + datagram.longitude), (beam.deltaLatitude_deg + datagram.latitude))
-		beam.depth = beam.z_reRefPoint_m - datagram.txTransducerDepth_m
-		# beam.depth = beam.z_reRefPoint_m - datagram.z_waterLevelReRefPoint_m
-		beam.id 	= datagram.ping
-	npeast = np.fromiter((beam.east for beam in datagram.beams), float, count=len(datagram.beams)) #. Also, adding count=len(stars)
-	npnorth = np.fromiter((beam.north for beam in datagram.beams), float, count=len(datagram.beams)) #. Also, adding count=len(stars)
-	npdepth = np.fromiter((beam.depth for beam in datagram.beams), float, count=len(datagram.beams)) #. Also, adding count=len(stars)
-	npq = np.fromiter((beam.rejectionInfo1 for beam in datagram.beams), float, count=len(datagram.beams)) #. Also, adding count=len(stars)
+###############################################################################
+def computebathypointclouds(datagrams, geo):
+	'''using a batch of MRZ datagrams, compute numpy arrays of the point cloud with one projection call for the whole batch'''
+	if len(datagrams) == 0:
+		return (np.empty(0), np.empty(0), np.empty(0), np.empty(0))
+	counts = [len(datagram.soundings) for datagram in datagrams]
+	soundings = np.concatenate([datagram.soundings for datagram in datagrams])
+	# the ping values repeated for every sounding in the ping
+	longitudes = np.repeat([datagram.longitude for datagram in datagrams], counts)
+	latitudes = np.repeat([datagram.latitude for datagram in datagrams], counts)
+	transducerdepths = np.repeat([datagram.txTransducerDepth_m for datagram in datagrams], counts)
 
 	# we can now comput absolute positions from the relative positions
-	# npLatitude_deg = npdeltaLatitude_deg + datagram.latitude_deg	
-	# npLongitude_deg = npdeltaLongitude_deg + datagram.longitude_deg
-	return (npeast, npnorth, npdepth, npq)
+	npeast, npnorth = geo.convertToGrid(soundings['deltaLongitude_deg'].astype(np.float64) + longitudes, soundings['deltaLatitude_deg'].astype(np.float64) + latitudes)
+	npdepth = soundings['z_reRefPoint_m'].astype(np.float64) - transducerdepths
+	# npdepth = soundings['z_reRefPoint_m'] - datagram.z_waterLevelReRefPoint_m
+	npq = soundings['rejectionInfo1'].astype(np.float64)
+	return (np.asarray(npeast, dtype=np.float64), np.asarray(npnorth, dtype=np.float64), npdepth, npq)
 
 ###############################################################################
 def update_progress(job_title, progress):
@@ -240,51 +258,244 @@ def decodeheader(s, obj):
 	obj.date 				= from_timestamp(obj.time_sec + obj.time_nanosec/1000000000)
 	return obj
 
+###############################################################################
+def positionstonavigation(times, longitudes, latitudes, headings, firstRecordOnly=False, step=0):
+	'''turn the position columns from readpositions into the navigation list of timestamp, x, y, z, heading.  bad positions are dropped and fixes closer than step seconds are skipped'''
+	navigation = []
+	lastimestamp = 0
+	valid = validpositions(longitudes, latitudes)
+	for timestamp, longitude, latitude, heading in zip(times[valid].tolist(), longitudes[valid].tolist(), latitudes[valid].tolist(), headings[valid].tolist()):
+		if (timestamp - lastimestamp) < step:
+			# skip...  performance increase
+			continue
+		# timestamp, x, y, z, heading
+		navigation.append([timestamp, longitude, latitude, 0.0, heading])
+		lastimestamp = timestamp
+		if firstRecordOnly: #we only want the first record
+			break
+	return navigation
+
+###############################################################################
+def loadnavigationrange(task):
+	'''process pool worker.  decode the #SPO datagrams in one byte range of a file, task is (filename, startbyte, endbyte)'''
+	filename, startbyte, endbyte = task
+	r = kmallreader(filename, usemmap=True)
+	r.setbyterange(startbyte, endbyte)
+	positions = r.readpositions()
+	r.close()
+	return positions
+
+###############################################################################
+def mergenavigation(parts, step=0):
+	'''join the positions decoded from the byte ranges of a file, in file order, into the same navigation list as loadNavigation.  if any range failed the whole file has failed, so an empty list is returned'''
+	if len(parts) == 0 or any(part is None or len(part) == 0 for part in parts):
+		return []
+	columns = [np.concatenate([part[i] for part in parts]) for i in range(4)]
+	return positionstonavigation(*columns, step=step)
+
+###############################################################################
+def mp_loadNavigation(filename, cpu, step=0):
+	'''load the navigation from a big file by decoding byte ranges of it in a process pool'''
+	r = kmallreader(filename)
+	byteranges = r.getbyteranges(cpu)
+	r.close()
+	return mergenavigation(multiprocesshelper.mp_decoderanges(loadnavigationrange, filename, byteranges, cpu), step)
+
+###############################################################################
+def loadpointcloudrange(task):
+	'''process pool worker.  decode and georeference the #MRZ datagrams in one byte range of a file, task is (filename, startbyte, endbyte, epsg)'''
+	filename, startbyte, endbyte, epsg = task
+	geo = geodetic.geodesy(epsg)
+	r = kmallreader(filename, usemmap=True)
+	r.setbyterange(startbyte, endbyte)
+	parts = []
+	pings = []
+	for offset in r.getoffsets('#MRZ'):
+		r.fileptr.seek(offset, 0)
+		typeofdatagram, datagram = r.readDatagram()
+		if typeofdatagram != '#MRZ':
+			continue
+		datagram.read()
+		pings.append(datagram)
+		# georeference the pings in batches so there is one projection call per batch
+		if len(pings) == 100:
+			parts.append(computebathypointclouds(pings, geo))
+			pings = []
+	parts.append(computebathypointclouds(pings, geo))
+	r.close()
+	return tuple(np.concatenate([part[i] for part in parts]) for i in range(4))
+
+###############################################################################
+def mp_loadpointcloud(filename, epsg, cpu):
+	'''decode and georeference every #MRZ datagram of a big file by decoding byte ranges of it in a process pool.  returns x, y, z, q arrays in file order'''
+	r = kmallreader(filename)
+	byteranges = r.getbyteranges(cpu)
+	r.close()
+	parts = multiprocesshelper.mp_decoderanges(loadpointcloudrange, filename, byteranges, cpu, epsg)
+	if len(parts) == 0:
+		return (np.empty(0), np.empty(0), np.empty(0), np.empty(0))
+	return tuple(np.concatenate([part[i] for part in parts]) for i in range(4))
+
+###############################################################################
+def validpositions(longitudes, latitudes):
+	'''mask of the positions which are inside the valid range of longitude and latitude'''
+	return (latitudes >= -90) & (latitudes <= 90) & (longitudes >= -180) & (longitudes <= 180)
+
+###############################################################################
+# LAS 1.2 public header block and point data record format 0
+LASHEADER_def = "=4sHH16sBB32s32sHHHLLBHL5L3d3d6d"
+LASPOINT0_dtype = np.dtype([('X', '<i4'), ('Y', '<i4'), ('Z', '<i4'), ('intensity', '<u2'), ('returns', 'u1'), ('classification', 'u1'), ('scanangle', 'i1'), ('userdata', 'u1'), ('pointsourceid', '<u2')])
+# the variable length record header, and the GeoTIFF key directory record which carries the CRS of the points
+LASVLRHEADER_def = "=H16sHH32s"
+LASGEOKEYDIRECTORY = 34735
+LASGEOGRAPHICSCALE = 0.0000001		# about 1cm at the equator for longitude, latitude clouds
+LASPROJECTEDSCALE = 0.001			# 1mm for projected clouds
+
 ###############################################################################
 class Cpointcloud:
-	'''class to hold a point cloud'''
-	# xarr = np.empty([0], dtype=float)
-	# yarr = np.empty([0], dtype=float)
-	# zarr = np.empty([0], dtype=float)
-	# qarr = np.empty([0], dtype=float)
-
-	# self.xarr = []
-	# self.yarr = []
-	# self.zarr = []
-	# self.qarr = []
-	# self.idarr = []
+	'''class to hold a point cloud.  the points are held in fixed size numpy blocks so adding a ping never copies the points we already have.
+	once the blocks use more than ramlimit bytes, new blocks are memory mapped into a temporary file so a whole survey will fit'''
+	BLOCKSIZE	= 1048576		# points per block
+	FIELDS		= 4				# x, y, z, q
 
 	###############################################################################
-	def __init__(self, npx=None, npy=None, npz=None, npq=None, npid=None):
-		'''add the new ping of data to the existing array '''
-		# np.append(self.xarr, np.array(npx))
-		# np.append(self.yarr, np.array(npy))
-		# np.append(self.zarr, np.array(npz))
-		# np.append(self.qarr, np.array(npq))
-		# np.append(self.idarr, np.array(npid))
-		self.xarr = []
-		self.yarr = []
-		self.zarr = []
-		self.qarr = []
-		# idarr = []
-		# self.xarr = np.array(npx)
-		# self.yarr = np.array(npy)
-		# self.zarr = np.array(npz)
-		# self.qarr = np.array(npq)
-		# self.idarr = np.array(npid)
+	def __init__(self, npx=None, npy=None, npz=None, npq=None, npid=None, ramlimit=1024*1024*1024, spillfolder=None, epsg=0, geographic=None):
+		'''create the point cloud, optionally adding a first ping of data.  epsg is the CRS of the x, y values and geographic is True when they are longitude, latitude.  if geographic is None it is guessed from the extents when saving'''
+		self.epsg = int(epsg)
+		self.geographic = geographic
+		self.blocks = []
+		self.count = 0
+		self.ramlimit = ramlimit
+		self.spillfolder = spillfolder
+		self.spillfile = None
+		self.spillbytes = 0
+		if npx is not None:
+			self.add(npx, npy, npz, npq)
+
+	###############################################################################
+	def __len__(self):
+		return self.count
+
+	###############################################################################
+	def newblock(self):
+		'''add an empty block, in memory while we are inside the ram limit, otherwise in the temporary spill file'''
+		blockbytes = self.BLOCKSIZE * self.FIELDS * np.dtype(np.float64).itemsize
+		if (len(self.blocks) + 1) * blockbytes <= self.ramlimit:
+			self.blocks.append(np.empty((self.BLOCKSIZE, self.FIELDS), dtype=np.float64))
+			return
+		if self.spillfile is None:
+			self.spillfile = tempfile.TemporaryFile(prefix="pointcloud_", suffix=".bin", dir=self.spillfolder)
+		# grow the spill file, then map the new block onto the end of it
+		self.spillfile.truncate(self.spillbytes + blockbytes)
+		self.blocks.append(np.memmap(self.spillfile, dtype=np.float64, mode='r+', offset=self.spillbytes, shape=(self.BLOCKSIZE, self.FIELDS)))
+		self.spillbytes += blockbytes
 
 	###############################################################################
 	def add(self, npx, npy, npz, npq):
 		'''add the new ping of data to the existing array '''
-		# self.xarr = np.append(self.xarr, np.array(npx))
-		# self.yarr = np.append(self.yarr, np.array(npy))
-		# self.zarr = np.append(self.zarr, np.array(npz))
-		# self.qarr = np.append(self.zarr, np.array(npq))
-		self.xarr.extend(npx)
-		self.yarr.extend(npy)
-		self.zarr.extend(npz)
-		self.qarr.extend(npq)
-		# self.idarr.extend(npid)
+		columns = [np.asarray(npx), np.asarray(npy), np.asarray(npz), np.asarray(npq)]
+		total = len(columns[0])
+		done = 0
+		while done < total:
+			if self.count == len(self.blocks) * self.BLOCKSIZE:
+				self.newblock()
+			block = self.blocks[-1]
+			used = self.count - ((len(self.blocks) - 1) * self.BLOCKSIZE)
+			n = min(total - done, self.BLOCKSIZE - used)
+			for i, column in enumerate(columns):
+				block[used:used + n, i] = column[done:done + n]
+			self.count += n
+			done += n
+
+	###############################################################################
+	def getblocks(self):
+		'''yield the filled part of every block as an array of x, y, z, q rows.  this lets us process a big point cloud without making one huge array'''
+		for i, block in enumerate(self.blocks):
+			yield block[:min(self.BLOCKSIZE, self.count - (i * self.BLOCKSIZE))]
+
+	###############################################################################
+	def toarray(self):
+		'''return the whole point cloud as one array of x, y, z, q rows'''
+		if self.count == 0:
+			return np.empty((0, self.FIELDS), dtype=np.float64)
+		return np.concatenate(list(self.getblocks()))
+
+	###############################################################################
+	def save(self, filename, dtype=np.float64):
+		'''save the point cloud in bulk.  a .las filename writes a LAS 1.2 file, anything else writes raw interleaved x, y, z, q values of the requested dtype'''
+		if os.path.splitext(filename)[1].lower() == ".las":
+			return self.savelas(filename)
+		with open(filename, 'wb') as f:
+			for block in self.getblocks():
+				block.astype(dtype, copy=False).tofile(f)
+
+	###############################################################################
+	def savelas(self, filename, scale=None):
+		'''save the point cloud as a LAS 1.2 file with point data format 0.  the quality value is written to the user data field.
+		the x, y scale defaults to 1e-7 for longitude, latitude clouds and 1mm for projected clouds, z is always 1mm, and the EPSG code is written as a GeoTIFF key directory record'''
+		minimums = np.full(3, np.inf)
+		maximums = np.full(3, -np.inf)
+		for block in self.getblocks():
+			if len(block) > 0:
+				minimums = np.minimum(minimums, block[:, :3].min(axis=0))
+				maximums = np.maximum(maximums, block[:, :3].max(axis=0))
+		if self.count == 0:
+			minimums = np.zeros(3)
+			maximums = np.zeros(3)
+		offsets = np.floor(minimums)
+
+		geographic = self.geographic
+		if geographic is None:
+			geographic = bool(minimums[0] >= -180 and maximums[0] <= 360 and minimums[1] >= -90 and maximums[1] <= 90)
+		if scale is None:
+			scale = LASGEOGRAPHICSCALE if geographic else LASPROJECTEDSCALE
+		# depths are always in metres.  make sure the biggest coordinate on each axis still fits in the 32 bit integers of the point records
+		scales = np.maximum(np.array([scale, scale, LASPROJECTEDSCALE]), (maximums - offsets) / 2147483647)
+
+		# the CRS, as GeoTIFF keys.  model type 2 is geographic, 1 is projected
+		vlrs = b""
+		if self.epsg > 0:
+			if geographic:
+				keys = [(1024, 0, 1, 2), (1025, 0, 1, 1), (2048, 0, 1, self.epsg)]
+			else:
+				keys = [(1024, 0, 1, 1), (1025, 0, 1, 1), (3072, 0, 1, self.epsg)]
+			geokeys = np.array([(1, 1, 0, len(keys))] + keys, dtype='<u2').tobytes()
+			vlrs = struct.pack(LASVLRHEADER_def, 0, b"LASF_Projection", LASGEOKEYDIRECTORY, len(geokeys), b"GeoKeyDirectoryTag") + geokeys
+
+		now = datetime.now()
+		header = struct.pack(LASHEADER_def,
+			b"LASF", 0, 0, b"\x00" * 16, 1, 2,
+			b"kmall", b"kmall.py",
+			now.timetuple().tm_yday, now.year,
+			struct.calcsize(LASHEADER_def), struct.calcsize(LASHEADER_def) + len(vlrs), 1 if len(vlrs) > 0 else 0,
+			0, LASPOINT0_dtype.itemsize, self.count,
+			self.count, 0, 0, 0, 0,
+			scales[0], scales[1], scales[2],
+			offsets[0], offsets[1], offsets[2],
+			maximums[0], minimums[0], maximums[1], minimums[1], maximums[2], minimums[2])
+
+		with open(filename, 'wb') as f:
+			f.write(header)
+			f.write(vlrs)
+			for block in self.getblocks():
+				points = np.zeros(len(block), dtype=LASPOINT0_dtype)
+				points['X'] = np.round((block[:, 0] - offsets[0]) / scales[0])
+				points['Y'] = np.round((block[:, 1] - offsets[1]) / scales[1])
+				points['Z'] = np.round((block[:, 2] - offsets[2]) / scales[2])
+				# single return, return number 1 of 1
+				points['returns'] = 9
+				points['userdata'] = np.clip(block[:, 3], 0, 255)
+				points.tofile(f)
+
+	###############################################################################
+	def close(self):
+		'''release the blocks and delete the spill file'''
+		self.blocks = []
+		self.count = 0
+		if self.spillfile is not None:
+			self.spillfile.close()
+			self.spillfile = None
+			self.spillbytes = 0
 
 ###############################################################################
 class kmallreader:
@@ -322,8 +533,39 @@ class kmallreader:
 
 	EMdgmMpartition_def			= "=2H"
 
+	# numpy structured dtypes matching the struct definitions above so a whole file of records can be decoded in one go with np.frombuffer
+	EMdgmHeader_dtype			= [('numBytesDgm', '<u4'), ('dgmType', 'S4'), ('dgmVersion', 'u1'), ('systemID', 'u1'), ('echoSounderID', '<u2'), ('time_sec', '<u4'), ('time_nanosec', '<u4')]
+	EMdgmScommon_dtype			= [('numBytesCmnPart', '<u2'), ('sensorSystem', '<u2'), ('sensorStatus', '<u2'), ('padding', '<u2')]
+	EMdgmSPOdataBlock_dtype		= [('timeFromSensor_sec', '<u4'), ('timeFromSensor_nanosec', '<u4'), ('posFixQuality_m', '<f4'), ('correctedLat_deg', '<f8'), ('correctedLong_deg', '<f8'), ('speedOverGround_mPerSec', '<f4'), ('courseOverGround_deg', '<f4'), ('ellipsoidHeightReRefPoint_m', '<f4')]
+	EMdgmSPO_dtype				= np.dtype(EMdgmHeader_dtype + EMdgmScommon_dtype + EMdgmSPOdataBlock_dtype)
+
+	EMdgmSKMinfo_dtype			= [('numBytesInfoPart', '<u2'), ('sensorSystem', 'u1'), ('sensorStatus', 'u1'), ('sensorInputFormat', '<u2'), ('numSamplesArray', '<u2'), ('numBytesPerSample', '<u2'), ('sensorDataContents', '<u2')]
+	EMdgmSKM_dtype				= np.dtype(EMdgmHeader_dtype + EMdgmSKMinfo_dtype)
+	KMbinary_dtype				= [('dgmType', 'S4'), ('numBytesDgm', '<u2'), ('dgmVersion', '<u2'), ('time_sec', '<u4'), ('time_nanosec', '<u4'), ('status', '<u4'),
+									('latitude_deg', '<f8'), ('longitude_deg', '<f8'), ('ellipsoidHeight_m', '<f4'),
+									('roll_deg', '<f4'), ('pitch_deg', '<f4'), ('heading_deg', '<f4'), ('heave_m', '<f4'),
+									('rollRate', '<f4'), ('pitchRate', '<f4'), ('yawRate', '<f4'),
+									('velNorth', '<f4'), ('velEast', '<f4'), ('velDown', '<f4'),
+									('latitudeError_m', '<f4'), ('longitudeError_m', '<f4'), ('ellipsoidHeightError_m', '<f4'), ('rollError_deg', '<f4'), ('pitchError_deg', '<f4'), ('headingError_deg', '<f4'), ('heaveError_m', '<f4'),
+									('northAcceleration', '<f4'), ('eastAcceleration', '<f4'), ('downAcceleration', '<f4')]
+	KMdelayedHeave_dtype		= [('delayedHeave_time_sec', '<u4'), ('delayedHeave_time_nanosec', '<u4'), ('delayedHeave_m', '<f4')]
+	EMdgmSKMsample_dtype		= np.dtype(KMbinary_dtype + KMdelayedHeave_dtype)
+
+	# one MRZ sounding, "HB 7BH6f 2Hf 4f 7f 6fH 3H"
+	EMdgmMRZ_sounding_dtype		= np.dtype([('soundingIndex', '<u2'), ('txSectorNumb', 'u1'),
+									('detectionType', 'u1'), ('detectionMethod', 'u1'), ('rejectionInfo1', 'u1'), ('rejectionInfo2', 'u1'), ('postProcessingInfo', 'u1'), ('detectionClass', 'u1'), ('detectionConfidenceLevel', 'u1'), ('padding', '<u2'),
+									('rangeFactor', '<f4'), ('qualityFactor', '<f4'), ('detectionUncertaintyVer_m', '<f4'), ('detectionUncertaintyHor_m', '<f4'), ('detectionWindowLength_sec', '<f4'), ('echoLength_sec', '<f4'),
+									('WCBeamNumb', '<u2'), ('WCrange_samples', '<u2'), ('WCNomBeamAngleAcross_deg', '<f4'),
+									('meanAbsCoeff_dBPerkm', '<f4'), ('reflectivity1_dB', '<f4'), ('reflectivity2_dB', '<f4'), ('receiverSensitivityApplied_dB', '<f4'),
+									('sourceLevelApplied_dB', '<f4'), ('BScalibration_dB', '<f4'), ('TVG_dB', '<f4'), ('beamAngleReRx_deg', '<f4'), ('beamAngleCorrection_deg', '<f4'), ('twoWayTravelTime_sec', '<f4'), ('twoWayTravelTimeCorrection_sec', '<f4'),
+									('deltaLatitude_deg', '<f4'), ('deltaLongitude_deg', '<f4'), ('z_reRefPoint_m', '<f4'), ('y_reRefPoint_m', '<f4'), ('x_reRefPoint_m', '<f4'), ('beamIncAngleAdj_deg', '<f4'), ('realTimeCleanInfo', '<u2'),
+									('SIstartRange_samples', '<u2'), ('SIcentreSample', '<u2'), ('SInumSamples', '<u2')])
+
+	# bump this whenever the record index changes so the sidecar files are rebuilt
+	INDEXVERSION				= 1
+
 	###############################################################################
-	def __init__(self, filename):
+	def __init__(self, filename, usemmap=False):
 		if not os.path.isfile(filename):
 			print ("file not found:", filename)
 		self.fileName = filename
@@ -332,6 +574,18 @@ class kmallreader:
 		# self.recordDate = ""
 		self.recordTime = ""
 		self.recordCounter=0
+		self.index = None
+		self.byterange = None
+
+		# in mmap mode the whole file is mapped into memory.  the mmap object is file like, so the datagram classes seek and read it without any system calls.
+		# the headers are decoded with unpack_from straight out of the buffer and each datagram is given a zero copy memoryview of its bytes in datagram.buffer
+		self.file = self.fileptr
+		self.mmap = None
+		self.buffer = None
+		if usemmap and self.fileSize > 0:
+			self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+			self.buffer = memoryview(self.mmap)
+			self.fileptr = self.mmap
 
 	###############################################################################
 	def __str__(self):
@@ -364,7 +618,16 @@ class kmallreader:
 	###############################################################################
 	def close(self):
 		'''close the current file'''
-		self.fileptr.close()
+		if self.mmap is not None:
+			self.buffer.release()
+			try:
+				self.mmap.close()
+			except BufferError:
+				# a datagram still holds a memoryview of the file, so the map is released when that datagram is garbage collected
+				pass
+			self.buffer = None
+			self.mmap = None
+		self.file.close()
 
 	###############################################################################
 	def rewind(self):
@@ -387,6 +650,8 @@ class kmallreader:
 	###############################################################################
 	def readDatagramHeader(self):
 		'''read the common header for any datagram'''
+		if self.buffer is not None:
+			return self.readDatagramHeaderAt(self.fileptr.tell())
 		try:
 			curr = self.fileptr.tell()
 			data = self.fileptr.read(self.KMALLPacketHeader_len)
@@ -416,6 +681,128 @@ class kmallreader:
 		except struct.error:
 			return 0,0,0,0,0,0,0,0
 
+	###############################################################################
+	def readDatagramHeaderAt(self, offset):
+		'''decode the common header of the datagram at an offset in the memory mapped file.  no seek or read is needed'''
+		try:
+			s = self.KMALLPacketHeader_unpack(self.buffer, offset)
+			self.date = from_timestamp(s[5] + s[6]/1000000000)
+			return s[0], s[1].decode('utf-8').rstrip('\x00'), s[2], s[3], s[4], s[5], s[6], self.date
+		except struct.error:
+			return 0,0,0,0,0,0,0,0
+
+	###############################################################################
+	def scandatagrams(self):
+		'''walk the memory mapped file yielding the offset, size, type and time of every datagram.  only the headers are decoded'''
+		unpack = self.KMALLPacketHeader_unpack
+		offset = 0
+		while offset + self.KMALLPacketHeader_len <= self.fileSize:
+			numberofbytes, typeofdatagram, version, systemid, echosounderid, time_sec, time_nanosec = unpack(self.buffer, offset)
+			# trap corrupt datagrams.  we see these when sis crashes
+			if numberofbytes == 0 or offset + numberofbytes > self.fileSize:
+				return
+			yield offset, numberofbytes, typeofdatagram.decode('utf-8').rstrip('\x00'), time_sec + time_nanosec/1000000000
+			offset += numberofbytes
+
+	###############################################################################
+	def buildindex(self):
+		'''make one pass through the file reading only the datagram headers, to build the record index of type, offset, length and time'''
+		records = []
+		if self.buffer is not None:
+			for offset, numberofbytes, typeofdatagram, timestamp in self.scandatagrams():
+				records.append((datagramtypecode(typeofdatagram), offset, numberofbytes, timestamp))
+			return np.array(records, dtype=fileutils.RECORDINDEXDTYPE)
+
+		self.rewind()
+		offset = 0
+		while offset + self.KMALLPacketHeader_len <= self.fileSize:
+			self.fileptr.seek(offset, 0)
+			s = self.KMALLPacketHeader_unpack(self.fileptr.read(self.KMALLPacketHeader_len))
+			numberofbytes = s[0]
+			# trap corrupt datagrams.  we see these when sis crashes
+			if numberofbytes == 0 or offset + numberofbytes > self.fileSize:
+				break
+			records.append((datagramtypecode(s[1]), offset, numberofbytes, s[5] + s[6]/1000000000))
+			offset += numberofbytes
+		self.rewind()
+		return np.array(records, dtype=fileutils.RECORDINDEXDTYPE)
+
+	###############################################################################
+	def getindex(self):
+		'''return the record index for the file.  it is loaded from the sidecar file if there is an up to date one, otherwise built and saved'''
+		if self.index is None:
+			self.index = fileutils.loadrecordindex(self.fileName, self.buildindex, self.INDEXVERSION)
+		return self.index
+
+	###############################################################################
+	def getoffsets(self, typeofdatagram):
+		'''return the file offsets of every datagram of the requested type, using the record index.  if a byte range is set only the datagrams starting inside it are returned'''
+		records = fileutils.recordsoftype(self.getindex(), datagramtypecode(typeofdatagram))
+		if self.byterange is not None:
+			records = fileutils.recordsinrange(records, self.byterange[0], self.byterange[1])
+		return records['offset'].tolist()
+
+	###############################################################################
+	def setbyterange(self, startbyte=None, endbyte=None):
+		'''limit the loaders to the datagrams which start in startbyte <= offset < endbyte.  this lets several processes decode one big file between them.  call with no arguments to read the whole file again'''
+		if startbyte is None:
+			self.byterange = None
+		else:
+			self.byterange = (startbyte, endbyte)
+
+	###############################################################################
+	def getbyteranges(self, count):
+		'''split the file into count datagram aligned byte ranges of about the same size'''
+		return fileutils.splitrecords(self.getindex(), count)
+
+	###############################################################################
+	def read_window(self, start_time, end_time, typeofdatagram=None):
+		'''yield (typeofdatagram, datagram) for every datagram timed start_time <= time <= end_time, optionally of one type only.  the record index is binary searched so only the datagrams in the window are read from disc'''
+		records = fileutils.recordsinwindow(self.getindex(), start_time, end_time)
+		if typeofdatagram is not None:
+			records = fileutils.recordsoftype(records, datagramtypecode(typeofdatagram))
+		for offset in records['offset'].tolist():
+			self.fileptr.seek(offset, 0)
+			yield self.readDatagram()
+		self.rewind()
+
+	###############################################################################
+	def getbytes(self):
+		'''return the whole file as a numpy uint8 array.  in mmap mode this is a view of the mapped file, otherwise the file is memory mapped read only by numpy'''
+		if self.buffer is not None:
+			return np.frombuffer(self.buffer, dtype=np.uint8)
+		return np.memmap(self.fileName, dtype=np.uint8, mode='r')
+
+	###############################################################################
+	def readpositions(self):
+		'''batch decode every #SPO datagram in the file.  returns column arrays of time, longitude, latitude, heading.  no per record python objects are created'''
+		spo = fileutils.gatherrecords(self.getbytes(), self.getoffsets('#SPO'), self.EMdgmSPO_dtype)
+		times = spo['time_sec'] + spo['time_nanosec'] / 1000000000
+		return times, spo['correctedLong_deg'], spo['correctedLat_deg'], spo['courseOverGround_deg']
+
+	###############################################################################
+	def readattitudes(self):
+		'''batch decode every sample from every #SKM datagram in the file.  returns column arrays of time, latitude, longitude, ellipsoid height, roll, pitch, heading, heave'''
+		raw = self.getbytes()
+		offsets = np.asarray(self.getoffsets('#SKM'), dtype=np.int64)
+		skm = fileutils.gatherrecords(raw, offsets, self.EMdgmSKM_dtype)
+		offsets = offsets[:len(skm)]
+
+		# the samples follow the info part, so work out where every sample starts from the sample count and size in each datagram
+		samplestart = offsets + self.KMALLPacketHeader_len + skm['numBytesInfoPart']
+		stride = skm['numBytesPerSample'].astype(np.int64)
+		# trap corrupt sample counts so we never read past the end of the datagram
+		datagramend = offsets + skm['numBytesDgm']
+		maxsamples = np.where(stride > 0, (datagramend - samplestart - self.EMdgmSKMsample_dtype.itemsize) // np.maximum(stride, 1) + 1, 0)
+		counts = np.clip(skm['numSamplesArray'], 0, np.maximum(maxsamples, 0))
+		first = np.cumsum(counts) - counts
+		sampleindex = np.arange(counts.sum()) - np.repeat(first, counts)
+		sampleoffsets = np.repeat(samplestart, counts) + sampleindex * np.repeat(stride, counts)
+
+		samples = fileutils.gatherrecords(raw, sampleoffsets, self.EMdgmSKMsample_dtype)
+		times = samples['time_sec'] + samples['time_nanosec'] / 1000000000
+		return times, samples['latitude_deg'], samples['longitude_deg'], samples['ellipsoidHeight_m'], samples['roll_deg'], samples['pitch_deg'], samples['heading_deg'], samples['heave_m']
+
 	###############################################################################
 	def readDatagramBytes(self, offset, byteCount):
 		'''read the entire raw bytes for the datagram without changing the file pointer.  this is used for file conditioning'''
@@ -446,24 +833,20 @@ class kmallreader:
 
 	###############################################################################
 	def getRecordCount(self, id=""):
-		'''read through the entire file as fast as possible to get a count of all records.  useful for progress bars so user can see what is happening'''
+		'''count the records, or only those whose type contains id, and report the first and last times.  useful for progress bars so user can see what is happening'''
 		count = 0
 		start = 0
 		end = 0
-		self.rewind()
-
-		numberofbytes, typeofdatagram, version, systemid, echosounderid, time_sec, time_nanosec, date = self.readDatagramHeader()
-		start = time_sec + time_nanosec/1000000000
-		self.rewind()
-		while self.moreData():
-			numberofbytes, typeofdatagram, version, systemid, echosounderid, time_sec, time_nanosec, date = self.readDatagramHeader()
-			self.fileptr.seek(numberofbytes, 1)
-			if id in typeofdatagram:
-				count += 1
-			if len(id) == 0:
-				count += 1
-		self.rewind()
-		end = time_sec + time_nanosec/1000000000
+		# the record index holds the type and time of every datagram, so there is no need to read the file
+		records = self.getindex()
+		if len(records) == 0:
+			return count, start, end
+		types, counts = np.unique(records['type'], return_counts=True)
+		for code, typecount in zip(types, counts):
+			if id in datagramtypename(code):
+				count += int(typecount)
+		start = float(records['timestamp'][0])
+		end = float(records['timestamp'][-1])
 		return count, start, end
 
 	###############################################################################
@@ -474,7 +857,18 @@ class kmallreader:
 		self.recordTime = time_sec + time_nanosec/1000000000
 		if numberofbytes == 0:
 			return "CORRUPT", None
-	
+		if self.buffer is not None:
+			# a truncated datagram cannot be mapped, so treat it as the end of the file
+			if self.fileptr.tell() + numberofbytes > self.fileSize:
+				return "CORRUPT", None
+			typeofdatagram, dg = self.createDatagram(typeofdatagram, numberofbytes)
+			dg.buffer = self.buffer[dg.offset:dg.offset + numberofbytes]
+			return typeofdatagram, dg
+		return self.createDatagram(typeofdatagram, numberofbytes)
+
+	###############################################################################
+	def createDatagram(self, typeofdatagram, numberofbytes):
+		'''create the datagram object for the datagram at the current file position.  This permits us to skip datagrams we do not support'''
 		if typeofdatagram == '#IIP': # Installation (Start)
 			dg = IIP_INSTALLATION(self.fileptr, numberofbytes)
 			return dg.typeofdatagram, dg
@@ -506,98 +900,40 @@ class kmallreader:
 		'''read the first position record so we have a clue where we are in the world'''
 		longitude = 0
 		latitude = 0
-		self.rewind()
-		while self.moreData():
-			try:
-				# print(self.fileptr.tell())
-				typeofdatagram, datagram = self.readDatagram()
-				if (typeofdatagram == '#SPO'):
-					datagram.read()
-					# trap bad values
-					if datagram.latitude < -90:
-						continue
-					if datagram.latitude > 90:
-						continue
-					if datagram.longitude < -180:
-						continue
-					if datagram.longitude > 180:
-						continue
-					longitude = datagram.longitude
-					latitude = datagram.latitude
-					break
-			except:
-				e = sys.exc_info()[0]
-				print("Error: %s.  Please check file.  it seems to be corrupt: %s" % (e, self.fileName))
-		self.rewind()
+		try:
+			times, longitudes, latitudes, headings = self.readpositions()
+			valid = np.flatnonzero(validpositions(longitudes, latitudes))
+			if len(valid) > 0:
+				longitude = float(longitudes[valid[0]])
+				latitude = float(latitudes[valid[0]])
+		except:
+			e = sys.exc_info()[0]
+			print("Error: %s.  Please check file.  it seems to be corrupt: %s" % (e, self.fileName))
 		return longitude, latitude
 
 ###############################################################################
 	def loadNavigation(self, firstRecordOnly=False, step=0):
 		'''loads all the navigation into lists'''
 		navigation 					= []
-		lastimestamp = 0
-		self.rewind()
-		while self.moreData():
-			try:
-				# print(self.fileptr.tell())
-				typeofdatagram, datagram = self.readDatagram()
-				if (typeofdatagram == 'CORRUPT'):
-					#we have seen corrupt kmall files when sis crashes.
-					self.rewind()
-					return navigation
-
-				if (typeofdatagram == '#SPO'):
-					if (self.recordTime - lastimestamp) < step:
-						# skip...  performance increase
-						continue
-					datagram.read()
-					# trap bad values
-					if datagram.latitude < -90:
-						continue
-					if datagram.latitude > 90:
-						continue
-					if datagram.longitude < -180:
-						continue
-					if datagram.longitude > 180:
-						continue
-					# timestamp, x, y, z, heading
-					navigation.append([to_timestamp(datagram.date), datagram.longitude, datagram.latitude, 0.0, datagram.heading])
-					lastimestamp = self.recordTime
-					if firstRecordOnly: #we only want the first record, so reset the file pointer and quit
-						self.rewind()
-						return navigation
-			except:
-				e = sys.exc_info()[0]
-				print("Error: %s.  Please check file.  it seems to be corrupt: %s" % (e, self.fileName))
-		self.rewind()
+		try:
+			# decode all the #SPO datagrams in one go, then trap bad values
+			navigation = positionstonavigation(*self.readpositions(), firstRecordOnly=firstRecordOnly, step=step)
+		except:
+			e = sys.exc_info()[0]
+			print("Error: %s.  Please check file.  it seems to be corrupt: %s" % (e, self.fileName))
 		return navigation
 
 ###############################################################################
 	def loadattitude(self):
 		'''loads all the attitude into list'''
 		attitude		= []
-		lastimestamp 	= 0
-		self.rewind()
-		while self.moreData():
-			try:
-				# print(self.fileptr.tell())
-				typeofdatagram, datagram = self.readDatagram()
-				if (typeofdatagram == 'CORRUPT'):
-					#we have seen corrupt kmall files when sis crashes.
-					self.rewind()
-					return attitude
-
-				if (typeofdatagram == '#SKM'):
-					datagram.read()
-					for sample in datagram.data:
-						timestamp = (sample[3] + sample[4]/1000000000)
-						# print (from_timestamp(timestamp), sample[4]/1000000000)
-						#time, x, y, z, roll, pitch, heading, heave
-						attitude.append([timestamp, sample[6], sample[7], sample[8], sample[9], sample[10], sample[11], sample[12]])
-			except:
-				e = sys.exc_info()[0]
-				print("Error: %s.  Please check file.  it seems to be corrupt: %s" % (e, self.fileName))
-		self.rewind()
+		try:
+			# decode all the #SKM samples in one go
+			#time, x, y, z, roll, pitch, heading, heave
+			attitude = np.column_stack(self.readattitudes()).tolist()
+		except:
+			e = sys.exc_info()[0]
+			print("Error: %s.  Please check file.  it seems to be corrupt: %s" % (e, self.fileName))
 		return attitude
 
 ###############################################################################
@@ -605,11 +941,10 @@ class kmallreader:
 		'''loads all the navigation from the PING into list so we can save as ASCII and inject into CARIS'''
 		pingnavigation 					= []
 		lastimestamp = 0
-		self.rewind()
-		
-		while self.moreData():
+		# use the record index to go straight to the #MRZ datagrams
+		for offset in self.getoffsets('#MRZ'):
 			try:
-				# print(self.fileptr.tell())
+				self.fileptr.seek(offset, 0)
 				typeofdatagram, datagram = self.readDatagram()
 				if (typeofdatagram == 'CORRUPT'):
 					#we have seen corrupt kmall files when sis crashes.
@@ -654,11 +989,10 @@ class kmallreader:
 		pingdata		= []
 		lastimestamp 	= 0
 		
-		self.rewind()
-		
-		while self.moreData():
+		# use the record index to go straight to the #MRZ datagrams
+		for offset in self.getoffsets('#MRZ'):
 			try:
-				# print(self.fileptr.tell())
+				self.fileptr.seek(offset, 0)
 				typeofdatagram, datagram = self.readDatagram()
 				if (typeofdatagram == 'CORRUPT'):
 					#we have seen corrupt kmall files when sis crashes.
@@ -1253,36 +1587,25 @@ class RANGEDEPTH:
 
 		# DECODE THE SOUNDINGS
 		# Data for each sounding, e.g. XYZ, reflectivity, two way travel time etc.
-		EMdgmMRZ_sounding_def = "HB 7BH6f 2Hf 4f 7f 6fH 3H"
-		rec_fmt = EMdgmMRZ_sounding_def
-		rec_len = struct.calcsize(rec_fmt)
-		rec_unpack = struct.Struct(rec_fmt).unpack
-
-		beams = []
+		# all the soundings are decoded in one go into a numpy structured array, so self.soundings['z_reRefPoint_m'] is the column of depths for the ping
+		self.timestamp = to_timestamp(self.date)
+		self.numBytesPerSounding = max(self.numBytesPerSounding, kmallreader.EMdgmMRZ_sounding_dtype.itemsize)
+		self.soundingbyteoffset = self.fileptr.tell() - self.offset	# remember where the soundings reside in the DATAGRAM BYTES so we can modify if needed
+		data = self.fileptr.read(self.numSoundingsMaxMain * self.numBytesPerSounding)
+		self.soundings = np.ndarray(shape=(self.numSoundingsMaxMain,), dtype=kmallreader.EMdgmMRZ_sounding_dtype, buffer=data, strides=(self.numBytesPerSounding,))
 
-		timestamp = to_timestamp(self.date)
-		for i in range(self.numSoundingsMaxMain):
-			beambyteoffset = self.fileptr.tell() - self.offset	# remember where this packet resides in the DATAGRAM BYTES so we can modify if needed
-			# beambyteoffset = (i * rec_len)	# remember where this packet resides in the DATAGRAM BYTES so we can modify if needed
-			s = rec_unpack(self.fileptr.read(rec_len))
-			beam = cBeam(timestamp, s, beambyteoffset)
-			beams.append(beam)
-
-		self.beams = beams
 		# DECODE SIDESCAN INTENSITY
-		SInumsamples = sum(beam.SInumSamples for beam in beams)
-		SIsample_desidB = "%sh" % (SInumsamples)
-		# SIsample_desidB = "%sh" % (kmallreader.MAX_SIDESCAN_SAMP)
-		rec_fmt = SIsample_desidB
-		rec_len = struct.calcsize(rec_fmt)
-		rec_unpack = struct.Struct(rec_fmt).unpack
-		s = rec_unpack(self.fileptr.read(rec_len))
-
-		self.SInumSamples 					= SInumsamples # s[0]
+		# we only need the count of the seabed image samples which follow the soundings
+		self.SInumSamples 					= int(self.soundings['SInumSamples'].sum())
 
 		# reset the file pointer to the end of the packet.  for some reasdon we are 4 bytes out??? pkpk
 		self.fileptr.seek(self.offset + self.numberofbytes, 0)
 
+	################################################################################################	
+	def getbeams(self):
+		'''return the soundings as a list of cBeam objects.  this is slow, so only use it when you need per beam objects'''
+		return [cBeam(self.timestamp, sounding, self.soundingbyteoffset + (i * self.numBytesPerSounding)) for i, sounding in enumerate(self.soundings.tolist())]
+
 ###############################################################################
 class POSITION:
 	def __init__(self, fileptr, numberofbytes):
@@ -1690,6 +2013,18 @@ def dateToSecondsSinceMidnight(dateObject):
 
 ###############################################################################
 # bitwise helper functions
+###############################################################################
+def datagramtypecode(typeofdatagram):
+	'''the 4 character datagram type as an integer so it can be stored in the record index'''
+	if isinstance(typeofdatagram, str):
+		typeofdatagram = typeofdatagram.encode('utf-8')
+	return int.from_bytes(typeofdatagram[:4].ljust(4, b'\x00'), 'little')
+
+###############################################################################
+def datagramtypename(typecode):
+	'''the 4 character datagram type from its record index integer'''
+	return int(typecode).to_bytes(4, 'little').decode('utf-8', errors='ignore').rstrip('\x00')
+
 ###############################################################################
 def isBitSet(int_type, offset):
 	'''testBit() returns a nonzero result, 2**offset, if the bit at 'offset' is one.'''
@@ -3,6 +3,7 @@ import sys
 import multiprocessing
 import ctypes
 import logging
+import queue
 from datetime import datetime, timedelta
 
 
@@ -21,6 +22,51 @@ def mpresult(msg):
 	# g_procprogress.increment_progress(os.path.basename(msg))
 	g_procprogress.increment_progress()
 
+###############################################################################
+def imap_bounded(pool, func, tasks, maxpending):
+	'''like pool.imap_unordered, but never more than maxpending tasks are queued or waiting to be consumed.  this keeps memory bounded when the consumer is slower than the workers.
+	the first maxpending tasks are submitted before this returns, so the pool is already working while the caller does something else before it starts on the results'''
+	results = queue.Queue()
+	tasks = iter(tasks)
+	pending = [0]
+
+	def submit():
+		while pending[0] < maxpending:
+			task = next(tasks, None)
+			if task is None:
+				break
+			pool.apply_async(func, (task,), callback=results.put, error_callback=results.put)
+			pending[0] += 1
+
+	def consume():
+		while True:
+			submit()
+			if pending[0] == 0:
+				return
+			result = results.get()
+			pending[0] -= 1
+			if isinstance(result, BaseException):
+				log("Error: %s" % (result), error=True)
+				continue
+			yield result
+
+	submit()
+	return consume()
+
+###############################################################################
+def mp_decoderanges(worker, filename, byteranges, cpu, *args):
+	'''decode one big file in parallel.  the worker is called with (filename, startbyte, endbyte, *args) for every byte range in a process pool.  the results come back in file order so they can simply be concatenated'''
+	tasks = [(filename, startbyte, endbyte) + args for startbyte, endbyte in byteranges]
+	if int(cpu) <= 1 or len(tasks) <= 1:
+		return [worker(task) for task in tasks]
+	pool = multiprocessing.Pool(min(int(cpu), len(tasks)))
+	try:
+		results = pool.map(worker, tasks)
+	finally:
+		pool.close()
+		pool.join()
+	return results
+
 ###############################################################################
 def getcpucount(requestedcpu):
 	'''control how many CPU's we use for multi processing'''
@@ -8,12 +8,15 @@
 
 import ctypes
 import math
+import mmap
 import pprint
 import struct
 import os.path
 import time
 from datetime import datetime
 from datetime import timedelta
+import numpy as np
+import fileutils
 
 def main():
 	#open the ALL file for reading by creating a new s7kReader class and passin in the filename to open.
@@ -55,6 +58,16 @@ class s7kreader:
 	# packetheader_fmt = '=2H4L2HF2HH2L2HL' #do not include anything beyond the total records in fragmented data record set.  stop header at the 2 reserved words
 	packetheader_len = struct.calcsize(packetheader_fmt)
 	packetheader_unpack = struct.Struct(packetheader_fmt).unpack_from
+	INDEXVERSION = 2 # bump this whenever the record index changes so the sidecar files are rebuilt
+	SYNCPATTERN = 0x0000FFFF
+	frame_unpack = struct.Struct('<2L').unpack_from # sync pattern and record size, 4 bytes into the frame
+
+	# the same frame header as packetheader_fmt, as a numpy dtype so many records can be decoded in one go
+	packetheader_dtype = np.dtype([('protocolversion', '<u2'), ('offset', '<u2'), ('syncpattern', '<u4'), ('numberofbytes', '<u4'), ('optionaldataoffset', '<u4'), ('optionaldataidentifier', '<u4'),
+		('year', '<u2'), ('day', '<u2'), ('seconds', '<f4'), ('hours', 'i1'), ('minutes', 'i1'), ('recordversion', '<u2'), ('recordtypeidentifier', '<u4'), ('deviceidentifier', '<u4'),
+		('reserved', '<u2'), ('systemenumerator', '<u2'), ('reserved2', '<u4'), ('flags', '<u2'), ('reserved3', '<u2'), ('reserved4', '<u4'), ('totalrecords', '<u4'), ('fragmentnumber', '<u4')])
+	P_1003_dtype = np.dtype(packetheader_dtype.descr + [('datumidentifier', '<u4'), ('latency', '<f4'), ('latitude', '<f8'), ('longitude', '<f8'), ('height', '<f8'),
+		('positiontypeflag', 'u1'), ('utmzone', 'u1'), ('qualityflag', 'u1'), ('positionmethod', 'u1')])
 
 	def __init__(self, filename=None):
 		if filename is not None:
@@ -66,6 +79,7 @@ class s7kreader:
 			self.recordDate = ""
 			self.recordTime = ""
 			self.recordCounter=0
+			self.index = None
 
 	def __str__(self):
 		return pprint.pformat(vars(self))
@@ -181,21 +195,62 @@ class s7kreader:
 		return data
 
 	def getRecordCount(self):
-		'''read through the entire file as fast as possible to get a count of all records.  useful for progress bars so user can see what is happening'''
-		count = 0
-		start = 0
-		end = 0
-		self.rewind()
-		numberOfBytes, readdatagramheader, recorddate = self.readdatagramheader()
-		start = recorddate # to_timestamp(to_DateTime(RecordDate, RecordTime))
-		self.rewind()
-		while self.moreData():
-			numberOfBytes, STX, typeOfDatagram, EMModel, RecordDate, RecordTime = self.readdatagramheader()
-			self.fileptr.seek(numberOfBytes, 1)
-			count += 1
+		'''count all records in the file and report the first and last times, straight from the record index.  useful for progress bars so user can see what is happening'''
+		records = self.getindex()
+		if len(records) == 0:
+			return 0, 0, 0
+		return len(records), float(records['timestamp'][0]), float(records['timestamp'][-1])
+
+	def buildindex(self):
+		'''make one pass through the file to build the record index of type, offset, length and time.  only the sync pattern and size of each frame are read while walking the file, the frame headers are then decoded in one go'''
+		offsets = []
+		if self.fileSize > 0:
+			with mmap.mmap(self.fileptr.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+				offset = 0
+				while offset + self.packetheader_len <= self.fileSize:
+					syncpattern, numberOfBytes = self.frame_unpack(buffer, offset + 4)
+					#trap corrupt datagram (we have seen these)
+					if syncpattern != self.SYNCPATTERN or numberOfBytes == 0 or offset + numberOfBytes > self.fileSize:
+						break
+					offsets.append(offset)
+					offset += numberOfBytes
+		headers = fileutils.gatherrecords(np.memmap(self.fileName, dtype=np.uint8, mode='r') if self.fileSize > 0 else np.empty(0, dtype=np.uint8), offsets, self.packetheader_dtype)
+		records = np.empty(len(headers), dtype=fileutils.RECORDINDEXDTYPE)
+		records['type'] = headers['recordtypeidentifier']
+		records['offset'] = offsets[:len(headers)]
+		records['length'] = headers['numberofbytes']
+		records['timestamp'] = to_timestamps(headers)
+		return records
+
+	def getindex(self):
+		'''return the record index for the file.  it is loaded from the sidecar file if there is an up to date one, otherwise built and saved'''
+		if self.index is None:
+			self.index = fileutils.loadrecordindex(self.fileName, self.buildindex, self.INDEXVERSION)
+		return self.index
+
+	def getoffsets(self, recordtypeidentifier):
+		'''return the file offsets of every record of the requested type, using the record index'''
+		return fileutils.recordsoftype(self.getindex(), int(recordtypeidentifier))['offset'].tolist()
+
+	def readpositions(self):
+		'''batch decode every 1003 position record in the file.  returns column arrays of time, longitude, latitude, height.  no per record python objects are created'''
+		offsets = self.getoffsets(1003)
+		if len(offsets) == 0:
+			return np.empty(0), np.empty(0), np.empty(0), np.empty(0)
+		positions = fileutils.gatherrecords(np.memmap(self.fileName, dtype=np.uint8, mode='r'), offsets, self.P_1003_dtype)
+		latitudes = positions['latitude'] * 180 / math.pi
+		longitudes = positions['longitude'] * 180 / math.pi
+		return to_timestamps(positions), longitudes, latitudes, positions['height']
+
+	def read_window(self, start_time, end_time, recordtypeidentifier=None):
+		'''yield (typeOfDatagram, datagram) for every record timed start_time <= time <= end_time, optionally of one type only.  the record index is binary searched so only the records in the window are read from disc'''
+		records = fileutils.recordsinwindow(self.getindex(), start_time, end_time)
+		if recordtypeidentifier is not None:
+			records = fileutils.recordsoftype(records, int(recordtypeidentifier))
+		for offset in records['offset'].tolist():
+			self.fileptr.seek(offset, 0)
+			yield self.readdatagram()
 		self.rewind()
-		end = to_timestamp(to_DateTime(RecordDate, RecordTime))
-		return count, start, end
 
 	def readdatagram(self):
 		'''read the datagram header.  This permits us to skip datagrams we do not support'''
@@ -257,17 +312,11 @@ class s7kreader:
 ###############################################################################
 	def loadNavigation(self, firstRecordOnly=False):
 		'''loads all the navigation into lists'''
-		navigation 					= []
-		selectedPositioningSystem 	= None
-		self.rewind()
-		while self.moreData():
-			typeOfDatagram, datagram = self.readdatagram()
-			if typeOfDatagram == '1003':
-				datagram.read()
-				#print (datagram.data, datagram.latitude, datagram.longitude)
-				self.fileptr.seek(datagram.offset + datagram.numberOfBytes, 0)# move the file pointer to the start of the record so we can read from disc
-				navigation.append([to_timestamp(datagram.recorddate), datagram.longitude, datagram.latitude])
-		self.rewind()
+		# the 1003 position records are found from the record index and decoded in one batch
+		times, longitudes, latitudes, heights = self.readpositions()
+		navigation = np.column_stack((times, longitudes, latitudes)).tolist()
+		if firstRecordOnly:
+			navigation = navigation[:1]
 		return navigation
 
 	# def getDatagramName(self, typeOfDatagram):
@@ -1264,6 +1313,10 @@ class s7kreader:
 
 ###############################################################################
 class P_1003:
+	rec_fmt = s7kreader.packetheader_fmt + 'Lfddd4B'
+	rec_len = struct.calcsize(rec_fmt)
+	rec_unpack = struct.Struct(rec_fmt).unpack
+
 	def __init__(self, fileptr, numberOfBytes, recorddate):
 		self.recordtypeidentifier = '1003'	# assign the code for this datagram type
 		self.offset = fileptr.tell()	# remember where this packet resides in the file so we can return if needed
@@ -1275,12 +1328,7 @@ class P_1003:
 
 	def read(self):
 		self.fileptr.seek(self.offset, 0)# move the file pointer to the start of the record so we can read from disc
-		hdr = s7kreader().packetheader_fmt
-		rec_fmt = hdr + 'Lfddd4B'
-		rec_len = struct.calcsize(rec_fmt)
-		rec_unpack = struct.Struct(rec_fmt).unpack
-		# bytesRead = rec_len
-		s = rec_unpack(self.fileptr.read(rec_len))
+		s = self.rec_unpack(self.fileptr.read(self.rec_len))
 		
 		self.datumidentifier 	= s[22]
 		self.latency	  		= s[23]
@@ -1850,6 +1898,11 @@ class UNKNOWN_RECORD:
 def to_timestamp(dateObject):
 	return (dateObject - datetime(1970, 1, 1)).total_seconds()
 
+def to_timestamps(headers):
+	'''return float unix timestamps from the 7k time fields of an array of frame headers, computed arithmetically rather than through datetime objects'''
+	days = (headers['year'].astype(np.int64) - 1970).astype('datetime64[Y]').astype('datetime64[D]').astype(np.int64) + headers['day'] - 1
+	return (days * 86400.0) + (headers['hours'] * 3600.0) + (headers['minutes'] * 60.0) + headers['seconds'].astype(np.float64)
+
 def to_DateTime(recordDate, recordTime):
 	'''return a python date object from a split date and time record. works with kongsberg date and time structures'''
 	date_object = datetime.strptime(str(recordDate), '%Y%m%d') + timedelta(0,recordTime)
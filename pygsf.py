@@ -21,7 +21,9 @@
 # ATTITUDE								= 12
 
 import os.path
+import mmap
 import struct
+import io
 import pprint
 import time
 import datetime
@@ -34,6 +36,8 @@ from statistics import mean
 # from delivershared import log as log, makedirs
 # for testing only...
 import numpy as np
+import fileutils
+import multiprocesshelper
 
 #/* The high order 4 bits are used to define the field size for this array */
 GSF_FIELD_SIZE_DEFAULT  = 0x00  #/* Default values for field size are used used for all beam arrays */
@@ -100,6 +104,41 @@ SYSTEM_CLEANING_ARRAY    			=	25
 DOPPLER_CORRECTION_ARRAY    		=	26
 SONAR_VERT_UNCERTAINTY_ARRAY    	=	27
 SCALE_FACTORS     					=	100
+
+# the ping arrays we decode.  subrecord id : attribute name on the ping
+PINGARRAYS = {
+	DEPTH_ARRAY					: 'DEPTH_ARRAY',
+	ACROSS_TRACK_ARRAY			: 'ACROSS_TRACK_ARRAY',
+	ALONG_TRACK_ARRAY			: 'ALONG_TRACK_ARRAY',
+	TRAVEL_TIME_ARRAY			: 'TRAVEL_TIME_ARRAY',
+	BEAM_ANGLE_ARRAY			: 'BEAM_ANGLE_ARRAY',
+	MEAN_CAL_AMPLITUDE_ARRAY	: 'MEAN_CAL_AMPLITUDE_ARRAY',
+	MEAN_REL_AMPLITUDE_ARRAY	: 'MEAN_REL_AMPLITUDE_ARRAY',
+	QUALITY_FACTOR_ARRAY		: 'QUALITY_FACTOR_ARRAY',
+	QUALITY_FLAGS_ARRAY			: 'QUALITY_FLAGS_ARRAY',
+	BEAM_FLAGS_ARRAY			: 'BEAM_FLAGS_ARRAY',
+	BEAM_ANGLE_FORWARD_ARRAY	: 'BEAM_ANGLE_FORWARD_ARRAY',
+	VERTICAL_ERROR_ARRAY		: 'VERTICAL_ERROR_ARRAY',
+	HORIZONTAL_ERROR_ARRAY		: 'HORIZONTAL_ERROR_ARRAY',
+	SECTOR_NUMBER_ARRAY			: 'SECTOR_NUMBER_ARRAY',
+}
+
+# numpy dtypes for the struct style data types from getdatatype.  gsf is big endian, and numpy 'L' is 8 bytes on some platforms so be explicit
+ARRAYDTYPES = {
+	'b'	: np.dtype('i1'),
+	'B'	: np.dtype('u1'),
+	'h'	: np.dtype('>i2'),
+	'H'	: np.dtype('>u2'),
+	'l'	: np.dtype('>i4'),
+	'L'	: np.dtype('>u4'),
+}
+
+PINGHEADER = struct.Struct('>llll5hlH3h2Hlllh')
+SUBRECORDHEADER = struct.Struct('>L')
+
+# the sidecar of the pings which carry scale factors, alongside the record index sidecar
+SCALEFACTORINDEXSUFFIX = ".scalefactorindex.npz"
+
 # SEABEAM_SPECIFIC    				=	102
 # EM12_SPECIFIC     					=	103
 # EM100_SPECIFIC    					=	104
@@ -162,10 +201,32 @@ SCALE_FACTORS     					=	100
 ###############################################################################
 def main():
 
-	# testR2SonicAdjustment()
+	testR2SonicAdjustment()
 	testreader()
 	# conditioner()
 
+###############################################################################
+def testR2SonicAdjustment():
+	'''
+	confirm the array form of the R2Sonic backscatter adjustment matches the scalar port of the CSIRO F77 code beam for beam
+	'''
+	ping = SWATH_BATHYMETRY_PING(io.BytesIO(), 0, SWATH_BATHYMETRY, 0)
+	H0 = (197.0, 1468.59, 80.0, 0.0174533, 0.0087266, 0.000275, 35.0, 8.0, -21.0 / 100.)
+
+	# the reference beam from Norm Campbell plus a sweep across the swath, including normal incidence and a zero range beam
+	S1_angle = np.concatenate(([-58.0, 0.0, 0.0005, 24.9, 25.0], np.linspace(-75, 75, 251)))
+	S1_twtt = np.concatenate(([0.20588, 0.1, 0.1, 0.0, 0.15], np.linspace(0.01, 0.4, 251)))
+	S1_range = S1_twtt / 2.0 * H0[1]
+	S1_uPa = np.concatenate(([470, 1, 65535, 470, 470], np.linspace(1, 60000, 251)))
+
+	expected = np.array([ping.backscatteradjustment(a, t, r, m, *H0) for a, t, r, m in zip(S1_angle, S1_twtt, S1_range, S1_uPa)])
+	adjusted = ping.backscatteradjustments(S1_angle, S1_twtt, S1_range, S1_uPa, *H0)
+	if not np.allclose(adjusted, expected, rtol=1e-12, atol=1e-9):
+		print ("Error: vectorised R2Sonic backscatter adjustment differs from the scalar version by %.3e dB" % (np.max(np.abs(adjusted - expected))))
+		return False
+	print ("R2Sonic backscatter adjustment OK, %d beams, max difference %.3e dB" % (len(adjusted), np.max(np.abs(adjusted - expected))))
+	return True
+
 ###############################################################################
 def testreader():
 	'''
@@ -450,17 +511,16 @@ class SWATH_BATHYMETRY_PING :
 	# SB_PDD_SPECIFIC   (obsolete)          211
 	# SB_NAVISOUND_SPECIFIC   (obsolete)    212
 	###############################################################################
-	def read(self, previousscalefactors={}, headeronly=False):
+	def read(self, previousscalefactors=None, headeronly=False):
+		'''
+		decode the ping.  the whole record is read in one go and every beam array is decoded straight from the bytes with np.frombuffer.
+		the scale factors are not on every ping, so by default we use the scale factors of the reader, which carry forward from ping to ping
+		'''
+		self.fileptr.seek(self.offset + self.hdrlen, 0)   # move the file pointer to the start of the record so we can read from disc			  
+		data = self.fileptr.read(self.numbytes - self.hdrlen)
 
 		# read ping header
-		hdrfmt = '>llll5hlH3h2Hlllh'
-		hdrlen = struct.calcsize(hdrfmt)
-		rec_unpack = struct.Struct(hdrfmt).unpack
-
-		self.fileptr.seek(self.offset + self.hdrlen, 0)   # move the file pointer to the start of the record so we can read from disc			  
-		# self.fileptr.seek(self.offset + self.hdrlen , 0)   # move the file pointer to the start of the record so we can read from disc			  
-		data = self.fileptr.read(hdrlen)
-		s = rec_unpack(data)
+		s = PINGHEADER.unpack_from(data, 0)
 		self.time 			= s[0] 
 		self.pingnanotime 	= s[1] 
 		self.timestamp		= self.time + (self.pingnanotime/1000000000)
@@ -484,48 +544,29 @@ class SWATH_BATHYMETRY_PING :
 		self.spare			= s[19]
 
 		# SCALE FACTORS ARE NOT ON EVERYPING SO CARRY FORWARDS
-		self.scalefactorsd = previousscalefactors
+		if previousscalefactors is not None:
+			self.scalefactorsd = previousscalefactors
 
 		# skip the record for performance reasons.  Very handy in some circumstances
 		if headeronly:
 			self.fileptr.seek(self.offset + self.numbytes, 0) #move forwards to the end of the record as we cannot trust the record length from the 2024
-			return
+			return self.scalefactorsd
 
-		while (self.fileptr.tell() <= self.offset + self.numbytes): #dont read past the end of the packet length.  This should never happen!
-			subrecfmt = '>l'
-			subrecfmtlen = struct.calcsize(subrecfmt)
-			subrecrec_unpack = struct.Struct(subrecfmt).unpack
-			data = self.fileptr.read(subrecfmtlen)   # read the record from disc
-			s = subrecrec_unpack(data)
-
-			subrecord_id = (s[0] & 0xFF000000) >> 24
-			subrecord_size = s[0] & 0x00FFFFFF
-			# print("id %d size %d" % (subrecord_id, subrecord_size))
-				# if subrecord_id == 21: 
-				# 	self.fileptr.seek(self.offset + self.numbytes, 0) #move forwards to the end of the record as we cannot trust the record length from the 2024
-				# else:
-				# 	self.fileptr.seek(subrecord_size, 1) #move forwards to the end of teh record
-				# continue
+		position = PINGHEADER.size
+		while position + SUBRECORDHEADER.size <= len(data): #dont read past the end of the packet length.
+			s = SUBRECORDHEADER.unpack_from(data, position)[0]
+			position += SUBRECORDHEADER.size
+			subrecord_id = (s & 0xFF000000) >> 24
+			subrecord_size = s & 0x00FFFFFF
 
 			# now decode the subrecord
-			# curr = self.fileptr.tell()
 			if subrecord_id == SCALE_FACTORS:
-				self.readscalefactorrecord()
-				continue
-
-			# 	for s in self.scalefactors:
-			# 		if s.subrecordID == 1:
-			# 			print (s.subrecordID, s.multiplier, s.offset, s.compressionFlag)
-			# 	continue
-			# else:
-				# scale, offset, compressionFlag, datatype = self.getscalefactor(subrecord_id, subrecord_size / int(self.numbeams))
-
-			if subrecord_id == 0:
-				self.fileptr.seek(subrecord_size, 1) #move forwards to the end of teh record
+				position = self.decodescalefactors(data, position)
 				continue
 
-			if subrecord_id > len(self.scalefactorsd):
-				self.fileptr.seek(subrecord_size, 1) #move forwards to the end of teh record
+			# skip records we do not have scale factors for
+			if subrecord_id == 0 or subrecord_id > len(self.scalefactorsd) or subrecord_id not in self.scalefactorsd or self.numbeams == 0:
+				position += subrecord_size #move forwards to the end of the record
 				continue
 
 			sf = self.scalefactorsd[subrecord_id]
@@ -533,62 +574,22 @@ class SWATH_BATHYMETRY_PING :
 
 			# skip records we do not support
 			if datatype == -999:
-				self.fileptr.seek(subrecord_size, 1) #move forwards to the end of teh record
+				position += subrecord_size #move forwards to the end of the record
 				continue
 
-			if subrecord_id == 1: 
-				# scale, offset, compressionFlag, datatype = self.getscalefactor(subrecord_id, subrecord_size / int(self.numbeams))
-				# print (sf.multiplier, sf.offset)
-				# print ("DEPTH ARRAY")
-				self.DEPTH_ARRAY = self.readarray(sf.multiplier, sf.offset, datatype)
-			elif subrecord_id == 2: 
-				# print ("ACROSS ARRAY")
-				self.ACROSS_TRACK_ARRAY = self.readarray(sf.multiplier, sf.offset, datatype)
-			elif subrecord_id == 3: 
-				# print ("ALONG ARRAY")
-				self.ALONG_TRACK_ARRAY = self.readarray(sf.multiplier, sf.offset, datatype)
-			elif subrecord_id == 4: 
-				# print ("TT ARRAY")
-				self.TRAVEL_TIME_ARRAY = self.readarray(sf.multiplier, sf.offset, datatype)
-			elif subrecord_id == 5: 
-				# print ("BA ARRAY")
-				self.BEAM_ANGLE_ARRAY = self.readarray(sf.multiplier, sf.offset, datatype)
-			elif subrecord_id == 6: 
-				# print ("MC ARRAY")
-				self.MEAN_CAL_AMPLITUDE_ARRAY = self.readarray(sf.multiplier, sf.offset, datatype)
-			elif subrecord_id == 7: 
-				# print ("MR ARRAY")
-				self.MEAN_REL_AMPLITUDE_ARRAY = self.readarray(sf.multiplier, sf.offset, datatype)
-			elif subrecord_id == 9: 
-				# print ("QF ARRAY")
-				self.QUALITY_FACTOR_ARRAY = self.readarray(sf.multiplier, sf.offset, datatype)
-			elif subrecord_id == 15: 
-				# print ("QF ARRAY")
-				self.QUALITY_FLAGS_ARRAY = self.readarray(sf.multiplier, sf.offset, datatype)
-			elif subrecord_id == 16: 
-				# print ("BF ARRAY")
-				self.BEAM_FLAGS_ARRAY = self.readarray(sf.multiplier, sf.offset, datatype)
-			elif subrecord_id == 18: 
-				# print ("BA ARRAY")
-				self.BEAM_ANGLE_FORWARD_ARRAY = self.readarray(sf.multiplier, sf.offset, datatype)
-			elif subrecord_id == 19: 
-				# print ("VA ARRAY")
-				self.VERTICAL_ERROR_ARRAY = self.readarray(sf.multiplier, sf.offset, datatype)
-			elif subrecord_id == 20: 
-				# print ("VE ARRAY")
-				self.VERTICAL_ERROR_ARRAY = self.readarray(sf.multiplier, sf.offset, datatype)
-			elif subrecord_id == 21: 
-				before = self.fileptr.tell()
-				# print ("SN ARRAY")
+			if subrecord_id in PINGARRAYS:
+				setattr(self, PINGARRAYS[subrecord_id], self.readarray(sf.multiplier, sf.offset, datatype, data, position))
+				position += subrecord_size
+			elif subrecord_id == INTENSITY_SERIES_ARRAY: 
+				# the snippets are decoded from the file as we cannot trust the subrecord length from the 2024
+				self.fileptr.seek(self.offset + self.hdrlen + position, 0)
 				self.SNIPPET_SERIES_ARRAY = self.readintensityarray(sf.multiplier, sf.offset, datatype, self.snippettype)
+				position = self.fileptr.tell() - self.offset - self.hdrlen
 				if subrecord_size % 4 > 0:
-					self.fileptr.seek(4 - (subrecord_size % 4), 1) #pkpk we should not need this!!!
-			elif subrecord_id == 22: 
-				# print ("SE ARRAY")
-				self.SECTOR_NUMBER_ARRAY = self.readarray(sf.multiplier, sf.offset, datatype)
+					position += 4 - (subrecord_size % 4) #pkpk we should not need this!!!
 			else:
 				# read to the end of the record to keep in alignment.  This permits us to not have all the decodes in place
-				self.fileptr.seek(subrecord_size, 1) #move forwards to the end of teh record
+				position += subrecord_size #move forwards to the end of the record
 			
 		self.fileptr.seek(self.offset + self.numbytes, 0) #move forwards to the end of the record as we cannot trust the record length from the 2024
 		
@@ -743,24 +744,28 @@ class SWATH_BATHYMETRY_PING :
 	# 	return 1,0,0, 'h'
 	###############################################################################
 	def readscalefactorrecord(self):
+		'''
+		read the scale factor subrecord from the current file position
+		'''
 		# /* First four byte integer contains the number of scale factors */
-		# now read all scale factors
-		scalefmt = '>l'
-		scalelen = struct.calcsize(scalefmt)
-		rec_unpack = struct.Struct(scalefmt).unpack
+		data = self.fileptr.read(4)
+		numscalefactors = struct.unpack('>l', data)[0]
+		data += self.fileptr.read(numscalefactors * 12)
+		self.decodescalefactors(data, 0)
 
-		data = self.fileptr.read(scalelen)
-		s = rec_unpack(data)
-		self.numscalefactors = s[0]
-
-		scalefmt = '>lll'
-		scalelen = struct.calcsize(scalefmt)
-		rec_unpack = struct.Struct(scalefmt).unpack
+	###############################################################################
+	def decodescalefactors(self, data, position):
+		'''
+		decode the scale factor subrecord from the ping bytes and update the scale factors in place so they carry forward to the following pings.  returns the position after the subrecord
+		'''
+		# /* First four byte integer contains the number of scale factors */
+		self.numscalefactors = struct.unpack_from('>l', data, position)[0]
+		position += 4
+		# now read all scale factors
+		values = np.frombuffer(data, dtype='>i4', count=self.numscalefactors * 3, offset=position).reshape(-1, 3).tolist()
+		position += self.numscalefactors * 12
 
-		# self.scalefactorsd = {}
-		for i in range(self.numscalefactors):
-			data = self.fileptr.read(scalelen)
-			s = rec_unpack(data)
+		for s in values:
 			sf = SCALEFACTOR()
 			sf.subrecordID = (s[0] & 0xFF000000) >> 24;
 			sf.compressionFlag = (s[0] & 0x00FF0000) >> 16;
@@ -810,6 +815,7 @@ class SWATH_BATHYMETRY_PING :
 
 			# print (sf.subrecordID, sf.compressionFlag, sf.multiplier, sf.offset)
 			self.scalefactorsd[sf.subrecordID] = sf
+		return position
 
 		# self.scalefactors=[]
 		# for i in range(self.numscalefactors):
@@ -825,9 +831,11 @@ class SWATH_BATHYMETRY_PING :
 		# return self.scalefactors
 
 	###############################################################################
-	def readintensityarray(self, snippets, scale, offset, datatype, snippettype):
+	def readintensityarray(self, scale, offset, datatype, snippettype):
 		''' 
-		read the time series intensity array type 21 subrecord
+		read the time series intensity array type 21 subrecord.  The samples for all beams are decoded into a single ragged array 
+		(self.snippetsamples) with per beam start offsets (self.snippetoffsets) so the reduction to a single value per beam 
+		is performed across all beams at once.
 		'''
 		hdrfmt = '>bl16s'
 		hdrlen = struct.calcsize(hdrfmt)
@@ -840,63 +848,76 @@ class SWATH_BATHYMETRY_PING :
 		# before we decode the intentisty data, read the sensor specific header
 		#for now just read the r2sonic as that is what we need.  For other sensors we need to implement decodes
 		self.decodeR2SonicImagerySpecific()
-		
-		for b in range(self.numbeams):
-			hdrfmt = '>hh8s'
-			hdrlen = struct.calcsize(hdrfmt)
-			rec_unpack = struct.Struct(hdrfmt).unpack
-			hdr = self.fileptr.read(hdrlen)
-			s = rec_unpack(hdr)
-			
-			numsamples = s[0]
-			bottomdetectsamplenumber = s[1]
-			spare = s[2]
 
-			fmt = '>' + str(numsamples) + 'H'
-			l = struct.calcsize(fmt)
-			rec_unpack = struct.Struct(fmt).unpack
-			
-			data = self.fileptr.read(l)  
-			raw = rec_unpack(data)
-			# strip out zero values
-			raw = [s for s in raw if s != 0]
-
-			if snippettype == SNIPPET_NONE:
-				snippets.append(0)
-				continue
-			elif snippettype == SNIPPET_MEAN5DB:
-				# populate the array with the mean of all samples withing a 5dB range of the mean.  As per QPS
-				if len(raw) > 0:
-					raw2 = [20.0 * math.log10(s / scale + offset) for s in raw]
-					mean = (sum(raw2) / float(len(raw2) ))
-					highcut = [s for s in raw2 if s < mean + 5] #high cut +5dB
-					highlowcut = [s for s in highcut if s > mean - 5] #low cut -5dB
-				else:
-					snippets.append(0)
-					continue
-				if len(highlowcut) > 0:
-					snippets.append((sum(highlowcut) / float(len(highlowcut) / scale) + offset))
-				else:
-					snippets.append((mean / scale) + offset)
-			elif snippettype == SNIPPET_MEAN:
-				# populate the array with the mean of all samples	 
-				if len(raw) > 0:
-					snippets.append((sum(raw) / float(len(raw) / scale) + offset))
-				else:
-					snippets.append(0)
-			elif snippettype == SNIPPET_MAX:
-				# populate the array with the MAX of all samples	 
-				if len(raw) > 0:
-					snippets.append(max(raw) / scale + offset)
-				else:
-					snippets.append(0)
-			elif snippettype == SNIPPET_MEAN:
-				# populate with a single value as identified by the bottom detect
-				if bottomdetectsamplenumber > 0:
-					snippets.append ((raw[bottomdetectsamplenumber] / scale) + offset)
-				else:
-					snippets.append (0)
-		return
+		# read the remainder of the record in one go and walk the beam headers.  We cannot trust the subrecord length from the 2024
+		start = self.fileptr.tell()
+		data = self.fileptr.read(max(0, self.offset + self.numbytes - start))
+		beamheader = struct.Struct('>hh8s')
+		counts = np.zeros(self.numbeams, dtype=np.int64)
+		bottomdetect = np.zeros(self.numbeams, dtype=np.int64)
+		starts = np.zeros(self.numbeams, dtype=np.int64)
+		position = 0
+		for b in range(self.numbeams):
+			if position + beamheader.size > len(data):
+				break
+			numsamples, bottomdetectsamplenumber, spare = beamheader.unpack_from(data, position)
+			position += beamheader.size
+			numsamples = max(0, min(numsamples, (len(data) - position) // 2))
+			counts[b] = numsamples
+			bottomdetect[b] = bottomdetectsamplenumber
+			starts[b] = position
+			position += numsamples * 2
+		self.fileptr.seek(start + position, 0)
+
+		# gather the big endian u16 samples of every beam into one ragged array
+		self.snippetoffsets = np.concatenate(([0], np.cumsum(counts)))
+		self.snippetbottomdetect = bottomdetect
+		total = int(self.snippetoffsets[-1])
+		beamids = np.repeat(np.arange(self.numbeams), counts)
+		byteidx = np.repeat(starts - (2 * self.snippetoffsets[:-1]), counts) + (2 * np.arange(total))
+		raw = np.frombuffer(data, dtype=np.uint8)
+		self.snippetsamples = (raw[byteidx].astype(np.uint16) << 8) | raw[byteidx + 1]
+
+		snippets = np.zeros(self.numbeams, dtype=np.float64)
+		if snippettype == SNIPPET_NONE or total == 0:
+			return snippets
+
+		if snippettype == SNIPPET_DETECT:
+			# populate with a single value as identified by the bottom detect
+			valid = (bottomdetect > 0) & (bottomdetect < counts)
+			values = self.snippetsamples[self.snippetoffsets[:-1][valid] + bottomdetect[valid]]
+			snippets[valid] = (values / scale) + offset
+			return snippets
+
+		# strip out zero values
+		nonzero = self.snippetsamples != 0
+		samples = self.snippetsamples[nonzero]
+		beamids = beamids[nonzero]
+		n = np.bincount(beamids, minlength=self.numbeams)
+		valid = n > 0
+
+		if snippettype == SNIPPET_MAX:
+			# populate the array with the MAX of all samples
+			if len(samples) > 0:
+				segments = np.concatenate(([0], np.cumsum(n)))[:-1][valid]
+				snippets[valid] = np.maximum.reduceat(samples, segments) / scale + offset
+		elif snippettype == SNIPPET_MEAN:
+			# populate the array with the mean of all samples
+			sums = np.bincount(beamids, weights=samples, minlength=self.numbeams)
+			snippets[valid] = (sums[valid] / (n[valid] / scale)) + offset
+		elif snippettype == SNIPPET_MEAN5DB:
+			# populate the array with the mean of all samples withing a 5dB range of the mean.  As per QPS
+			with np.errstate(divide='ignore', invalid='ignore'):
+				db = 20.0 * np.log10(samples / scale + offset)
+				mean = np.bincount(beamids, weights=db, minlength=self.numbeams) / n
+				keep = (db < mean[beamids] + 5) & (db > mean[beamids] - 5)
+				hl = np.bincount(beamids[keep], weights=db[keep], minlength=self.numbeams)
+				hlcount = np.bincount(beamids[keep], minlength=self.numbeams)
+				cut = valid & (hlcount > 0)
+				snippets[cut] = (hl[cut] / (hlcount[cut] / scale)) + offset
+				nocut = valid & (hlcount == 0)
+				snippets[nocut] = (mean[nocut] / scale) + offset
+		return snippets
 
 	###############################################################################
 	def R2Soniccorrection(self):
@@ -918,22 +939,14 @@ class SWATH_BATHYMETRY_PING :
 		H0_RxGain = self.receivergain
 		H0_VTX_Offset = self.vtxoffset
 
-		for i in range(self.numbeams):
-			if self.BEAM_FLAGS_ARRAY[i] < 0:
-				continue
-			S1_angle = self.BEAM_ANGLE_ARRAY[i] #angle in degrees
-			S1_twtt = self.TRAVEL_TIME_ARRAY[i]
-			S1_range = math.sqrt((self.ACROSS_TRACK_ARRAY[i] ** 2) + (self.ALONG_TRACK_ARRAY[i] ** 2))
-			if samplearray[i] != 0:
-				S1_uPa = samplearray[i]
-				# adjusted = 0				
-				# a test on request from Norm....
-				# adjusted = 20 * math.log10(S1_uPa) - 100
-				# the formal adjustment from Norm Campbell...
-				# if i == 127:
-				adjusted = self.backscatteradjustment( S1_angle, S1_twtt, S1_range, S1_uPa, H0_TxPower, H0_SoundSpeed, H0_RxAbsorption, H0_TxBeamWidthVert, H0_TxBeamWidthHoriz, H0_TxPulseWidth, H0_RxSpreading, H0_RxGain, H0_VTX_Offset)
-				
-				samplearray[i] = adjusted
+		# correct all valid beams with non zero samples in one pass
+		samplearray = np.asarray(samplearray, dtype=np.float64)
+		valid = (np.asarray(self.BEAM_FLAGS_ARRAY) >= 0) & (samplearray != 0)
+		S1_angle = np.asarray(self.BEAM_ANGLE_ARRAY, dtype=np.float64)[valid] #angle in degrees
+		S1_twtt = np.asarray(self.TRAVEL_TIME_ARRAY, dtype=np.float64)[valid]
+		S1_range = np.hypot(np.asarray(self.ACROSS_TRACK_ARRAY, dtype=np.float64)[valid], np.asarray(self.ALONG_TRACK_ARRAY, dtype=np.float64)[valid])
+		S1_uPa = samplearray[valid]
+		samplearray[valid] = self.backscatteradjustments(S1_angle, S1_twtt, S1_range, S1_uPa, H0_TxPower, H0_SoundSpeed, H0_RxAbsorption, H0_TxBeamWidthVert, H0_TxBeamWidthHoriz, H0_TxPulseWidth, H0_RxSpreading, H0_RxGain, H0_VTX_Offset)
 		return samplearray
 
 	###############################################################################
@@ -1027,6 +1040,40 @@ class SWATH_BATHYMETRY_PING :
 
 		return backscatter_dB_m
 
+	###############################################################################
+	def backscatteradjustments(self, S1_angle, S1_twtt, S1_range, S1_Magnitude, H0_TxPower, H0_SoundSpeed, H0_RxAbsorption, H0_TxBeamWidthVert, H0_TxBeamWidthHoriz, H0_TxPulseWidth, H0_RxSpreading, H0_RxGain, H0_VTX_Offset):
+		'''array form of backscatteradjustment.  The S1_ beam parameters are numpy arrays for all beams in the ping, the H0_ header parameters are per ping constants.  See backscatteradjustment for the derivation'''
+		S1_angle = np.asarray(S1_angle, dtype=np.float64)
+		S1_twtt = np.asarray(S1_twtt, dtype=np.float64)
+		S1_Magnitude = np.asarray(S1_Magnitude, dtype=np.float64)
+
+		one_rad = 57.29577951308232
+		S1_angle_rad = S1_angle / one_rad
+		z_range_m = (S1_twtt / 2.0) * H0_SoundSpeed
+
+		with np.errstate(divide='ignore', invalid='ignore'):
+			###### TRANSMISSION LOSS CORRECTION ##########################################
+			z_received_level = 20.0 * np.log10(S1_Magnitude)
+			z_source_level = H0_TxPower # [dB re 1 uPa at 1 meter]
+			z_transmission_loss = (2.0 * H0_RxAbsorption * z_range_m / 1000.0) + (40.0 * np.log10(z_range_m))
+
+			###### INSONIFICATION AREA CORRECTION ##########################################
+			# normal incidence within 0.001 degrees, otherwise the smaller of the normal and oblique areas
+			z_area_of_insonification_nml = H0_TxBeamWidthVert * H0_TxBeamWidthHoriz * z_range_m ** 2
+			z_area_of_insonification_obl = 0.5 * H0_SoundSpeed * H0_TxPulseWidth * H0_TxBeamWidthVert * z_range_m / np.sin(np.abs(S1_angle_rad))
+			z_area_of_insonification = np.where((np.abs(S1_angle) < 0.001) | (z_area_of_insonification_nml < z_area_of_insonification_obl), z_area_of_insonification_nml, z_area_of_insonification_obl)
+
+			###### TIME VARIED GAIN CORRECTION ##########################################
+			TVG = (2.0 * z_range_m * H0_RxAbsorption / 1000.) + (H0_RxSpreading * np.log10(z_range_m)) + H0_RxGain
+			# as per email from Beaudoin, clip the TVG between 4 and 83 dB
+			TVG = np.clip(TVG, 4, 83)
+
+			###### NOW COMPUTE THE CORRECTED BACKSCATTER ##########################################
+			backscatter_dB_m = z_received_level - z_source_level + z_transmission_loss - (10.0 * np.log10(z_area_of_insonification)) - TVG - H0_VTX_Offset + 100.0
+
+		# there is a range of zero, so this is an invalid beam
+		return np.where(z_range_m == 0, 0.0, backscatter_dB_m)
+
 	###############################################################################
 	def decodeR2SonicImagerySpecific(self):
 		''' 
@@ -1089,14 +1136,16 @@ class SWATH_BATHYMETRY_PING :
 		return		
 
 	###############################################################################
-	def readarray(self, scale, offset, datatype):
-		''' 
-		read the ping array data
+	def readarray(self, scale, offset, datatype, data=None, position=0):
+		'''
+		read the ping array data.  the array is decoded from the ping bytes at position if they are given, otherwise from the file
 		'''
 		# https://stackoverflow.com/questions/54679949/unpacking-binary-file-using-struct-unpack-vs-np-frombuffer-vs-np-ndarray-vs-np-f
-
-		fmt = '>' + datatype
-		nparr = np.fromfile(self.fileptr, dtype=np.dtype(fmt), count=self.numbeams)
+		dtype = ARRAYDTYPES[datatype]
+		if data is None:
+			data = self.fileptr.read(dtype.itemsize * self.numbeams)
+			position = 0
+		nparr = np.frombuffer(data, dtype=dtype, count=self.numbeams, offset=position)
 		nparr = (nparr / scale) - offset
 		# nparr = (nparr / scale) + offset  we should be subtracting not adding!!!!
 		return nparr
@@ -1438,6 +1487,8 @@ class CSWATH_BATHY_SUMMARY:
 
 ###############################################################################
 class GSFREADER:
+	INDEXVERSION = 1 # bump this whenever the record index changes so the sidecar files are rebuilt
+
 	def __init__(self, filename, loadscalefactors=False):
 		'''
 		class to read generic sensor format files.
@@ -1457,6 +1508,9 @@ class GSFREADER:
 		# if loadscalefactors:
 		# self.scalefactors = self.loadscalefactors()
 		self.attitudedata = np.empty((0), int)
+		self.index = None
+		self.scalefactorindex = None
+		self.byterange = None
 
 	###########################################################################
 	def moreData(self):
@@ -1527,9 +1581,10 @@ class GSFREADER:
 		heading = np.empty((0), int)
 
 		curr = self.fileptr.tell()
-		self.rewind()
 
-		while self.moreData():
+		# use the record index to go straight to the attitude records
+		for offset in self.getoffsets(ATTITUDE):
+			self.fileptr.seek(offset, 0)
 			numberofbytes, recordidentifier, datagram = self.readDatagram()
 			if recordidentifier == 	ATTITUDE:
 				datagram.read()
@@ -1551,10 +1606,10 @@ class GSFREADER:
 		navigation = []
 		previoustimestamp = 0
 		curr = self.fileptr.tell()
-		self.rewind()
-
 
-		while self.moreData():
+		# use the record index to go straight to the ping records
+		for offset in self.getoffsets(SWATH_BATHYMETRY):
+			self.fileptr.seek(offset, 0)
 			numberofbytes, recordidentifier, datagram = self.readDatagram()
 			if recordidentifier == SWATH_BATHYMETRY:
 				datagram.read({}, True)
@@ -1572,20 +1627,124 @@ class GSFREADER:
 	###########################################################################
 	def getrecordcount(self):
 		'''
-		rewind, count the number of ping records as fast as possible.  useful for progress bars
+		count the number of ping records straight from the record index.  useful for progress bars
 		'''
-		numpings = 0
-		curr = self.fileptr.tell()
-		self.rewind()
+		return len(self.getoffsets(SWATH_BATHYMETRY))
 
-		while self.moreData():
-			numberofbytes, recordidentifier, datagram = self.readDatagram()
-			if recordidentifier == SWATH_BATHYMETRY:
-				numpings += 1
+	###########################################################################
+	def buildindex(self):
+		'''
+		make one pass through the file reading only the record headers, to build the record index of type, offset, length and time.
+		every record except the file header starts with its time as seconds and nanoseconds.  the file is memory mapped for the scan so the headers are unpacked straight out of the buffer without a seek and read per record
+		'''
+		records = []
+		if self.fileSize == 0:
+			return np.array(records, dtype=fileutils.RECORDINDEXDTYPE)
+		header_unpack = struct.Struct(self.hdrfmt).unpack_from
+		time_unpack = struct.Struct(">2l").unpack_from
+		rec_len = self.hdrlen + 8
+		with mmap.mmap(self.fileptr.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+			offset = 0
+			while offset + self.hdrlen <= self.fileSize:
+				sizeofdata, recordidentifier = header_unpack(buffer, offset)
+				numberofbytes = sizeofdata + self.hdrlen
+				if offset + numberofbytes > self.fileSize:
+					break # a truncated record at the end of the file
+				timestamp = np.nan
+				if recordidentifier != HEADER and offset + rec_len <= self.fileSize:
+					seconds, nanoseconds = time_unpack(buffer, offset + self.hdrlen)
+					timestamp = seconds + nanoseconds/1000000000
+				records.append((recordidentifier, offset, numberofbytes, timestamp))
+				offset += numberofbytes
+		return np.array(records, dtype=fileutils.RECORDINDEXDTYPE)
 
-		self.fileptr.seek(curr, 0)
-		return numpings
+	###########################################################################
+	def getindex(self):
+		'''
+		return the record index for the file.  it is loaded from the sidecar file if there is an up to date one, otherwise built and saved
+		'''
+		if self.index is None:
+			self.index = fileutils.loadrecordindex(self.fileName, self.buildindex, self.INDEXVERSION)
+		return self.index
+
+	###########################################################################
+	def buildscalefactorindex(self):
+		'''
+		make one pass over the pings to find the ones which carry scale factors.  the gsf specification puts the scale factor subrecord straight after the ping header, so only that subrecord header is read from each ping.
+		returns the rows of the record index for those pings
+		'''
+		records = fileutils.recordsoftype(self.getindex(), SWATH_BATHYMETRY)
+		if len(records) == 0:
+			return records
+		hasscalefactors = np.zeros(len(records), dtype=bool)
+		with mmap.mmap(self.fileptr.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+			for i, (offset, numberofbytes) in enumerate(zip(records['offset'].tolist(), records['length'].tolist())):
+				position = offset + self.hdrlen + PINGHEADER.size
+				if position + SUBRECORDHEADER.size <= offset + numberofbytes:
+					hasscalefactors[i] = (SUBRECORDHEADER.unpack_from(buffer, position)[0] >> 24) == SCALE_FACTORS
+		return records[hasscalefactors]
+
+	###########################################################################
+	def getscalefactorindex(self):
+		'''
+		return the record index rows of the pings which carry scale factors.  like the record index it is saved alongside the file
+		'''
+		if self.scalefactorindex is None:
+			self.scalefactorindex = fileutils.loadrecordindex(self.fileName, self.buildscalefactorindex, self.INDEXVERSION, SCALEFACTORINDEXSUFFIX)
+		return self.scalefactorindex
+
+	###########################################################################
+	def getoffsets(self, recordidentifier):
+		'''
+		return the file offsets of every record of the requested type, using the record index.  if a byte range is set only the records starting inside it are returned
+		'''
+		records = fileutils.recordsoftype(self.getindex(), recordidentifier)
+		if self.byterange is not None:
+			records = fileutils.recordsinrange(records, self.byterange[0], self.byterange[1])
+		return records['offset'].tolist()
+
+	###########################################################################
+	def setbyterange(self, startbyte=None, endbyte=None):
+		'''
+		limit the loaders to the records which start in startbyte <= offset < endbyte.  this lets several processes decode one big file between them.  call with no arguments to read the whole file again
+		'''
+		if startbyte is None:
+			self.byterange = None
+		else:
+			self.byterange = (startbyte, endbyte)
+
+	###########################################################################
+	def getbyteranges(self, count):
+		'''
+		split the file into count record aligned byte ranges of about the same size
+		'''
+		return fileutils.splitrecords(self.getindex(), count)
 		
+	###########################################################################
+	def read_window(self, start_time, end_time, recordidentifier=None):
+		'''
+		yield (numberofbytes, recordidentifier, datagram) for every record timed start_time <= time <= end_time, optionally of one type only.  
+		the record index is binary searched so only the records in the window are read from disc.
+		the scale factors are only on some pings and can change through the file, so they are primed from the last ping before the window which carries them
+		'''
+		records = fileutils.recordsinwindow(self.getindex(), start_time, end_time)
+		if recordidentifier is not None:
+			records = fileutils.recordsoftype(records, recordidentifier)
+		if len(records) == 0:
+			return
+
+		scalefactors = self.getscalefactorindex()
+		scalefactors = scalefactors[scalefactors['offset'] < records['offset'][0]]
+		if len(scalefactors) > 0:
+			self.fileptr.seek(int(scalefactors['offset'][-1]), 0)
+			numberofbytes, identifier, datagram = self.readDatagram()
+			datagram.read()
+
+		for offset in records['offset'].tolist():
+			self.fileptr.seek(offset, 0)
+			yield self.readDatagram()
+		self.rewind()
+
 	###########################################################################
 	def readDatagram(self):
 		# read the datagram header.  This permits us to skip datagrams we do not support
@@ -1610,7 +1769,8 @@ class GSFREADER:
 
 		if recordidentifier == SWATH_BATHYMETRY:
 			dg = SWATH_BATHYMETRY_PING(self.fileptr, numberofbytes, recordidentifier, hdrlen)
-			# dg.scalefactors = self.scalefactors
+			# the scale factors are only on some pings, so share the reader's scale factors with every ping.  they carry forward as the pings are read
+			dg.scalefactorsd = self.scalefactorsd
 			return numberofbytes, recordidentifier, dg 
 
 		elif recordidentifier == SWATH_BATHY_SUMMARY:
@@ -1683,6 +1843,43 @@ class GSFREADER:
 		# 	# return (sizeofdata + self.hdrlen, recordidentifier, haschecksum, self.hdrlen )
 
 
+###########################################################################
+def loadnavigationrange(task):
+	'''
+	process pool worker.  load the navigation from the ping records in one byte range of a file, task is (filename, startbyte, endbyte)
+	'''
+	filename, startbyte, endbyte = task
+	r = GSFREADER(filename)
+	r.setbyterange(startbyte, endbyte)
+	navigation = r.loadnavigation()
+	r.close()
+	return navigation
+
+###########################################################################
+def mergenavigation(parts):
+	'''
+	join the navigation loaded from the byte ranges of a file, in file order.  the first ping of each range does not know the ping before it, so its delta time is put back.
+	every range of a split file holds pings, so a range which failed or came back empty means the file could not be decoded and an empty list is returned rather than a track with a hole in it
+	'''
+	navigation = []
+	for part in parts:
+		if not part:
+			return []
+		if len(navigation) > 0:
+			part[0][7] = part[0][0] - navigation[-1][0]
+		navigation.extend(part)
+	return navigation
+
+###########################################################################
+def mp_loadnavigation(filename, cpu):
+	'''
+	load the navigation from a big file by decoding byte ranges of it in a process pool
+	'''
+	r = GSFREADER(filename)
+	byteranges = r.getbyteranges(cpu)
+	r.close()
+	return mergenavigation(multiprocesshelper.mp_decoderanges(loadnavigationrange, filename, byteranges, cpu))
+
 ###########################################################################
 def isBitSet(int_type, offset):
 	'''testBit() returns a nonzero result, 2**offset, if the bit at 'offset' is one.'''
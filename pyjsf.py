@@ -14,6 +14,8 @@ import os.path
 import time
 from datetime import datetime
 from datetime import timedelta
+import numpy as np
+import fileutils
 
 def main():
 	#open the ALL file for reading by creating a new s7kReader class and passin in the filename to open.
@@ -54,6 +56,7 @@ class jsfreader:
 	packetheader_fmt = '=HBBHBBBBHL'
 	packetheader_len = struct.calcsize(packetheader_fmt)
 	packetheader_unpack = struct.Struct(packetheader_fmt).unpack_from
+	INDEXVERSION = 1 # bump this whenever the record index changes so the sidecar files are rebuilt
 
 	def __init__(self, filename=None):
 		if filename is not None:
@@ -65,6 +68,7 @@ class jsfreader:
 			self.recordDate = ""
 			self.recordTime = ""
 			self.recordCounter=0
+			self.index = None
 
 	def __str__(self):
 		return pprint.pformat(vars(self))
@@ -152,21 +156,56 @@ class jsfreader:
 		return data
 
 	def getRecordCount(self):
-		'''read through the entire file as fast as possible to get a count of all records.  useful for progress bars so user can see what is happening'''
-		count = 0
-		start = 0
-		end = 0
+		'''count all records in the file and report the first and last ping times, straight from the record index.  useful for progress bars so user can see what is happening'''
+		records = self.getindex()
+		timestamps = records['timestamp'][~np.isnan(records['timestamp'])]
+		if len(timestamps) == 0:
+			return len(records), 0, 0
+		return len(records), float(timestamps[0]), float(timestamps[-1])
+
+	def buildindex(self):
+		'''make one pass through the file reading only the message headers, to build the record index of type, offset, length and time.
+		only the sonar data messages (80) carry a time, which is the first field after the header'''
+		records = []
+		rec_fmt = self.packetheader_fmt + 'l'
+		rec_len = struct.calcsize(rec_fmt)
+		rec_unpack = struct.Struct(rec_fmt).unpack_from
+		offset = 0
+		while offset + self.packetheader_len <= self.fileSize:
+			self.fileptr.seek(offset, 0)
+			data = self.fileptr.read(rec_len)
+			s = self.packetheader_unpack(data)
+			recordtypeidentifier = s[3]
+			numberOfBytes = self.packetheader_len + s[9]
+			if offset + numberOfBytes > self.fileSize:
+				break
+			timestamp = np.nan
+			if recordtypeidentifier == 80 and len(data) == rec_len:
+				timestamp = rec_unpack(data)[10]
+			records.append((recordtypeidentifier, offset, numberOfBytes, timestamp))
+			offset += numberOfBytes
 		self.rewind()
-		numberOfBytes, readdatagramheader, recorddate = self.readdatagramheader()
-		start = recorddate # to_timestamp(to_DateTime(RecordDate, RecordTime))
+		return np.array(records, dtype=fileutils.RECORDINDEXDTYPE)
+
+	def getindex(self):
+		'''return the record index for the file.  it is loaded from the sidecar file if there is an up to date one, otherwise built and saved'''
+		if self.index is None:
+			self.index = fileutils.loadrecordindex(self.fileName, self.buildindex, self.INDEXVERSION)
+		return self.index
+
+	def getoffsets(self, recordtypeidentifier):
+		'''return the file offsets of every message of the requested type, using the record index'''
+		return fileutils.recordsoftype(self.getindex(), int(recordtypeidentifier))['offset'].tolist()
+
+	def read_window(self, start_time, end_time, recordtypeidentifier=None):
+		'''yield (typeOfDatagram, datagram) for every sonar data message timed start_time <= time <= end_time.  only the sonar data messages carry a time, so the others are never in a window.  the record index is binary searched so only the messages in the window are read from disc'''
+		records = fileutils.recordsinwindow(self.getindex(), start_time, end_time)
+		if recordtypeidentifier is not None:
+			records = fileutils.recordsoftype(records, int(recordtypeidentifier))
+		for offset in records['offset'].tolist():
+			self.fileptr.seek(offset, 0)
+			yield self.readdatagram()
 		self.rewind()
-		while self.moreData():
-			numberOfBytes, STX, typeOfDatagram, EMModel, RecordDate, RecordTime = self.readdatagramheader()
-			self.fileptr.seek(numberOfBytes, 1)
-			count += 1
-		self.rewind()
-		end = to_timestamp(to_DateTime(RecordDate, RecordTime))
-		return count, start, end
 
 	def readdatagram(self):
 		'''read the datagram header.  This permits us to skip datagrams we do not support'''
@@ -230,8 +269,9 @@ class jsfreader:
 		'''loads all the navigation into lists'''
 		navigation 					= []
 		selectedPositioningSystem 	= None
-		self.rewind()
-		while self.moreData():
+		# use the record index to go straight to the 80 sonar data messages
+		for offset in self.getoffsets(80):
+			self.fileptr.seek(offset, 0)
 			typeOfDatagram, datagram = self.readdatagram()
 			if typeOfDatagram == '80':
 				datagram.read()
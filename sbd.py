@@ -10,6 +10,7 @@ import pprint
 import struct
 import time
 from datetime import datetime, timezone
+import numpy as np
 
 
 # local imports
@@ -19,6 +20,8 @@ import sys
 path_root = Path(__file__).parent
 sys.path.append(str(path_root))
 
+import fileutils
+
 # import r2sonicdecode
 # import refraction
 
@@ -363,6 +366,8 @@ class SBDReader:
 	PIPETRACKER			= 11 #0x00b
 	#thats all of the categories from the insutruments.xml file in naviscan
 
+	INDEXVERSION		= 1 # bump this whenever the record index changes so the sidecar files are rebuilt
+
 	#########################################################################################
 	def __init__(self, SBDfilename):
 		if not os.path.exists(SBDfilename):
@@ -392,6 +397,7 @@ class SBDReader:
 		self.sensor['easting'] = 0
 		self.sensor['northing'] = 0
 		self.sensor['mbesname'] = ""
+		self.index = None
 
 	#########################################################################################
 	def readdatagram(self):
@@ -546,11 +552,41 @@ class SBDReader:
 		# print ("current file ptr position:", self.fileptr.tell())
 		return bytesRemaining
 
+	#########################################################################################
+	def buildindex(self):
+		'''make one pass through the file reading only the message headers, to build the record index of sensor category, offset, length and time'''
+		records = []
+		self.rewind()
+		offset = self.fileptr.tell() # the first message follows the file header
+		while offset + self.hdr_len <= self.filesize:
+			self.fileptr.seek(offset, 0)
+			msghdr = self.hdr_unpack(self.fileptr.read(self.hdr_len))
+			numberofbytes = self.hdr_len + msghdr[7]
+			if offset + numberofbytes > self.filesize:
+				break # a truncated message at the end of the file
+			records.append((msghdr[0] % 256, offset, numberofbytes, msghdr[5] + (msghdr[6] / 1000000)))
+			offset += numberofbytes
+		self.rewind()
+		return np.array(records, dtype=fileutils.RECORDINDEXDTYPE)
+
+	#########################################################################################
+	def getindex(self):
+		'''return the record index for the file.  it is loaded from the sidecar file if there is an up to date one, otherwise built and saved'''
+		if self.index is None:
+			self.index = fileutils.loadrecordindex(self.filename, self.buildindex, self.INDEXVERSION)
+		return self.index
+
+	#########################################################################################
+	def getoffsets(self, categories):
+		'''return the file offsets, in file order, of every message in the requested sensor categories, using the record index'''
+		return fileutils.recordsoftype(self.getindex(), categories)['offset'].tolist()
+
 	#########################################################################################
 	def getfirstcoordinate(self):
 		'''we sometimes need to guess the EPSG and for that we need the first coordinate in the file so read it and quit'''
-		self.rewind()
-		while self.moreData() > 0:
+		# the gyro messages are needed as well as the positions, so the heading is up to date
+		for offset in self.getoffsets([self.GYRO, self.POSITION]):
+			self.fileptr.seek(offset, 0)
 			category, decoded = self.readdatagram()
 
 			if category == self.POSITION: # 8
@@ -565,9 +601,10 @@ class SBDReader:
 		navigation = []
 		navigation2 = []
 		previoustimestamp = 0
-		self.rewind()
 		start_time = time.time() # time the process
-		while self.moreData() > 0:
+		# use the record index to go straight to the gyro and position messages
+		for offset in self.getoffsets([self.GYRO, self.POSITION]):
+			self.fileptr.seek(offset, 0)
 			category, decoded = self.readdatagram()
 
 			if category == self.GYRO:
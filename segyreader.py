@@ -9,6 +9,7 @@ import time
 import re
 import math
 import pprint
+import numpy as np
 
 from datetime import datetime
 from datetime import timedelta
@@ -24,10 +25,22 @@ TEXTUAL_HEADER_NUM_BYTES 	= CARD_LENGTH * CARDS_PER_HEADER
 BINARY_HEADER_NUM_BYTES 	= 400
 REEL_HEADER_NUM_BYTES 		= TEXTUAL_HEADER_NUM_BYTES + BINARY_HEADER_NUM_BYTES
 TRACE_HEADER_NUM_BYTES 		= 240
+# the trace header fields used for navigation, at their byte offsets so every trace header in a fixed length file can be viewed in one go
+# the scale from the trace header coordinate units to metres (or feet) or decimal degrees.  DDDMMSS is decoded by convertcoordinates
+COORDINATEUNITSCALE = {1: 1, 2: 1/(60*60), 3: 1, 4: 1}
+# the numpy dtype of each sample format we can decode.  format 1 is IBM float, which is viewed as raw big endian words and converted by ibm2ieee
+SAMPLEFORMATDTYPES = {1: '>u4', 2: '>i4', 3: '>i2', 5: '>f4', 8: 'i1'}
+TRACEHEADER_dtype = np.dtype({'names': ['depthscalar', 'coordscalar', 'sourceX', 'sourceY', 'groupX', 'groupY', 'coordunits', 'samplesintrace', 'year', 'day', 'hour', 'minute', 'second', 'shotpoint'],
+	'formats': ['>i2', '>i2', '>i4', '>i4', '>i4', '>i4', '>i2', '>i2', '>i2', '>i2', '>i2', '>i2', '>i2', '>i4'],
+	'offsets': [68, 70, 72, 76, 80, 84, 88, 114, 156, 158, 160, 162, 164, 196],
+	'itemsize': TRACE_HEADER_NUM_BYTES})
 # END_TEXT_STANZA = "((SEG: EndText))"
 
 ###############################################################################################
 def main():
+	testcoordinateconversion()
+	testibmfloat()
+
 	#open the file for reading by creating a new Reader class and passing in the filename to open.
 	filename	 = "Z:/Subsea-Cloud/OceanInfinity/IslandPride/F12/WideArea/20191207_6100_126_P11_S10_A14_144/2_post_dive_48h/6-1-2-18_SEG-Y/Envelope/SBP-0174-m028-20191208-085427_P.E.sgy"
 	# filename	 = "C:/infinitytool/GGTools/segy/20140614082310.seg"
@@ -57,6 +70,127 @@ def main():
 
 
 
+###############################################################################
+def convertcoordinates(values, coordscalar, coordunits):
+	'''convert raw trace header coordinates to metres (or feet) or decimal degrees in one numpy pass.  values, coordscalar and coordunits are whole columns, or single values, straight from the trace headers.
+	coordunits 1 is length, 2 is seconds of arc, 3 is decimal degrees and 4 is DDDMMSS.  the scalar applies to the DDDMMSS value, so DDDMMSS.ss is stored with a scalar of -100.
+	unknown units return 0 so the coordinates are skipped as unset'''
+	values = np.asarray(values, dtype=np.float64)
+	coordscalar = np.asarray(coordscalar, dtype=np.float64)
+	coordunits = np.asarray(coordunits)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		scalar = np.where(coordscalar < 0, 1 / np.abs(coordscalar), np.abs(coordscalar))
+		scaled = values * scalar
+
+		# DDDMMSS, so split out the degrees, minutes and seconds.  divide rather than multiply by the reciprocal so whole seconds stay whole
+		dms = np.where(coordscalar < 0, np.abs(values) / np.abs(coordscalar), np.abs(values) * np.abs(coordscalar))
+		degrees = np.floor(dms / 10000)
+		minutes = np.floor((dms - (degrees * 10000)) / 100)
+		seconds = dms - (degrees * 10000) - (minutes * 100)
+		dddmmss = np.copysign(degrees + (minutes / 60) + (seconds / 3600), values)
+
+	return np.select([(coordunits == 1) | (coordunits == 3), coordunits == 2, coordunits == 4], [scaled, scaled * (1/(60*60)), dddmmss], 0.0)
+
+###############################################################################
+def testcoordinateconversion():
+	'''check the coordinate conversion against known values for every coordinate unit'''
+	tests = [
+		# value, scalar, units, expected
+		(500000123, -100, 1, 5000001.23),
+		(6000000, 1, 1, 6000000.0),
+		(12345, 10, 1, 123450.0),
+		(41400000, -100, 2, 115.0),
+		(-11880000, -100, 2, -33.0),
+		(1150250000, -10000000, 3, 115.025),
+		(-33, 0, 3, 0.0),
+		(1150130, 1, 4, 115.0 + (1 / 60) + (30 / 3600)),
+		(-330030, 1, 4, -(33.0 + (30 / 3600))),
+		(115013012, -100, 4, 115.0 + (1 / 60) + (30.12 / 3600)),
+		(-330059, 0, 4, 0.0),
+		(450000, 1, 4, 45.0),
+		(1795959, 1, 4, 179.0 + (59 / 60) + (59 / 3600)),
+		(-1800000, 1, 4, -180.0),
+		(5959, 1, 4, (59 / 60) + (59 / 3600)),
+		(300, 1, 4, 3 / 60),
+		(12345, 1, 0, 0.0),
+		]
+	values, scalars, units, expected = (np.array(column) for column in zip(*tests))
+	converted = convertcoordinates(values, scalars, units)
+	failed = ~np.isclose(converted, expected, rtol=0, atol=1e-9)
+	for i in np.flatnonzero(failed):
+		print ("Error: coordinate %d scalar %d units %d converted to %.9f, expected %.9f" % (values[i], scalars[i], units[i], converted[i], expected[i]))
+	# single values go through the same conversion as columns
+	for value, scalar, unit, expect in tests:
+		if not math.isclose(float(convertcoordinates(value, scalar, unit)), expect, abs_tol=1e-9):
+			print ("Error: single coordinate %d scalar %d units %d did not convert to %.9f" % (value, scalar, unit, expect))
+			failed[0] = True
+	print ("Coordinate conversion %s, %d known values" % ("FAILED" if failed.any() else "OK", len(tests)))
+	return not failed.any()
+
+###############################################################################
+def ibm2ieee(words):
+	'''convert IBM System/360 single precision floats, held as 32 bit words, to ieee float32 in one numpy pass.  an IBM float is a sign bit, a 7 bit base 16 exponent biased by 64 and a 24 bit fraction'''
+	words = np.asarray(words).astype(np.uint32)
+	sign = np.where((words >> 31) == 1, -1.0, 1.0)
+	exponent = ((words >> 24) & 0x7f).astype(np.int32)
+	fraction = (words & 0x00ffffff).astype(np.float64)
+	# the fraction is scaled by 2**-24 and the exponent is a power of 16.  values beyond the float32 range become inf
+	with np.errstate(over='ignore'):
+		return (sign * np.ldexp(fraction, (4 * (exponent - 64)) - 24)).astype(np.float32)
+
+###############################################################################
+def decodesamples(data, sampleformat):
+	'''decode the raw sample bytes of one trace into a numpy array.  IBM float is converted to float32, the other formats keep their own type'''
+	samples = np.frombuffer(data, dtype=SAMPLEFORMATDTYPES[sampleformat])
+	if sampleformat == 1:
+		return ibm2ieee(samples)
+	return samples
+
+###############################################################################
+def testibmfloat():
+	'''check the IBM float conversion against known values'''
+	tests = [
+		# IBM word, expected
+		(0x00000000, 0.0),
+		(0x41100000, 1.0),
+		(0xC1100000, -1.0),
+		(0x40800000, 0.5),
+		(0x42640000, 100.0),
+		(0xC276A000, -118.625),
+		(0x4110000F, 1.0 + (15 * 2 ** -20)),
+		(0x3E100000, 16.0 ** -3),
+		(0x7FFFFFFF, np.inf),
+		]
+	words, expected = (np.array(column) for column in zip(*tests))
+	converted = ibm2ieee(words)
+	failed = converted != expected.astype(np.float32)
+	for i in np.flatnonzero(failed):
+		print ("Error: IBM float 0x%08X converted to %r, expected %r" % (words[i], converted[i], expected[i]))
+	print ("IBM float conversion %s, %d known values" % ("FAILED" if failed.any() else "OK", len(tests)))
+	return not failed.any()
+
+###############################################################################
+class ibmtraces:
+	'''a (traces, samples) view of the IBM float samples of a memory mapped segy file.  rows are only converted to float32 as they are sliced, 
+	so a file far bigger than memory can be worked through a range of traces at a time'''
+	def __init__(self, raw):
+		self.raw	= raw
+		self.shape	= raw.shape
+		self.ndim	= raw.ndim
+		self.dtype	= np.dtype(np.float32)
+
+	def __len__(self):
+		return self.shape[0]
+
+	def __getitem__(self, key):
+		return ibm2ieee(self.raw[key])
+
+	def __array__(self, dtype=None, copy=None):
+		samples = ibm2ieee(self.raw)
+		if dtype is not None:
+			samples = samples.astype(dtype)
+		return samples
+
 ###############################################################################
 class field:
 	name = ""
@@ -77,6 +211,9 @@ class field:
 class segyreader:
 	'''class to read a segy file'''
 	PacketHeader_fmt = '>' #< == little endian, > == big endian
+	traceheader_fmt = '>4l 3l4hl 7l2h4l5h 10h 20h 11h5l 2h6s2h 2h6s6s h8s'
+	traceheader_len = struct.calcsize(traceheader_fmt)
+	traceheader_unpack = struct.Struct(traceheader_fmt).unpack
 	reccount = 0
 	def __init__(self, fileName):
 		if not os.path.isfile(fileName):
@@ -98,6 +235,7 @@ class segyreader:
 		self.sourceY 			= 0
 		self.groupX 			= 0
 		self.groupY 			= 0
+		self.samples			= None
 
 		self.encoding = self.guess_textual_header_encoding()
 
@@ -111,6 +249,14 @@ class segyreader:
 
 	def loadNavigation(self):
 		'''load the navigation from the data trace headers so we can use it for all sorts of things '''
+		navigation = self.loadnavigationfixedlength()
+		if navigation is not None:
+			self.navigation = navigation
+			return self.navigation
+
+		# the traces are not all the same length, so read them one at a time from the first trace
+		self.rewind()
+		self.readHeader()
 		while self.moreData() > 0:
 			if not self.readDatagram():
 				break
@@ -123,6 +269,126 @@ class segyreader:
 				print ("skipping zero latitude, longitude coordinates")
 		return self.navigation
 
+#################################################################################################
+	def gettracelayout(self):
+		'''return the byte offset of the first trace, the length of every trace and the number of traces when every trace is the same length, otherwise None.
+		rev 1 and later files declare fixed length traces with fixedlengthtraceflag and samplespertrace in the binary header.  older files are taken from the first trace and must fit the file exactly.
+		either way every trace header must agree on the number of samples before the layout is trusted.  the file pointer is left at the first trace'''
+		self.rewind()
+		self.readHeader()
+		datastart = self.fileptr.tell()
+		if self.sampleformatsize == 0 or (self.fileSize - datastart) < TRACE_HEADER_NUM_BYTES:
+			return None
+
+		if self.majorversion >= 1 and self.fixedlengthtraceflag == 1 and self.samplespertrace > 0:
+			samplesintrace = self.samplespertrace
+			tracelength = TRACE_HEADER_NUM_BYTES + (samplesintrace * self.sampleformatsize)
+			tracecount = (self.fileSize - datastart) // tracelength
+		else:
+			self.readTraceHeader()
+			self.fileptr.seek(datastart, 0)
+			samplesintrace = self.samplesintrace
+			if samplesintrace <= 0:
+				return None
+			tracelength = TRACE_HEADER_NUM_BYTES + (samplesintrace * self.sampleformatsize)
+			tracecount = (self.fileSize - datastart) // tracelength
+			if (self.fileSize - datastart) % tracelength != 0:
+				return None
+		if tracecount == 0:
+			return None
+
+		# a variable length file can still fit, so confirm the sample count in every trace header through the strided view
+		buffer = np.memmap(self.fileName, dtype=np.uint8, mode='r')
+		headers = np.ndarray(shape=(tracecount,), dtype=TRACEHEADER_dtype, buffer=buffer, offset=datastart, strides=(tracelength,))
+		if not np.all(headers['samplesintrace'] == samplesintrace):
+			return None
+		return datastart, tracelength, tracecount
+
+#################################################################################################
+	def readtraceheaders(self):
+		'''return the navigation fields of every trace header as a numpy structured array, or None if the traces are not all the same length.
+		the file is memory mapped and viewed with a stride of one trace, so the sample data is never read'''
+		layout = self.gettracelayout()
+		if layout is None:
+			return None
+		datastart, tracelength, tracecount = layout
+		buffer = np.memmap(self.fileName, dtype=np.uint8, mode='r')
+		return np.ndarray(shape=(tracecount,), dtype=TRACEHEADER_dtype, buffer=buffer, offset=datastart, strides=(tracelength,))
+
+#################################################################################################
+	def readsamples(self):
+		'''return the samples of every trace as a (traces, samples) array backed by the memory mapped file, so only the traces which are used are read from disc.
+		formats 2, 3, 5 and 8 are a numpy view of the file.  IBM float (format 1) is an ibmtraces view which converts the rows to float32 as they are sliced.
+		returns None if the traces are not all the same length or the sample format is not supported'''
+		layout = self.gettracelayout()
+		if layout is None:
+			print ("Error: the traces are not all the same length so the samples cannot be mapped: %s" % (self.fileName))
+			return None
+		if self.sampleformat not in SAMPLEFORMATDTYPES:
+			print ("Error: sample format %d is not supported: %s" % (self.sampleformat, self.fileName))
+			return None
+		datastart, tracelength, tracecount = layout
+		samplesintrace = (tracelength - TRACE_HEADER_NUM_BYTES) // self.sampleformatsize
+		buffer = np.memmap(self.fileName, dtype=np.uint8, mode='r')
+		raw = np.ndarray(shape=(tracecount, samplesintrace), dtype=SAMPLEFORMATDTYPES[self.sampleformat], buffer=buffer, offset=datastart + TRACE_HEADER_NUM_BYTES, strides=(tracelength, self.sampleformatsize))
+		if self.sampleformat == 1:
+			return ibmtraces(raw)
+		return raw
+
+#################################################################################################
+	def loadnavigationfixedlength(self):
+		'''load the navigation from every trace header in one go.  returns None if the traces are not all the same length, so the caller can read trace by trace instead'''
+		headers = self.readtraceheaders()
+		if headers is None:
+			return None
+		self.fileptr.seek(0, 2) # leave the file pointer at the end, as if every trace was read
+
+		longitudes = convertcoordinates(headers['sourceX'], headers['coordscalar'], headers['coordunits'])
+		latitudes = convertcoordinates(headers['sourceY'], headers['coordscalar'], headers['coordunits'])
+
+		days = (headers['year'].astype(np.int64) - 1970).astype('datetime64[Y]').astype('datetime64[D]').astype(np.int64) + headers['day'] - 1
+		timestamps = (days * 86400.0) + (headers['hour'] * 3600.0) + (headers['minute'] * 60.0) + headers['second']
+
+		valid = (longitudes != 0) & (latitudes != 0)
+		if not np.all(valid):
+			print ("skipping %d zero latitude, longitude coordinates" % (np.count_nonzero(~valid)))
+		return np.column_stack((timestamps[valid], longitudes[valid], latitudes[valid])).tolist()
+
+#################################################################################################
+	def read_window(self, start_time, end_time):
+		'''yield the [timestamp, sourceX, sourceY] record of every trace timed start_time <= time <= end_time.  segy has no record index, but the traces are recorded in time order so 
+		when every trace is the same length the trace times are binary searched by reading single trace headers, otherwise the traces are scanned from the start'''
+		layout = self.gettracelayout()
+		fixedlength = layout is not None
+		if fixedlength:
+			datastart, tracelength, tracecount = layout
+			# find the first trace at or after the start of the window
+			first = 0
+			last = tracecount
+			while first < last:
+				middle = (first + last) // 2
+				self.fileptr.seek(datastart + (middle * tracelength), 0)
+				self.readTraceHeader()
+				if self.timestamp < start_time:
+					first = middle + 1
+				else:
+					last = middle
+			self.fileptr.seek(datastart + (first * tracelength), 0)
+		else:
+			self.rewind()
+			self.readHeader()
+
+		while self.moreData() > 0:
+			if not self.readDatagram():
+				break
+			if self.timestamp > end_time:
+				if fixedlength:
+					break # the traces are in time order, so we are past the window
+				continue
+			if self.timestamp >= start_time:
+				yield self.record
+		self.rewind()
+
 #################################################################################################
 #################################################################################################
 #################################################################################################
@@ -186,7 +452,7 @@ class segyreader:
 			self.fixedlengthtraceflag 		= s[29]
 			self.extendedtextheaderrecords 	= s[30]
 			self.sampleformat 				= s[9]
-			if self.sampleformatsize == 1:
+			if self.sampleformat == 1:
 				self.sampleformatsize = 4
 			elif self.sampleformat == 2:
 				self.sampleformatsize = 4
@@ -205,24 +471,23 @@ class segyreader:
 		return
 
 #################################################################################################
-	def readTrace(self):
-		'''read the trace, skipping the trace data'''
+	def readTrace(self, decode=False):
+		'''read the trace, skipping the trace data unless decode is set, in which case the samples are decoded into self.samples'''
 		bytestoread = self.samplesintrace * self.sampleformatsize
 		if bytestoread < 0:
 			return False
 		if (self.fileSize - self.fileptr.tell()) >= bytestoread:
-			self.fileptr.read(bytestoread)
+			if decode and self.sampleformat in SAMPLEFORMATDTYPES:
+				self.samples = decodesamples(self.fileptr.read(bytestoread), self.sampleformat)
+			else:
+				self.fileptr.seek(bytestoread, 1)
 			return True
 
 #################################################################################################
 	def readTraceHeader(self):
 		'''trace header is 240 bytes '''
-		rec_fmt = '>4l 3l4hl 7l2h4l5h 10h 20h 11h5l 2h6s2h 2h6s6s h8s'
-		rec_len = struct.calcsize(rec_fmt)
-		rec_unpack = struct.Struct(rec_fmt).unpack
-
-		if (self.fileSize - self.fileptr.tell()) >= rec_len:
-			s = rec_unpack(self.fileptr.read(rec_len))
+		if (self.fileSize - self.fileptr.tell()) >= self.traceheader_len:
+			s = self.traceheader_unpack(self.fileptr.read(self.traceheader_len))
 			self.depthscalar	= s[19]
 			self.coordscalar	= s[20]
 			if self.coordscalar < 0:
@@ -235,30 +500,8 @@ class segyreader:
 			self.coordunits		= s[25]
 			self.samplesintrace	= s[38]
 			self.shotpoint		= s[75]
-			if self.coordunits == 1:
-				self.crs = 1 #metres or feet, so convert accordingly
-				self.sourceX 		= s[21] * self.coordscalar * self.crs
-				self.sourceY 		= s[22] * self.coordscalar * self.crs
-				self.groupX 		= s[23] * self.coordscalar * self.crs
-				self.groupY 		= s[24] * self.coordscalar * self.crs
-			elif self.coordunits == 2:
-				self.crs 			= 1/(60*60) #seconds of arc, so convert to decimal degrees accordingly
-				self.sourceX 		= s[21] * self.coordscalar * self.crs
-				self.sourceY 		= s[22] * self.coordscalar * self.crs
-				self.groupX 		= s[23] * self.coordscalar * self.crs
-				self.groupY 		= s[24] * self.coordscalar * self.crs
-			elif self.coordunits == 3:
-				self.crs 			= 1 #degrees, so convert accordingly
-				self.sourceX 		= s[21] * self.coordscalar * self.crs
-				self.sourceY 		= s[22] * self.coordscalar * self.crs
-				self.groupX 		= s[23] * self.coordscalar * self.crs
-				self.groupY 		= s[24] * self.coordscalar * self.crs
-			elif self.coordunits == 4:
-				self.crs 			= 1 #DDDMMSS, so convert accordingly
-				self.sourceX 		= (float(str(s[21])[0:3]) * 10000 * self.coordscalar) + (float(str(s[21])[3:5]) * 100 * self.coordscalar) + (float(str(s[21])[0:3]) * 1 * self.coordscalar)
-				self.sourceY 		= (float(str(s[22])[0:3]) * 10000 * self.coordscalar) + (float(str(s[22])[3:5]) * 100 * self.coordscalar) + (float(str(s[22])[0:3]) * 1 * self.coordscalar)
-				self.groupX 		= (float(str(s[23])[0:3]) * 10000 * self.coordscalar) + (float(str(s[23])[3:5]) * 100 * self.coordscalar) + (float(str(s[23])[0:3]) * 1 * self.coordscalar)
-				self.groupY 		= (float(str(s[24])[0:3]) * 10000 * self.coordscalar) + (float(str(s[24])[3:5]) * 100 * self.coordscalar) + (float(str(s[24])[0:3]) * 1 * self.coordscalar)
+			self.crs			= COORDINATEUNITSCALE.get(self.coordunits, 0)
+			self.sourceX, self.sourceY, self.groupX, self.groupY = convertcoordinates(s[21:25], s[20], self.coordunits).tolist()
 
 		return True
 #################################################################################################
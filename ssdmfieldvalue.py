@@ -6,21 +6,65 @@ def main(*opargs, **kwargs):
     '''test rig for ssdmfieldvalue'''
     print(readvalue("SURVEY_ID", "defaultvalue"))
     print(readvalue("invalidrequest", "defaultvalue"))
+    print(readvalues(["SURVEY_ID", "SURVEY_ID_REF", "invalidrequest"], "defaultvalue"))
+
 ###############################################################################    
-def readvalue(fieldname, default=""):
+# the parsed field values, keyed by the lower case field name, and the modified time of the file they were read from
+FIELDVALUES = {}
+FIELDVALUESMTIME = None
+
+###############################################################################    
+def getfilename():
+    '''the ssdmfieldvalue.txt file lives alongside this module'''
     dir = os.path.dirname(os.path.abspath(__file__))
-    filename = 'ssdmfieldvalue.txt'
-    filename = os.path.join(dir, filename)
+    return os.path.join(dir, 'ssdmfieldvalue.txt')
+
+###############################################################################    
+def loadvalues():
+    '''parse the field value file into a dictionary.  the file is only re-read if it has been modified since we last read it'''
+    global FIELDVALUES, FIELDVALUESMTIME
+    filename = getfilename()
     if not os.path.isfile(filename):
-        return default
+        FIELDVALUES = {}
+        FIELDVALUESMTIME = None
+        return FIELDVALUES
+
+    mtime = os.path.getmtime(filename)
+    if mtime == FIELDVALUESMTIME:
+        return FIELDVALUES
 
-    file = open(filename)
-    for line in file:
-        if line.lower().startswith(fieldname.lower()):
+    values = {}
+    with open(filename) as file:
+        for line in file:
             fields = line.strip().split(',')
-            if len(fields) > 0:
-                return str(fields[1]).strip()
-    
+            if len(fields) < 2:
+                continue
+            key = fields[0].strip().lower()
+            # the first entry in the file wins, as it always has
+            if key not in values:
+                values[key] = str(fields[1]).strip()
+    FIELDVALUES = values
+    FIELDVALUESMTIME = mtime
+    return FIELDVALUES
+
+###############################################################################    
+def readvalue(fieldname, default=""):
+    '''return the value of a field from the ssdmfieldvalue.txt file, or the default if it is not there'''
+    values = loadvalues()
+    key = fieldname.lower()
+    if key in values:
+        return values[key]
+    # fall back to matching the start of the field name
+    for name in values:
+        if name.startswith(key):
+            return values[name]
+    return default
+
+###############################################################################    
+def readvalues(fieldnames, default=""):
+    '''return a list of values, one for each of the requested field names'''
+    return [readvalue(fieldname, default) for fieldname in fieldnames]
+
 ###############################################################################    
 if __name__ == "__main__":
 	main()
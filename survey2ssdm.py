@@ -11,6 +11,8 @@ import ctypes
 import fnmatch
 import math
 import json
+import hashlib
+import numpy as np
 from argparse import ArgumentParser
 from argparse import RawTextHelpFormatter
 from datetime import datetime
@@ -23,6 +25,7 @@ from py7k import s7kreader
 from pyjsf import jsfreader
 from segyreader import segyreader
 from pygsf import GSFREADER
+import pygsf
 import readkml
 import kmraw
 import sbd
@@ -54,6 +57,9 @@ def main():
 	parser.add_argument('-all', 	action='store_true', 	default=True, 	dest='all', 			help='extract all supported forms of data (ie do everything).')
 	parser.add_argument('-reprocess',action='store_true', 	default=False, 	dest='reprocess', 		help='reprocess the survey folders by re-reading input files and creating new GIS features, ignoring the cache files. (ie do everything).')
 	parser.add_argument('-cpu', 	action='store',			default='0', 	dest='cpu', 			help='number of cpu processes to use in parallel. [Default: 0, all cpu]')
+	parser.add_argument('-update', 	action='store_true', 	default=False, 	dest='update', 			help='update the existing GEOPACKAGE rather than creating a new one.  only the features for new or changed files are added. e.g. -update')
+	parser.add_argument('-bulk', 	action='store_true', 	default=False, 	dest='bulk', 			help='build the GEOPACKAGE quickly with fast sqlite settings in a temporary file, which is renamed when complete.  useful when writing to a network share. e.g. -bulk')
+	parser.add_argument('-simplify',action='store', 		default="0",	dest='simplify', 		help='simplify the track lines using douglas peucker so no vertex moves more than the tolerance.  add m for metres or deg for degrees, otherwise the units of the output EPSG. The true line length is kept. e.g. -simplify 0.5m [Default: 0, off]')
 
 	args = parser.parse_args()
 	# if len(sys.argv)==1:
@@ -109,36 +115,20 @@ def process(args):
 	if len(args.outputFilename) == 0:
 		args.outputFilename 	= os.path.join(args.opath, args.odir, surveyname + "_SSDM.gpkg")
 		args.outputFilename  	= fileutils.addFileNameAppendage(args.outputFilename, args.odix)
-		args.outputFilename 	= fileutils.createOutputFileName(args.outputFilename)
+		if not args.update:
+			args.outputFilename = fileutils.createOutputFileName(args.outputFilename)
 	
-	# create the gpkg...
-	gpkg = geopackage.geopackage(args.outputFilename, int(args.epsg))
+	# create the gpkg, or open the existing one if we are updating it...
+	gpkg = geopackage.geopackage(args.outputFilename, int(args.epsg), args.update, args.bulk)
 	# pkpk this does not yet work...
 	# gpkg.addEPSG(args.epsg)
 
 	#load the python proj projection object library if the user has requested it
 	geo = geodetic.geodesy(args.epsg)
 
-	# process any and all .sbd files from EIVA
-	mp_processSBD(args, gpkg, geo)
-
-	# process any and all .raw files from KM
-	mp_processKMRAW(args, gpkg, geo)
-
-	# process any and all kmall files
-	mp_processKMALL(args, gpkg, geo)
-
-	# process any and all 7k files
-	mp_process7k(args, gpkg, geo)
-
-	# process any and all JSF files
-	mp_processjsf(args, gpkg, geo)
-
-	# process any and all SEGY files
-	mp_processsegy(args, gpkg, geo)
-
-	# process any and all GSF files
-	mp_processgsf(args, gpkg, geo)
+	# process any and all supported files (sbd, km .raw, kmall, 7k, jsf, segy, gsf) through one shared process pool
+	mp_processsurvey(args, gpkg, geo)
+	gpkg.close()
 
 	print("Completed creation of SSDM tracks to: %s" %(args.outputFilename))
 
@@ -239,14 +229,11 @@ def processSBD(filename, outfilename, step, epsgsbd):
 
 	#the sbd files are in east north rather than lat, long so we need to convert them here...
 	geo = geodetic.geodesy(epsgsbd)
-	navigation3 = []
-	for nav in navigation:
-		x, y = geo.convertToGeographicals(nav[1], nav[2])
-		navigation3.append([nav[0], x, y, nav[3]])
-		# if x > 90:
-		# 	print ("oops")
-	with open(outfilename,'w') as f:
-		json.dump(navigation3, f)
+	# sbd navigation is time, x, y, heading
+	navigation3 = navigationtoarray(navigation, headingidx=3)
+	# convert the whole file in one call
+	navigation3[:,NAVLONGITUDEIDX], navigation3[:,NAVLATITUDEIDX] = geo.convertToGeographicals(navigation3[:,NAVLONGITUDEIDX], navigation3[:,NAVLATITUDEIDX])
+	savenavigationcache(outfilename, navigation3)
 	
 	return(navigation3)
 
@@ -259,8 +246,9 @@ def processKMRAW(filename, outfilename, step):
 	navigation = r.loadnavigation(step=1)
 	r.close()
 
-	with open(outfilename,'w') as f:
-		json.dump(navigation, f)
+	# km .raw navigation is time, x, y
+	navigation = navigationtoarray(navigation)
+	savenavigationcache(outfilename, navigation)
 	
 	return(navigation)
 
@@ -269,12 +257,13 @@ def processKMALL(filename, outfilename, step):
 	#now read the kmall file and return the navigation table filename
 
 	# print("Loading KMALL Navigation...")
-	r = kmall.kmallreader(filename)
+	r = kmall.kmallreader(filename, usemmap=True)
 	navigation = r.loadNavigation(step=1)
 	r.close()
 
-	with open(outfilename,'w') as f:
-		json.dump(navigation, f)
+	# kmall navigation is time, x, y, z, heading
+	navigation = navigationtoarray(navigation, depthidx=3, headingidx=4)
+	savenavigationcache(outfilename, navigation)
 	
 	return(navigation)
 
@@ -287,8 +276,9 @@ def process7k(filename, outfilename, step):
 	navigation = r.loadNavigation(False)
 	r.close()
 
-	with open(outfilename,'w') as f:
-		json.dump(navigation, f)
+	# 7k navigation is time, x, y
+	navigation = navigationtoarray(navigation)
+	savenavigationcache(outfilename, navigation)
 	
 	return(navigation)
 
@@ -299,15 +289,50 @@ def processgsf(filename, outfilename, step):
 	# print("Loading sgy Navigation...")
 	r = GSFREADER(filename)
 	if (r.fileSize == 0):
-		# the file is a corrupt empty file so skip
-		return navigation
+		# the file is a corrupt empty file so skip.  there is no cache for it, so it is not recorded in the manifest
+		return None
 	navigation = r.loadnavigation()
 	r.close()
 
-	with open(outfilename,'w') as f:
-		json.dump(navigation, f)
+	# gsf navigation is time, x, y, height, roll, pitch, heading, deltatime, pingflags
+	navigation = navigationtoarray(navigation, depthidx=3, headingidx=6)
+	savenavigationcache(outfilename, navigation)
 	
 	return(navigation)
+
+################################################################################
+def openkmall(filename):
+	'''open a kmall file memory mapped, so the record index is built with the buffer scan rather than a seek and read per datagram'''
+	return kmall.kmallreader(filename, usemmap=True)
+
+################################################################################
+def mergeKMALL(filename, outfilename, step, parts):
+	'''merge the navigation decoded from the byte ranges of a big kmall file, in file order'''
+	navigation = kmall.mergenavigation(parts, step=1)
+	if len(navigation) == 0:
+		# a byte range failed so the whole file has failed.  do not write a cache for it
+		return None
+
+	# kmall navigation is time, x, y, z, heading
+	navigation = navigationtoarray(navigation, depthidx=3, headingidx=4)
+	savenavigationcache(outfilename, navigation)
+
+	return(navigation)
+
+################################################################################
+def mergegsf(filename, outfilename, step, parts):
+	'''merge the navigation decoded from the byte ranges of a big gsf file, in file order'''
+	navigation = pygsf.mergenavigation(parts)
+	if len(navigation) == 0:
+		# a byte range failed so the whole file has failed.  do not write a cache for it
+		return None
+
+	# gsf navigation is time, x, y, height, roll, pitch, heading, deltatime, pingflags
+	navigation = navigationtoarray(navigation, depthidx=3, headingidx=6)
+	savenavigationcache(outfilename, navigation)
+
+	return(navigation)
+
 ################################################################################
 def processsegy(filename, outfilename, step):
 	#now read the kmall file and return the navigation table filename
@@ -315,14 +340,15 @@ def processsegy(filename, outfilename, step):
 	# print("Loading sgy Navigation...")
 	r = segyreader(filename)
 	if (r.fileSize == 0):
-		# the file is a corrupt empty file so skip
-		return navigation
+		# the file is a corrupt empty file so skip.  there is no cache for it, so it is not recorded in the manifest
+		return None
 	r.readHeader()
 	navigation = r.loadNavigation()
 	r.close()
 
-	with open(outfilename,'w') as f:
-		json.dump(navigation, f)
+	# segy navigation is time, x, y
+	navigation = navigationtoarray(navigation)
+	savenavigationcache(outfilename, navigation)
 	
 	return(navigation)
 
@@ -335,508 +361,417 @@ def processjsf(filename, outfilename, step):
 	navigation = r.loadNavigation(False)
 	r.close()
 
-	with open(outfilename,'w') as f:
-		json.dump(navigation, f)
+	# jsf navigation is time, x, y
+	navigation = navigationtoarray(navigation)
+	savenavigationcache(outfilename, navigation)
 	
 	return(navigation)
 
 ################################################################################
-def mp_process7k(args, gpkg, geo):
+# column layout of the navigation cache.  every file format is reduced to the same float64 columns
+NAVTIMEIDX		= 0
+NAVLONGITUDEIDX	= 1
+NAVLATITUDEIDX	= 2
+NAVDEPTHIDX		= 3
+NAVHEADINGIDX	= 4
+NAVCOLUMNS		= 5
 
-	# boundary = []
-	boundarytasks = []
-	results = []
+################################################################################
+def navigationtoarray(navigation, depthidx=None, headingidx=None):
+	'''convert the list of navigation records from a reader into a float64 array of time, longitude, latitude, depth, heading.  fields a format does not have are set to zero'''
+	nav = np.zeros((len(navigation), NAVCOLUMNS), dtype=np.float64, order='F')
+	if len(navigation) == 0:
+		return nav
+	records = np.array([[update[0], update[1], update[2]] for update in navigation], dtype=np.float64)
+	nav[:, NAVTIMEIDX:NAVLATITUDEIDX+1] = records
+	if depthidx is not None:
+		nav[:, NAVDEPTHIDX] = [update[depthidx] for update in navigation]
+	if headingidx is not None:
+		nav[:, NAVHEADINGIDX] = [update[headingidx] for update in navigation]
+	return nav
 
-	rawfolder = os.path.join(args.inputfolder, ssdmfieldvalue.readvalue("MBES_RAW_FOLDER"))
-	if not os.path.isdir(rawfolder):
-		rawfolder = args.inputfolder
+################################################################################
+def savenavigationcache(outfilename, navigation):
+	'''write the navigation array as a binary .npy file.  it is stored column major so each column is contiguous and can be memory mapped on load'''
+	np.save(outfilename, np.asfortranarray(navigation, dtype=np.float64))
 
-	# rawfilename = ssdmfieldvalue.readvalue("MBES_RAW_FILENAME")
+################################################################################
+def simplifytolerance(tolerance, geo):
+	'''convert the -simplify tolerance into the units of the output coordinate system.  a value ending in m is metres, ending in deg is degrees, otherwise it is already in the output units'''
+	METRESPERDEGREE = 111320.0 # near enough for a simplification tolerance
+	tolerance = str(tolerance).strip().lower()
+	geographic = int(geo.EPSGCode) == 4326 or geo.projection is None # convertToGrid leaves these as longitude, latitude
+	if tolerance.endswith("deg"):
+		tolerance = float(tolerance[:-3])
+		return tolerance if geographic else tolerance * METRESPERDEGREE
+	if tolerance.endswith("m"):
+		tolerance = float(tolerance[:-1])
+		return tolerance / METRESPERDEGREE if geographic else tolerance
+	return float(tolerance)
 
-	matches = fileutils.findFiles2(True, rawfolder, "*.s7k")
+################################################################################
+def decimationmask(times, step):
+	'''return a boolean mask of the fixes to keep so the kept fixes are at least step seconds apart.  the first and last fixes are always kept'''
+	times = np.asarray(times, dtype=np.float64)
+	if len(times) == 0:
+		return np.zeros(0, dtype=bool)
+	if step <= 0:
+		return np.ones(len(times), dtype=bool)
+	mask = np.zeros(len(times), dtype=bool)
+	if np.all(times[1:] >= times[:-1]):
+		# the times are in order, so find the next fix at least step seconds on from every fix in one go, then follow the chain from the first fix
+		nextfix = np.maximum(np.searchsorted(times, times + step, side='left'), np.arange(1, len(times) + 1)).tolist()
+		keep = []
+		idx = 0
+		while idx < len(times):
+			keep.append(idx)
+			idx = nextfix[idx]
+		mask[keep] = True
+	else:
+		# the times go backwards somewhere, so walk the fixes the slow way
+		lastTimeStamp = times[0]
+		mask[0] = True
+		for idx in range(1, len(times)):
+			if times[idx] - lastTimeStamp >= step:
+				mask[idx] = True
+				lastTimeStamp = times[idx]
+	mask[-1] = True
+	return mask
 
-	# surveyname = os.path.basename(args.inputfolder) #this folder should be the survey NAME
+################################################################################
+# the supported raw file formats.  extension : [navigation extractor, create a track point per fix, reader version]
+# bump the reader version whenever a reader changes what it decodes so the existing cache files for that format are rebuilt
+SUPPORTEDFORMATS = {
+	".sbd"		: [processSBD, 		True,	1],
+	".raw"		: [processKMRAW, 	False,	1],
+	".kmall"	: [processKMALL, 	False,	1],
+	".s7k"		: [process7k, 		False,	1],
+	".jsf"		: [processjsf, 		False,	1],
+	".sgy"		: [processsegy, 	False,	1],
+	".gsf"		: [processgsf, 		True,	1],
+}
+
+# the formats which can be split into record aligned byte ranges so one big file is decoded by all the cpus.  extension : [reader, byte range worker, merge]
+SPLITFORMATS = {
+	".kmall"	: [openkmall,			kmall.loadnavigationrange,	mergeKMALL],
+	".gsf"		: [GSFREADER,			pygsf.loadnavigationrange,	mergegsf],
+}
+# only files bigger than this are split, so the pool is not swamped with tiny tasks
+SPLITFILESIZE = 256 * 1024 * 1024
+
+# bump this whenever the layout of the navigation cache files changes
+NAVIGATIONCACHEVERSION = 1
 
-	#create the linestring table for the trackplot
-	type, fields = geopackage_ssdm.createSurveyTracklineSSDM()
-	linestringtable = geopackage.vectortable(gpkg.connection, "SurveyTrackLine", args.epsg, type, fields)
+################################################################################
+class navigationcachemanifest:
+	'''a record of which raw file each navigation cache file was built from.  each entry holds the source size, modified time, a fast partial hash and the reader version so only new or changed files are decoded again'''
+	def __init__(self, filename, reprocess=False):
+		self.filename = filename
+		self.entries = {}
+		if reprocess or not os.path.exists(filename):
+			return
+		try:
+			with open(filename) as f:
+				self.entries = json.load(f)
+		except (OSError, ValueError):
+			multiprocesshelper.log("Navigation cache manifest is unreadable, all files will be reprocessed: %s" % (filename))
+			self.entries = {}
+
+	###############################################################################
+	def cachefilename(self, outputfolder, key):
+		'''the cache file name includes a hash of the source path so files with the same name in different folders do not overwrite each other'''
+		pathhash = hashlib.md5(key.encode('utf-8')).hexdigest()[:8]
+		return os.path.join(outputfolder, "%s_%s_navigation.npy" % (os.path.basename(key), pathhash)).replace('\\','/')
+
+	###############################################################################
+	def isfresh(self, key, sourcefile, cachefile, size, mtime, readerversion):
+		'''return True if the cache file was built from this exact version of the source file with the current reader'''
+		entry = self.entries.get(key)
+		if entry is None:
+			return False
+		if entry["cachefile"] != os.path.basename(cachefile) or not os.path.exists(cachefile):
+			return False
+		if entry["cacheversion"] != NAVIGATIONCACHEVERSION or entry["readerversion"] != readerversion:
+			return False
+		if entry["size"] != size:
+			return False
+		if entry["mtime"] != mtime:
+			# the file has been touched, eg copied to another drive.  if the content is unchanged keep the cache
+			if entry["hash"] != fileutils.partialhash(sourcefile):
+				return False
+			entry["mtime"] = mtime
+		return True
+
+	###############################################################################
+	def update(self, key, sourcefile, cachefile, size, mtime, readerversion):
+		'''record that the cache file is now up to date with the source file'''
+		self.entries[key] = {
+			"source"		: key,
+			"cachefile"		: os.path.basename(cachefile),
+			"size"			: size,
+			"mtime"			: mtime,
+			"hash"			: fileutils.partialhash(sourcefile),
+			"readerversion"	: readerversion,
+			"cacheversion"	: NAVIGATIONCACHEVERSION,
+		}
+
+	###############################################################################
+	def save(self):
+		'''write the manifest to a temporary file and swap it in so a crash never leaves a half written manifest'''
+		tmpfilename = self.filename + ".tmp"
+		with open(tmpfilename, 'w') as f:
+			json.dump(self.entries, f, indent=1)
+		os.replace(tmpfilename, self.filename)
 
-	for filename in matches:
-		root = os.path.splitext(filename)[0]
-		root = os.path.basename(filename)
-		outputfolder = os.path.join(os.path.dirname(args.outputFilename), "log")
-		os.makedirs(outputfolder, exist_ok=True)
-		# makedirs(outputfolder)
-		outfilename = os.path.join(outputfolder, root+"_navigation.txt").replace('\\','/')
-		if args.reprocess:
-			if os.path.exists(outfilename):
-				os.unlink(outfilename)
-		if os.path.exists(outfilename):
-			# the cache file exists so load it
-			with open(outfilename) as f:
-				# print("loading file %s" %(outfilename))
-				lst = json.load(f)
-				results.append([filename, lst])
+################################################################################
+def processfile(task):
+	'''worker for the shared process pool.  extract the navigation from any supported file and return it alongside the filename so results can be consumed in any order.
+	a task for one byte range of a big file has a fifth item of (startbyte, endbyte, chunkindex, chunkcount) and returns just the navigation for that range.
+	the navigation is None if the file could not be decoded, so it is not recorded in the manifest and is tried again next time'''
+	filename, outfilename, step, epsgsbd = task[:4]
+	chunk = task[4] if len(task) > 4 else None
+	ext = os.path.splitext(filename)[1].lower()
+	navigation = None
+	try:
+		if chunk is not None:
+			navigation = SPLITFORMATS[ext][1]((filename, chunk[0], chunk[1]))
+		elif ext == ".sbd":
+			# sbd files are in grid coordinates so they need the epsg code to convert to geographicals
+			navigation = processSBD(filename, outfilename, step, epsgsbd)
 		else:
-			boundarytasks.append([filename, outfilename])
-
-	multiprocesshelper.log("New 7k Files to Import: %d" %(len(boundarytasks)))		
-	cpu = multiprocesshelper.getcpucount(args.cpu)
-	multiprocesshelper.log("Extracting S7K Navigation with %d CPU's" %(cpu))
-	pool = mp.Pool(cpu)
-	multiprocesshelper.g_procprogress.setmaximum(len(boundarytasks))
-	# poolresults = [pool.apply_async(processKMALL, (task[0], task[1], args.step)) for task in boundarytasks]
-	poolresults = [pool.apply_async(process7k, (task[0], task[1], args.step), callback=multiprocesshelper.mpresult) for task in boundarytasks]
-	pool.close()
-	pool.join()
-	for idx, result in enumerate (poolresults):
-		results.append([boundarytasks[idx][0], result._value])
-		# print (result._value)
-
-	# now we can read the results files and create the geometry into the SSDM table
-	multiprocesshelper.log("Files to Import to geopackage: %d" %(len(results)))		
-
-	multiprocesshelper.g_procprogress.setmaximum(len(results))
-	for result in results:
-		createTrackLine(result[0], result[1], linestringtable, float(args.step), geo)
-		multiprocesshelper.mpresult("")
+			navigation = SUPPORTEDFORMATS[ext][0](filename, outfilename, step)
+	except:
+		e = sys.exc_info()[0]
+		print("Error: %s.  Please check file.  it seems to be corrupt: %s" % (e, filename))
+	return filename, navigation, chunk
 
 ################################################################################
-def mp_processgsf(args, gpkg, geo):
-
-	# boundary = []
-	boundarytasks = []
-	results = []
-
-	rawfolder = os.path.join(args.inputfolder, ssdmfieldvalue.readvalue("MBES_RAW_FOLDER"))
-	if not os.path.isdir(rawfolder):
-		rawfolder = args.inputfolder
+def findbyteranges(task):
+	'''process pool worker.  split a big file into record aligned byte ranges, task is (filename, cpu).  building the record index is the one full scan of the file, so it is done in the pool where the big files are scanned side by side.
+	the index is saved alongside the file, so the byte range workers load it rather than scan the file again'''
+	filename, cpu = task
+	ext = os.path.splitext(filename)[1].lower()
+	try:
+		r = SPLITFORMATS[ext][0](filename)
+		byteranges = r.getbyteranges(cpu)
+		r.close()
+	except:
+		return []
+	return byteranges
 
-	# rawfilename = ssdmfieldvalue.readvalue("MBES_RAW_FILENAME")
+################################################################################
+def splittasks(pool, tasks, sources, cpu):
+	'''split the tasks for big files into tasks for record aligned byte ranges of the file, so all the cpus work on it.  small files and formats which cannot be split stay as one task'''
+	bigfiles = [task[0] for task in tasks if os.path.splitext(task[0])[1].lower() in SPLITFORMATS and sources[task[0]][3] >= SPLITFILESIZE]
+	byteranges = dict(zip(bigfiles, pool.map(findbyteranges, [(filename, cpu) for filename in bigfiles], chunksize=1)))
+	splits = []
+	for task in tasks:
+		ranges = byteranges.get(task[0], [])
+		if len(ranges) <= 1:
+			splits.append(task)
+			continue
+		splits.extend([task + [(startbyte, endbyte, chunkindex, len(ranges))] for chunkindex, (startbyte, endbyte) in enumerate(ranges)])
+	return splits
 
-	matches = fileutils.findFiles2(True, rawfolder, "*.gsf")
+################################################################################
+def mergeresult(result, pending, sources, step):
+	'''collect the results from the pool.  a whole file is returned as is.  the byte ranges of a big file are held until they are all in, then merged in file order.  returns None, None while we are waiting.
+	the navigation of a big file is None if any of its byte ranges failed, so the file is not recorded as done in the manifest'''
+	filename, navigation, chunk = result
+	if chunk is None:
+		return filename, navigation
+	startbyte, endbyte, chunkindex, chunkcount = chunk
+	parts = pending.setdefault(filename, {})
+	parts[chunkindex] = navigation
+	if len(parts) < chunkcount:
+		return None, None
+	del pending[filename]
+	ext = os.path.splitext(filename)[1].lower()
+	try:
+		navigation = SPLITFORMATS[ext][2](filename, sources[filename][2], step, [parts[i] for i in range(chunkcount)])
+	except:
+		e = sys.exc_info()[0]
+		print("Error: %s.  Please check file.  it seems to be corrupt: %s" % (e, filename))
+		navigation = None
+	return filename, navigation
 
-	# surveyname = os.path.basename(args.inputfolder) #this folder should be the survey NAME
+################################################################################
+def findrawfiles(rawfolder, extensions):
+	'''walk the folder tree once and return a list of [filename, filesize, modifiedtime] for every file with a supported extension'''
+	matches = []
+	for root, dirnames, filenames in os.walk(rawfolder):
+		for f in filenames:
+			if os.path.splitext(f)[1].lower() in extensions:
+				filename = os.path.join(root, f).replace('\\','/')
+				stat = os.stat(filename)
+				matches.append([filename, stat.st_size, stat.st_mtime])
+	return matches
 
-	#create the POINT table for the trackplot
-	tptype, tpfields = geopackage_ssdm.createTrackPoint()
-	pointtable = geopackage.vectortable(gpkg.connection, "SurveyTrackPoint", args.epsg, tptype, tpfields)
+################################################################################
+def writetracks(filename, navigation, linestringtable, pointtable, step, geo, tolerance=0.0):
+	'''write the navigation for a single file into the SSDM track tables'''
+	createTrackLine(filename, navigation, linestringtable, float(step), geo, tolerance=tolerance)
+	if SUPPORTEDFORMATS[os.path.splitext(filename)[1].lower()][1]:
+		createTrackPoint(filename, navigation, pointtable, float(step), geo)
+	multiprocesshelper.mpresult("")
 
-	#create the linestring table for the trackplot
-	type, fields = geopackage_ssdm.createSurveyTracklineSSDM()
-	linestringtable = geopackage.vectortable(gpkg.connection, "SurveyTrackLine", args.epsg, type, fields)
+################################################################################
+def loadnavigationcache(outfilename):
+	'''load the navigation from a cache file written by one of the process workers.  the file is memory mapped so only the columns we touch are read from disc'''
+	try:
+		return np.load(outfilename, mmap_mode='r')
+	except ValueError:
+		# an empty navigation array cannot be memory mapped
+		return np.load(outfilename)
 
-	for filename in matches:
-		root = os.path.splitext(filename)[0]
-		root = os.path.basename(filename)
-		outputfolder = os.path.join(os.path.dirname(args.outputFilename), "log")
-		os.makedirs(outputfolder, exist_ok=True)
-		# makedirs(outputfolder)
-		outfilename = os.path.join(outputfolder, root+"_navigation.txt").replace('\\','/')
-		if args.reprocess:
-			if os.path.exists(outfilename):
-				os.unlink(outfilename)
-		if os.path.exists(outfilename):
-			# the cache file exists so load it
-			with open(outfilename) as f:
-				# print("loading file %s" %(outfilename))
-				lst = json.load(f)
-				results.append([filename, lst])
-		else:
-			boundarytasks.append([filename, outfilename])
-
-	if args.cpu == '1':
-		for filename in matches:
-			root = os.path.splitext(filename)[0]
-			root = os.path.basename(filename)
-			outputfolder = os.path.join(os.path.dirname(args.outputFilename), "log")
-			os.makedirs(outputfolder, exist_ok=True)
-			# makedirs(outputfolder)
-			outfilename = os.path.join(outputfolder, root+"_navigation.txt").replace('\\','/')
-			result = processgsf(filename, outfilename, args.step)
-			results.append([filename, result])
-	else:
-		multiprocesshelper.log("New GSF Files to Import: %d" %(len(boundarytasks)))		
-		cpu = multiprocesshelper.getcpucount(args.cpu)
-		multiprocesshelper.log("Extracting GSF Navigation with %d CPU's" %(cpu))
-		pool = mp.Pool(cpu)
-		multiprocesshelper.g_procprogress.setmaximum(len(boundarytasks))
-		poolresults = [pool.apply_async(processgsf, (task[0], task[1], args.step), callback=multiprocesshelper.mpresult) for task in boundarytasks]
-		pool.close()
-		pool.join()
-		for idx, result in enumerate (poolresults):
-			results.append([boundarytasks[idx][0], result._value])
-			# print (result._value)
-
-	# now we can read the results files and create the geometry into the SSDM table
-	multiprocesshelper.log("Files to Import to geopackage: %d" %(len(results)))		
-
-	multiprocesshelper.g_procprogress.setmaximum(len(results))
-	for result in results:
-		createTrackLine(result[0], result[1], linestringtable, float(args.step), geo)
-		createTrackPoint(result[0], result[1], pointtable, float(args.step), geo)
-		multiprocesshelper.mpresult("")
 ################################################################################
-def mp_processsegy(args, gpkg, geo):
+def mp_processsurvey(args, gpkg, geo, extensions=SUPPORTEDFORMATS):
+	'''find every supported file in a single walk of the survey, then extract the navigation through one shared process pool, largest files first.  each result is written to the geopackage as soon as it completes so only a handful of navigation lists are ever held in memory'''
 
-	# boundary = []
 	boundarytasks = []
-	results = []
+	cachefiles = []
 
 	rawfolder = os.path.join(args.inputfolder, ssdmfieldvalue.readvalue("MBES_RAW_FOLDER"))
 	if not os.path.isdir(rawfolder):
 		rawfolder = args.inputfolder
 
-	# rawfilename = ssdmfieldvalue.readvalue("MBES_RAW_FILENAME")
+	# the track simplification tolerance in the units of the output coordinate system
+	tolerance = simplifytolerance(args.simplify, geo)
 
-	matches = fileutils.findFiles2(True, rawfolder, "*.sgy")
+	matches = findrawfiles(rawfolder, extensions)
+	# schedule the largest files first so one big file does not hold up the tail of the queue
+	matches.sort(key=lambda match: match[1], reverse=True)
 
-	# surveyname = os.path.basename(args.inputfolder) #this folder should be the survey NAME
+	#create the POINT table for the trackplot
+	tptype, tpfields = geopackage_ssdm.createTrackPoint()
+	pointtable = geopackage.vectortable(gpkg.connection, "SurveyTrackPoint", args.epsg, tptype, tpfields)
 
 	#create the linestring table for the trackplot
 	type, fields = geopackage_ssdm.createSurveyTracklineSSDM()
 	linestringtable = geopackage.vectortable(gpkg.connection, "SurveyTrackLine", args.epsg, type, fields)
 
-	for filename in matches:
-		root = os.path.splitext(filename)[0]
-		root = os.path.basename(filename)
-		outputfolder = os.path.join(os.path.dirname(args.outputFilename), "log")
-		os.makedirs(outputfolder, exist_ok=True)
-		# makedirs(outputfolder)
-		outfilename = os.path.join(outputfolder, root+"_navigation.txt").replace('\\','/')
-		if args.reprocess:
-			if os.path.exists(outfilename):
-				os.unlink(outfilename)
-		if os.path.exists(outfilename):
-			# the cache file exists so load it
-			with open(outfilename) as f:
-				# print("loading file %s" %(outfilename))
-				lst = json.load(f)
-				results.append([filename, lst])
-		else:
-			boundarytasks.append([filename, outfilename])
-
-	if args.cpu == '1':
-		for filename in matches:
-			root = os.path.splitext(filename)[0]
-			root = os.path.basename(filename)
-			outputfolder = os.path.join(os.path.dirname(args.outputFilename), "log")
-			os.makedirs(outputfolder, exist_ok=True)
-			# makedirs(outputfolder)
-			outfilename = os.path.join(outputfolder, root+"_navigation.txt").replace('\\','/')
-			result = processsegy(filename, outfilename, args.step)
-			results.append([filename, result])
-	else:
-		multiprocesshelper.log("New sgy Files to Import: %d" %(len(boundarytasks)))		
-		cpu = multiprocesshelper.getcpucount(args.cpu)
-		multiprocesshelper.log("Extracting SGY Navigation with %d CPU's" %(cpu))
-		pool = mp.Pool(cpu)
-		multiprocesshelper.g_procprogress.setmaximum(len(boundarytasks))
-		poolresults = [pool.apply_async(processsegy, (task[0], task[1], args.step), callback=multiprocesshelper.mpresult) for task in boundarytasks]
-		pool.close()
-		pool.join()
-		for idx, result in enumerate (poolresults):
-			results.append([boundarytasks[idx][0], result._value])
-			# print (result._value)
-
-	# now we can read the results files and create the geometry into the SSDM table
-	multiprocesshelper.log("Files to Import to geopackage: %d" %(len(results)))		
-
-	multiprocesshelper.g_procprogress.setmaximum(len(results))
-	for result in results:
-		createTrackLine(result[0], result[1], linestringtable, float(args.step), geo)
-		multiprocesshelper.mpresult("")
-
-################################################################################
-def mp_processjsf(args, gpkg, geo):
-
-	# boundary = []
-	boundarytasks = []
-	results = []
-
-	rawfolder = os.path.join(args.inputfolder, ssdmfieldvalue.readvalue("MBES_RAW_FOLDER"))
-	if not os.path.isdir(rawfolder):
-		rawfolder = args.inputfolder
-
-	# rawfilename = ssdmfieldvalue.readvalue("MBES_RAW_FILENAME")
-
-	matches = fileutils.findFiles2(True, rawfolder, "*.jsf")
+	outputfolder = os.path.join(os.path.dirname(args.outputFilename), "log")
+	os.makedirs(outputfolder, exist_ok=True)
+	manifest = navigationcachemanifest(os.path.join(outputfolder, "navigationcache.json"), args.reprocess)
+	sources = {}
 
-	# surveyname = os.path.basename(args.inputfolder) #this folder should be the survey NAME
-
-	#create the linestring table for the trackplot
-	type, fields = geopackage_ssdm.createSurveyTracklineSSDM()
-	linestringtable = geopackage.vectortable(gpkg.connection, "SurveyTrackLine", args.epsg, type, fields)
+	cpu = multiprocesshelper.getcpucount(args.cpu)
 
-	for filename in matches:
-		root = os.path.splitext(filename)[0]
-		root = os.path.basename(filename)
-		outputfolder = os.path.join(os.path.dirname(args.outputFilename), "log")
-		os.makedirs(outputfolder, exist_ok=True)
-		# makedirs(outputfolder)
-		outfilename = os.path.join(outputfolder, root+"_navigation.txt").replace('\\','/')
-		if args.reprocess:
-			if os.path.exists(outfilename):
-				os.unlink(outfilename)
-		if os.path.exists(outfilename):
-			# the cache file exists so load it
-			with open(outfilename) as f:
-				# print("loading file %s" %(outfilename))
-				lst = json.load(f)
-				results.append([filename, lst])
+	# when updating an existing geopackage, find out which files are already in it so we only add the new ones
+	existing = set()
+	if args.update:
+		existing = linestringtable.getdistinctvalues("DATA_SOURCE")
+	skipped = 0
+
+	files = []
+	for filename, filesize, filemtime in matches:
+		# key the cache on the path relative to the survey so it survives the survey being moved to another drive
+		key = os.path.relpath(filename, args.inputfolder).replace('\\','/')
+		outfilename = manifest.cachefilename(outputfolder, key)
+		readerversion = SUPPORTEDFORMATS[os.path.splitext(filename)[1].lower()][2]
+		fresh = manifest.isfresh(key, filename, outfilename, filesize, filemtime, readerversion)
+		files.append([filename, filesize, filemtime, key, outfilename, readerversion, fresh])
+
+	# the features are tagged with the file name only, so files of the same name in different folders share a DATA_SOURCE.
+	# if any one of them is new or has changed, the features of all of them are deleted and every one of them is written again
+	stale = set(os.path.basename(filename) for filename, filesize, filemtime, key, outfilename, readerversion, fresh in files if not fresh)
+	deleted = set()
+
+	for filename, filesize, filemtime, key, outfilename, readerversion, fresh in files:
+		datasource = os.path.basename(filename)
+		if datasource in existing:
+			if datasource not in stale:
+				# already in the geopackage and unchanged since, so nothing to do
+				skipped += 1
+				continue
+			# this file, or another of the same name, has changed since it was added, eg it was still logging, so replace their features
+			if datasource not in deleted:
+				linestringtable.deleterecords("DATA_SOURCE", datasource)
+				pointtable.deleterecords("DATA_SOURCE", datasource)
+				deleted.add(datasource)
+		if fresh:
+			# the cache file is up to date so load it when we are ready to write it
+			cachefiles.append([filename, outfilename])
 		else:
-			boundarytasks.append([filename, outfilename])
+			sources[filename] = [key, filename, outfilename, filesize, filemtime, readerversion]
+			boundarytasks.append([filename, outfilename, args.step, args.epsgsbd])
+
+	if args.update:
+		multiprocesshelper.log("Files already in geopackage: %d" %(skipped))
+	multiprocesshelper.log("Files to Import from cache: %d" %(len(cachefiles)))
+	multiprocesshelper.log("New Files to Import: %d" %(len(sources)))
+	multiprocesshelper.g_procprogress.setmaximum(len(cachefiles) + len(sources))
+
+	if cpu == 1:
+		for filename, outfilename in cachefiles:
+			writetracks(filename, loadnavigationcache(outfilename), linestringtable, pointtable, args.step, geo, tolerance)
+		for task in boundarytasks:
+			filename, navigation, chunk = processfile(task)
+			writetracks(filename, navigation, linestringtable, pointtable, args.step, geo, tolerance)
+			# only record the file once its navigation cache has been written
+			if navigation is not None:
+				manifest.update(*sources[filename])
+		manifest.save()
+		return
 
-	multiprocesshelper.log("New jsf Files to Import: %d" %(len(boundarytasks)))		
-	cpu = multiprocesshelper.getcpucount(args.cpu)
-	multiprocesshelper.log("Extracting JSF Navigation with %d CPU's" %(cpu))
+	multiprocesshelper.log("Extracting Navigation with %d CPU's" %(cpu))
 	pool = mp.Pool(cpu)
-	multiprocesshelper.g_procprogress.setmaximum(len(boundarytasks))
-	# poolresults = [pool.apply_async(processKMALL, (task[0], task[1], args.step)) for task in boundarytasks]
-	poolresults = [pool.apply_async(processjsf, (task[0], task[1], args.step), callback=multiprocesshelper.mpresult) for task in boundarytasks]
+	# big files are split into byte ranges so every cpu can work on them
+	boundarytasks = splittasks(pool, boundarytasks, sources, cpu)
+	# imap_bounded hands the first couple of tasks per cpu to the pool before it returns, so the workers decode while we write the cached files.
+	# only a couple of results per cpu are allowed to wait for the writer so the parent memory stays bounded.
+	poolresults = multiprocesshelper.imap_bounded(pool, processfile, boundarytasks, cpu * 2)
+	for filename, outfilename in cachefiles:
+		writetracks(filename, loadnavigationcache(outfilename), linestringtable, pointtable, args.step, geo, tolerance)
+	pending = {}
+	for result in poolresults:
+		filename, navigation = mergeresult(result, pending, sources, args.step)
+		if filename is None:
+			continue
+		writetracks(filename, navigation, linestringtable, pointtable, args.step, geo, tolerance)
+		# only record the file once its navigation cache has been written
+		if navigation is not None:
+			manifest.update(*sources[filename])
 	pool.close()
 	pool.join()
-	for idx, result in enumerate (poolresults):
-		results.append([boundarytasks[idx][0], result._value])
-		# print (result._value)
-
-	# now we can read the results files and create the geometry into the SSDM table
-	multiprocesshelper.log("Files to Import to geopackage: %d" %(len(results)))		
-
-	multiprocesshelper.g_procprogress.setmaximum(len(results))
-	for result in results:
-		createTrackLine(result[0], result[1], linestringtable, float(args.step), geo)
-		multiprocesshelper.mpresult("")
+	for filename in pending:
+		multiprocesshelper.log("Error: not all of the file was decoded: %s" % (filename), error=True)
+	manifest.save()
 
 ################################################################################
-def mp_processSBD(args, gpkg, geo):
-
-	# boundary = []
-	boundarytasks = []
-	results = []
-
-	rawfolder = os.path.join(args.inputfolder, ssdmfieldvalue.readvalue("MBES_RAW_FOLDER"))
-	if not os.path.isdir(rawfolder):
-		rawfolder = args.inputfolder
-
-	# rawfilename = ssdmfieldvalue.readvalue("MBES_RAW_FILENAME")
-
-	matches = fileutils.findFiles2(True, rawfolder, "*.sbd")
-
-	# if args.epsgsbd == "0":
-	# 	reader = sbd.SBDReader(matches[0])
-	# 	timstamp, x, y, heading = reader.getfirstcoordinate()
-	# 	# args.epsgsbd = geo.getEPSGfromEN(x,y)
-	# 	args.epsgsbd = geodetic.getPRJFromEPSG(x,y)
-
-	# surveyname = os.path.basename(args.inputfolder) #this folder should be the survey NAME
-
-	#create the POINT table for the trackplot
-	tptype, tpfields = geopackage_ssdm.createTrackPoint()
-	pointtable = geopackage.vectortable(gpkg.connection, "SurveyTrackPoint", args.epsg, tptype, tpfields)
+def mp_process7k(args, gpkg, geo):
+	'''process any and all 7k files through the streaming scheduler'''
+	mp_processsurvey(args, gpkg, geo, [".s7k"])
 
-	#create the linestring table for the trackplot
-	type, fields = geopackage_ssdm.createSurveyTracklineSSDM()
-	linestringtable = geopackage.vectortable(gpkg.connection, "SurveyTrackLine", args.epsg, type, fields)
+################################################################################
+def mp_processgsf(args, gpkg, geo):
+	'''process any and all GSF files through the streaming scheduler'''
+	mp_processsurvey(args, gpkg, geo, [".gsf"])
 
-	for filename in matches:
-		root = os.path.splitext(filename)[0]
-		root = os.path.basename(filename)
-		outputfolder = os.path.join(os.path.dirname(args.outputFilename), "log")
-		os.makedirs(outputfolder, exist_ok=True)
-		# makedirs(outputfolder)
-		outfilename = os.path.join(outputfolder, root+"_navigation.txt").replace('\\','/')
-		if args.reprocess:
-			if os.path.exists(outfilename):
-				os.unlink(outfilename)
-		if os.path.exists(outfilename):
-			# the cache file exists so load it
-			with open(outfilename) as f:
-				# print("loading file %s" %(outfilename))
-				lst = json.load(f)
-				results.append([filename, lst])
-		else:
-			boundarytasks.append([filename, outfilename])
-
-	if args.cpu == '1':
-		for filename in matches:
-			root = os.path.splitext(filename)[0]
-			root = os.path.basename(filename)
-			outputfolder = os.path.join(os.path.dirname(args.outputFilename), "log")
-			outfilename = os.path.join(outputfolder, root+"_navigation.txt").replace('\\','/')
-			if os.path.exists(outfilename):
-				continue
+################################################################################
+def mp_processsegy(args, gpkg, geo):
+	'''process any and all SEGY files through the streaming scheduler'''
+	mp_processsurvey(args, gpkg, geo, [".sgy"])
 
-			root = os.path.splitext(filename)[0]
-			root = os.path.basename(filename)
-			outputfolder = os.path.join(os.path.dirname(args.outputFilename), "log")
-			os.makedirs(outputfolder, exist_ok=True)
-			outfilename = os.path.join(outputfolder, root+"_navigation.txt").replace('\\','/')
-			result = processSBD(filename, outfilename, args.step, args.epsgsbd)
-			results.append([filename, result])			
-	else:
-		multiprocesshelper.log("New km .raw Files to Import: %d" %(len(boundarytasks)))		
-		cpu = multiprocesshelper.getcpucount(args.cpu)
-		multiprocesshelper.log("Extracting KM .RAW Navigation with %d CPU's" %(cpu))
-		pool = mp.Pool(cpu)
-		multiprocesshelper.g_procprogress.setmaximum(len(boundarytasks))
-		poolresults = [pool.apply_async(processSBD, (task[0], task[1], args.step, args.epsgsbd), callback=multiprocesshelper.mpresult) for task in boundarytasks]
-		pool.close()
-		pool.join()
-		for idx, result in enumerate (poolresults):
-			results.append([boundarytasks[idx][0], result._value])
-			# print (result._value)
-
-	# now we can read the results files and create the geometry into the SSDM table
-	multiprocesshelper.log("Files to Import to geopackage: %d" %(len(results)))		
-
-	multiprocesshelper.g_procprogress.setmaximum(len(results))
-	for result in results:
-		createTrackLine(result[0], result[1], linestringtable, float(args.step), geo)
-		createTrackPoint(result[0], result[1], pointtable, float(args.step), geo)
-		multiprocesshelper.mpresult("")
+################################################################################
+def mp_processjsf(args, gpkg, geo):
+	'''process any and all JSF files through the streaming scheduler'''
+	mp_processsurvey(args, gpkg, geo, [".jsf"])
 
+################################################################################
+def mp_processSBD(args, gpkg, geo):
+	'''process any and all .sbd files from EIVA through the streaming scheduler'''
+	mp_processsurvey(args, gpkg, geo, [".sbd"])
 
 ################################################################################
 def mp_processKMRAW(args, gpkg, geo):
-
-	# boundary = []
-	boundarytasks = []
-	results = []
-
-	rawfolder = os.path.join(args.inputfolder, ssdmfieldvalue.readvalue("MBES_RAW_FOLDER"))
-	if not os.path.isdir(rawfolder):
-		rawfolder = args.inputfolder
-
-	# rawfilename = ssdmfieldvalue.readvalue("MBES_RAW_FILENAME")
-
-	matches = fileutils.findFiles2(True, rawfolder, "*.raw")
-
-	# surveyname = os.path.basename(args.inputfolder) #this folder should be the survey NAME
-
-	#create the linestring table for the trackplot
-	type, fields = geopackage_ssdm.createSurveyTracklineSSDM()
-	linestringtable = geopackage.vectortable(gpkg.connection, "SurveyTrackLine", args.epsg, type, fields)
-
-	for filename in matches:
-		root = os.path.splitext(filename)[0]
-		root = os.path.basename(filename)
-		outputfolder = os.path.join(os.path.dirname(args.outputFilename), "log")
-		os.makedirs(outputfolder, exist_ok=True)
-		# makedirs(outputfolder)
-		outfilename = os.path.join(outputfolder, root+"_navigation.txt").replace('\\','/')
-		if args.reprocess:
-			if os.path.exists(outfilename):
-				os.unlink(outfilename)
-		if os.path.exists(outfilename):
-			# the cache file exists so load it
-			with open(outfilename) as f:
-				# print("loading file %s" %(outfilename))
-				lst = json.load(f)
-				results.append([filename, lst])
-		else:
-			boundarytasks.append([filename, outfilename])
-
-	if args.cpu == '1':
-		for filename in matches:
-			root = os.path.splitext(filename)[0]
-			root = os.path.basename(filename)
-			outputfolder = os.path.join(os.path.dirname(args.outputFilename), "log")
-			os.makedirs(outputfolder, exist_ok=True)
-			outfilename = os.path.join(outputfolder, root+"_navigation.txt").replace('\\','/')
-			result = processKMRAW(filename, outfilename, args.step)
-			results.append([filename, result])			
-	else:
-		multiprocesshelper.log("New km .raw Files to Import: %d" %(len(boundarytasks)))		
-		cpu = multiprocesshelper.getcpucount(args.cpu)
-		multiprocesshelper.log("Extracting KM .RAW Navigation with %d CPU's" %(cpu))
-		pool = mp.Pool(cpu)
-		multiprocesshelper.g_procprogress.setmaximum(len(boundarytasks))
-		poolresults = [pool.apply_async(processKMRAW, (task[0], task[1], args.step), callback=multiprocesshelper.mpresult) for task in boundarytasks]
-		pool.close()
-		pool.join()
-		for idx, result in enumerate (poolresults):
-			results.append([boundarytasks[idx][0], result._value])
-			# print (result._value)
-
-	# now we can read the results files and create the geometry into the SSDM table
-	multiprocesshelper.log("Files to Import to geopackage: %d" %(len(results)))		
-
-	multiprocesshelper.g_procprogress.setmaximum(len(results))
-	for result in results:
-		createTrackLine(result[0], result[1], linestringtable, float(args.step), geo)
-		multiprocesshelper.mpresult("")
+	'''process any and all .raw files from KM through the streaming scheduler'''
+	mp_processsurvey(args, gpkg, geo, [".raw"])
 
 ################################################################################
 def mp_processKMALL(args, gpkg, geo):
-
-	# boundary = []
-	boundarytasks = []
-	results = []
-
-	rawfolder = os.path.join(args.inputfolder, ssdmfieldvalue.readvalue("MBES_RAW_FOLDER"))
-	if not os.path.isdir(rawfolder):
-		rawfolder = args.inputfolder
-
-	# rawfilename = ssdmfieldvalue.readvalue("MBES_RAW_FILENAME")
-
-	matches = fileutils.findFiles2(True, rawfolder, "*.kmall")
-
-	# surveyname = os.path.basename(args.inputfolder) #this folder should be the survey NAME
-
-	#create the linestring table for the trackplot
-	type, fields = geopackage_ssdm.createSurveyTracklineSSDM()
-	linestringtable = geopackage.vectortable(gpkg.connection, "SurveyTrackLine", args.epsg, type, fields)
-
-	for filename in matches:
-		root = os.path.splitext(filename)[0]
-		root = os.path.basename(filename)
-		outputfolder = os.path.join(os.path.dirname(args.outputFilename), "log")
-		os.makedirs(outputfolder, exist_ok=True)
-		# makedirs(outputfolder)
-		outfilename = os.path.join(outputfolder, root+"_navigation.txt").replace('\\','/')
-		if args.reprocess:
-			if os.path.exists(outfilename):
-				os.unlink(outfilename)
-		if os.path.exists(outfilename):
-			# the cache file exists so load it
-			with open(outfilename) as f:
-				# print("loading file %s" %(outfilename))
-				lst = json.load(f)
-				results.append([filename, lst])
-		else:
-			boundarytasks.append([filename, outfilename])
-
-	if args.cpu == '1':
-		for filename in matches:
-			root = os.path.splitext(filename)[0]
-			root = os.path.basename(filename)
-			outputfolder = os.path.join(os.path.dirname(args.outputFilename), "log")
-			os.makedirs(outputfolder, exist_ok=True)
-			outfilename = os.path.join(outputfolder, root+"_navigation.txt").replace('\\','/')
-			result = processKMALL(filename, outfilename, args.step)
-			results.append([filename, result])			
-	else:
-		multiprocesshelper.log("New kmall Files to Import: %d" %(len(boundarytasks)))		
-		cpu = multiprocesshelper.getcpucount(args.cpu)
-		multiprocesshelper.log("Extracting KMALL Navigation with %d CPU's" %(cpu))
-		pool = mp.Pool(cpu)
-		multiprocesshelper.g_procprogress.setmaximum(len(boundarytasks))
-		# poolresults = [pool.apply_async(processKMALL, (task[0], task[1], args.step)) for task in boundarytasks]
-		poolresults = [pool.apply_async(processKMALL, (task[0], task[1], args.step), callback=multiprocesshelper.mpresult) for task in boundarytasks]
-		pool.close()
-		pool.join()
-		for idx, result in enumerate (poolresults):
-			results.append([boundarytasks[idx][0], result._value])
-			# print (result._value)
-
-	# now we can read the results files and create the geometry into the SSDM table
-	multiprocesshelper.log("Files to Import to geopackage: %d" %(len(results)))		
-
-	multiprocesshelper.g_procprogress.setmaximum(len(results))
-	for result in results:
-		createTrackLine(result[0], result[1], linestringtable, float(args.step), geo)
-		multiprocesshelper.mpresult("")
+	'''process any and all kmall files through the streaming scheduler'''
+	mp_processsurvey(args, gpkg, geo, [".kmall"])
 
 ###############################################################################
 def createTrackPoint(filename, navigation, pointtable, step, geo, surveyname=""):
@@ -877,49 +812,52 @@ def createTrackPoint(filename, navigation, pointtable, step, geo, surveyname="")
 
 	# compute the brg1 line heading
 	# distance, brg1, brg2 = geodetic.calculateRangeBearingFromGeographicals(navigation[0][1], navigation[0][2], navigation[-1][1], navigation[-1][2])
+	###########################
+	# the SSDM fields which are the same for every point in the file are looked up once
+	###########################
+	archivefields = setssdmarchivefields() # 2 fields
+	objectvalues = getssdmobjectvalues() # 3 of the object fields
+	lineid, symbologycode, contractorname, eqlurl, otherurl, layer = ssdmfieldvalue.readvalues(["LINE_ID", "TRACK_SYMBOLOGY_CODE", "CONTRACTOR_NAME", "HIRES_SEISMIC_EQL_URL", "OTHER_DATA_URL", "TRACK_LAYER"])
+	linename = os.path.basename(filename)
+	linefields = []
+	linefields.append(lineid)
+	#LINE_NAME
+	linefields.append(linename)
+	#LAST_SEIS_PT_ID
+	linefields.append(int(navigation[-1][timeIDX]))
+	#SYMBOLOGY_CODE
+	linefields.append(symbologycode)
+	#DATA_SOURCE
+	linefields.append(linename)
+	#CONTRACTOR_NAME
+	linefields.append(contractorname)
+	#LINE_LENGTH
+	linefields.append(totalDistanceRun)
+	#FIRST_SEIS_PT_ID
+	linefields.append(int(navigation[0][timeIDX]))
+	#HIRES_SEISMIC_EQL_URL
+	linefields.append(eqlurl)
+	#OTHER_DATA_URL
+	linefields.append(otherurl)
+	#LAYER
+	linefields.append(layer)
+	#SHAPE_Length
+	linefields.append(totalDistanceRun)
+
+	# project the whole file in one call
+	navigation = np.asarray(navigation, dtype=np.float64)
+	eastings, northings = geo.convertToGrid(navigation[:,longitudeIDX], navigation[:,latitudeIDX])
+
 	# create the trackline shape file
-	for update in navigation:
-		x,y = geo.convertToGrid(update[longitudeIDX],update[latitudeIDX])
-		# linestring.append(x)
-		# linestring.append(y)
-		# lastTimeStamp = update[0]
-		# recDate = from_timestamp(navigation[0][timeIDX]).strftime("%Y%m%d")
-	
+	for update, x, y in zip(navigation, eastings, northings):
+
 		###########################
 		# write out the FIELDS data
 		###########################
-
-		# write out the FIELDS data
 		fielddata = []
-		fielddata += setssdmarchivefields() # 2 fields
-		fielddata += setssdmobjectfields() # 4 fields
-
-		fielddata.append(ssdmfieldvalue.readvalue("LINE_ID"))
-		#LINE_NAME
-		fielddata.append(os.path.basename(filename))
-		#LAST_SEIS_PT_ID
-		fielddata.append(int(navigation[-1][timeIDX]))
-		#SYMBOLOGY_CODE
-		fielddata.append(ssdmfieldvalue.readvalue("TRACK_SYMBOLOGY_CODE"))
-		#DATA_SOURCE
-		fielddata.append(os.path.basename(filename))
-		#CONTRACTOR_NAME
-		fielddata.append(ssdmfieldvalue.readvalue("CONTRACTOR_NAME"))
-		#LINE_LENGTH
-		fielddata.append(totalDistanceRun)
-		#FIRST_SEIS_PT_ID
-		fielddata.append(int(navigation[0][timeIDX]))
-		#HIRES_SEISMIC_EQL_URL
-		fielddata.append(ssdmfieldvalue.readvalue("HIRES_SEISMIC_EQL_URL"))
-		#OTHER_DATA_URL
-		fielddata.append(ssdmfieldvalue.readvalue("OTHER_DATA_URL"))
-		# #HIRES_SEISMIC_RAP_URL
-		# fielddata.append(ssdmfieldvalue.readvalue("HIRES_SEISMIC_RAP_URL"))
-		#LAYER
-		fielddata.append(ssdmfieldvalue.readvalue("TRACK_LAYER"))
-		#SHAPE_Length
-		fielddata.append(totalDistanceRun)
-
+		fielddata += archivefields
+		fielddata += setssdmobjectfields(objectvalues) # 5 fields
+		fielddata += linefields
 
 		##################################################
 		# fields.append(["SurveyTime", 			"TEXT"])
@@ -956,9 +894,8 @@ def createTrackPoint(filename, navigation, pointtable, step, geo, surveyname="")
 	pointtable.close()
 
 ###############################################################################
-def createTrackLine(filename, navigation, linestringtable, step, geo, surveyname=""):
+def createTrackLine(filename, navigation, linestringtable, step, geo, surveyname="", tolerance=0.0):
 	#verified April 2021
-	lastTimeStamp = 0
 	linestring = []
 
 	timeIDX				= 0
@@ -981,28 +918,24 @@ def createTrackLine(filename, navigation, linestringtable, step, geo, surveyname
 			return
 	except:
 		return
-	prevX =  navigation[0][longitudeIDX]
-	prevY = navigation[0][latitudeIDX]
-
-	for update in navigation:
-		distance = geodetic.est_dist(update[latitudeIDX], update[longitudeIDX], prevY, prevX)
-		totalDistanceRun += distance
-		prevX = update[longitudeIDX]
-		prevY = update[latitudeIDX]
+	navigation = np.asarray(navigation, dtype=np.float64)
+	# the length of every segment and the cumulative length along the track
+	distances = geodetic.est_dist_array(navigation[1:,latitudeIDX], navigation[1:,longitudeIDX], navigation[:-1,latitudeIDX], navigation[:-1,longitudeIDX])
+	cumulativedistance = np.concatenate(([0.0], np.cumsum(distances)))
+	totalDistanceRun = float(cumulativedistance[-1])
 
 	# compute the brg1 line heading
 	# distance, brg1, brg2 = geodetic.calculateRangeBearingFromGeographicals(navigation[0][1], navigation[0][2], navigation[-1][1], navigation[-1][2])
 	# create the trackline shape file
-	for update in navigation:
-		if update[0] - lastTimeStamp >= step:
-			x,y = geo.convertToGrid(update[longitudeIDX],update[latitudeIDX])
-			linestring.append(x)
-			linestring.append(y)
-			lastTimeStamp = update[0]
-	# now add the very last update
-	x,y = geo.convertToGrid(float(navigation[-1][longitudeIDX]),float(navigation[-1][latitudeIDX]))
-	linestring.append(x)
-	linestring.append(y)
+	keep = decimationmask(navigation[:,timeIDX], step)
+	# project the decimated track in one call
+	x,y = geo.convertToGrid(navigation[keep, longitudeIDX], navigation[keep, latitudeIDX])
+	# simplify the shape of the line.  the line length comes from the full navigation so it is not affected
+	if tolerance > 0:
+		simplified = geodetic.douglaspeucker(x, y, tolerance)
+		x = np.asarray(x)[simplified]
+		y = np.asarray(y)[simplified]
+	linestring = np.column_stack((x, y)).ravel().tolist()
 	# print("Points added to track: %d" % (len(line)))
 	# now add to the table.
 	recDate = from_timestamp(navigation[0][timeIDX]).strftime("%Y%m%d")
@@ -1012,33 +945,34 @@ def createTrackLine(filename, navigation, linestringtable, step, geo, surveyname
 	###########################
 
 	# write out the FIELDS data
+	lineid, symbologycode, contractorname, eqlurl, otherurl, rapurl, layer = ssdmfieldvalue.readvalues(["LINE_ID", "TRACK_SYMBOLOGY_CODE", "CONTRACTOR_NAME", "HIRES_SEISMIC_EQL_URL", "OTHER_DATA_URL", "HIRES_SEISMIC_RAP_URL", "TRACK_LAYER"])
 	fielddata = []
 	fielddata += setssdmarchivefields() # 2 fields
-	fielddata += setssdmobjectfields() # 4 fields
+	fielddata += setssdmobjectfields() # 5 fields
 
-	fielddata.append(ssdmfieldvalue.readvalue("LINE_ID"))
+	fielddata.append(lineid)
 	#LINE_NAME
 	fielddata.append(os.path.basename(filename))
 	#LAST_SEIS_PT_ID
 	fielddata.append(int(navigation[-1][timeIDX]))
 	#SYMBOLOGY_CODE
-	fielddata.append(ssdmfieldvalue.readvalue("TRACK_SYMBOLOGY_CODE"))
+	fielddata.append(symbologycode)
 	#DATA_SOURCE
 	fielddata.append(os.path.basename(filename))
 	#CONTRACTOR_NAME
-	fielddata.append(ssdmfieldvalue.readvalue("CONTRACTOR_NAME"))
+	fielddata.append(contractorname)
 	#LINE_LENGTH
 	fielddata.append(totalDistanceRun)
 	#FIRST_SEIS_PT_ID
 	fielddata.append(int(navigation[0][timeIDX]))
 	#HIRES_SEISMIC_EQL_URL
-	fielddata.append(ssdmfieldvalue.readvalue("HIRES_SEISMIC_EQL_URL"))
+	fielddata.append(eqlurl)
 	#OTHER_DATA_URL
-	fielddata.append(ssdmfieldvalue.readvalue("OTHER_DATA_URL"))
+	fielddata.append(otherurl)
 	#HIRES_SEISMIC_RAP_URL
-	fielddata.append(ssdmfieldvalue.readvalue("HIRES_SEISMIC_RAP_URL"))
+	fielddata.append(rapurl)
 	#LAYER
-	fielddata.append(ssdmfieldvalue.readvalue("TRACK_LAYER"))
+	fielddata.append(layer)
 	#SHAPE_Length
 	fielddata.append(totalDistanceRun)
 
@@ -1054,15 +988,21 @@ def setssdmarchivefields():
 	return fields
 
 ###############################################################################
-def setssdmobjectfields():
+def getssdmobjectvalues():
+	'''the SSDM object fields which are the same for every feature'''
+	return ssdmfieldvalue.readvalues(['survey_id', 'survey_id_ref', 'remarks'])
+
+###############################################################################
+def setssdmobjectfields(objectvalues=None):
+	'''the SSDM object fields.  pass in getssdmobjectvalues() when creating many features so we do not look them up every time'''
 	# featureid 		= 0
 
 	# featureid 		= uuid.UUID()
+	if objectvalues is None:
+		objectvalues = getssdmobjectvalues()
 	objectid 		= None
 	featureid 		= str(uuid.uuid4())
-	surveyid 		= ssdmfieldvalue.readvalue('survey_id')
-	surveyidref 	= ssdmfieldvalue.readvalue('survey_id_ref')
-	remarks 		= ssdmfieldvalue.readvalue('remarks')
+	surveyid, surveyidref, remarks = objectvalues
 	
 	fields = []
 	fields.append(objectid)
@@ -1077,6 +1017,11 @@ def createsurveyplan(reader, table, geo):
 	'''read a survey.mp file and create a SSDM geopackage'''
 	totalDistanceRun = 0
 
+	# the SSDM fields which are the same for every line are looked up once
+	surveyname 		= ssdmfieldvalue.readvalue("SURVEY_NAME")
+	archivefields 	= setssdmarchivefields()
+	objectvalues 	= getssdmobjectvalues()
+
 	for surveyLine in reader.surveylines:
 		line = []
 		distance = 0
@@ -1092,8 +1037,7 @@ def createsurveyplan(reader, table, geo):
 		# distance += geodetic.est_dist(wpt.latitude, wpt.longitude, prevY, prevX)
 		# prevX = wpt.longitude
 		# prevY = wpt.latitude
-			
-		surveyname 		= ssdmfieldvalue.readvalue("SURVEY_NAME")
+
 		lineprefix 		= linename
 		# linename 		= surveyname[:20]
 		# heading 		= 0
@@ -1108,8 +1052,8 @@ def createsurveyplan(reader, table, geo):
 
 		# write out the FIELDS data
 		fielddata = []
-		fielddata += setssdmarchivefields()
-		fielddata += setssdmobjectfields()
+		fielddata += archivefields
+		fielddata += setssdmobjectfields(objectvalues)
 
 		fielddata.append(surveyname)
 		fielddata.append(lineprefix)